@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+
+"""
+Decides whether a for loop could run as a parallel for. The Resolver
+analyses every loop it resolves, and nebbdyr.py --auto-parallel runs the
+loops which passed in parallel.
+
+The iterations of a loop are independent when its body only assigns the
+variables it declares itself, adds to or multiplies a variable declared
+outside of it, as in s := s + x, which becomes a reduction, and stores
+into lists declared outside of it at the loop variable, as in
+a[i] := x, which every iteration does at an index of its own. The
+functions it calls must be core functions without side effects, or
+functions declared before the loop which don't assign variables declared
+outside of them or store into lists they didn't make. Anything else
+keeps the loop serial, and --parallel-report tells why.
+
+Variables are told apart by name, so a list stored into through one
+name and read through another is not noticed.
+"""
+
+from expression import Expr, Stmt
+from expr import Binary, Call, Lambda, List, Variable
+from stmt import Class, For, Function, Unstable
+from tokentype import TokenType as TT
+
+# The core functions which only compute their result
+PURE = {"list", "tostring", "tonumber", "len", "array", "sum", "min", "max",
+        "mean", "matmul", "shape", "reshape"}
+
+# What a local of the loop or of a function called by it holds
+VALUE = "value"
+FUNCTION = "function"
+# A list made where it was declared, which the scope may store into
+FRESH = "fresh"
+
+
+class Serial(Exception):
+    """ Raised with the reason a loop has to run serially """
+    def __init__(self, reason):
+        super(Serial, self).__init__(reason)
+        self.reason = reason
+
+
+class Errors:
+    """ Stands in for Nebbdyr while resolving the parallel version of a loop """
+    def __init__(self):
+        self.messages = []
+
+    def error(self, origin, message):
+        self.messages.append(message)
+
+    def runtime_error(self, error):
+        self.messages.append(error.msg)
+
+
+class Analysis:
+    """
+    Walks the body of a loop, or of a function it calls, collecting the
+    reductions, stores and outer variables it reads
+    """
+    def __init__(self, declaration, loop=None, parameters=(), scope=None,
+                 checked=None):
+        # Finds the function or class declaring a name outside of the body
+        # and the index of its scope, see Resolver.declaration
+        self.declaration = declaration
+        self.loop = loop
+        # The index of the scope outer names are looked up from
+        self.scope = scope
+        # The names declared inside of the body by scope, the first one
+        # holding the loop variable or the parameters
+        first = [loop.name] if loop is not None else parameters
+        self.scopes = [{name.lexeme: VALUE for name in first}]
+        # The functions checked so far and the outer names they read
+        self.checked = {} if checked is None else checked
+        # The reduction variables by name, as (operator, name)
+        self.reductions = {}
+        # The lists stored into at the loop variable, by name
+        self.stores = {}
+        # The outer variables read other than as a[i] and s in s := s + x
+        self.reads = set()
+        # The number of loops and functions the walk is inside of
+        self.loops = 0
+        self.functions = 0
+
+    def analyse(self, body):
+        self.walk(body)
+        for name in self.reads:
+            if name in self.reductions:
+                raise Serial("It reads the reduction variable '{}'.".format(name))
+            if name in self.stores:
+                raise Serial("It reads '{}' at other indices than the loop variable.".format(name))
+        for name in self.stores:
+            if name in self.reductions:
+                raise Serial("It stores into the reduction variable '{}'.".format(name))
+        return self
+
+    def walk(self, node):
+        if isinstance(node, (list, tuple)):
+            for statement in node:
+                self.walk(statement)
+        elif node is not None:
+            node.accept(self)
+
+    # Scopes
+
+    def lookup(self, name):
+        """ What the body's local name holds, or None for outer names """
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return None
+
+    def declare(self, name, kind=VALUE):
+        self.scopes[-1][name.lexeme] = kind
+
+    def is_loop_variable(self, expr):
+        return (self.loop is not None and isinstance(expr, Variable) and
+                expr.name.lexeme == self.loop.name.lexeme and
+                not any(expr.name.lexeme in scope
+                        for scope in self.scopes[1:]))
+
+    def read(self, name):
+        if self.lookup(name.lexeme) is None:
+            self.reads.add(name.lexeme)
+
+    def function(self, parameters, body):
+        """ Walk the body of a function or lambda declared inside the body """
+        self.scopes.append({name.lexeme: VALUE for name in parameters})
+        loops = self.loops
+        self.loops = 0
+        self.functions += 1
+        self.walk(body)
+        self.functions -= 1
+        self.loops = loops
+        self.scopes.pop()
+
+    def check_call(self, callee):
+        if not isinstance(callee, Variable):
+            raise Serial("It calls a function which can not be named.")
+        name = callee.name.lexeme
+        kind = self.lookup(name)
+        if kind == FUNCTION:
+            return
+        if kind is not None:
+            raise Serial("It calls '{}', which is not known to be free of side effects.".format(name))
+        declaration, scope = self.declaration(name, self.scope)
+        if not isinstance(declaration, (Function, Class)):
+            if declaration is None and scope == 0 and name in PURE:
+                return
+            raise Serial("It calls '{}', which is not known to be free of side effects.".format(name))
+        if isinstance(declaration, Class):
+            # Classes have no initializers, so calling one makes an instance
+            return
+        self.reads |= self.check_function(declaration, scope)
+
+    def check_function(self, declaration, scope):
+        """ The outer names read by a function declared outside of the body """
+        if declaration in self.checked:
+            return self.checked[declaration]
+        # A recursive call reads what the function reads
+        self.checked[declaration] = set()
+        analysis = Analysis(self.declaration, parameters=declaration.parameters,
+                            scope=scope, checked=self.checked)
+        analysis.functions = 1
+        analysis.walk(declaration.body)
+        self.checked[declaration] = analysis.reads
+        return analysis.reads
+
+    # Statements
+
+    def visit_block_stmt(self, stmt):
+        self.scopes.append({})
+        self.walk(stmt.statements)
+        self.scopes.pop()
+
+    def visit_class_stmt(self, stmt):
+        raise Serial("It declares the class '{}'.".format(stmt.name.lexeme))
+
+    def visit_expression_stmt(self, stmt):
+        self.walk(stmt.expression)
+
+    def visit_function_stmt(self, stmt):
+        self.declare(stmt.name, FUNCTION)
+        self.function(stmt.parameters, stmt.body)
+
+    def visit_if_stmt(self, stmt):
+        self.walk(stmt.condition)
+        self.walk(stmt.then_branch)
+        self.walk(stmt.else_branch)
+
+    def visit_print_stmt(self, stmt):
+        self.walk(stmt.expression)
+
+    def visit_return_stmt(self, stmt):
+        if not self.functions:
+            raise Serial("It returns from the function.")
+        self.walk(stmt.value)
+
+    def visit_var_stmt(self, stmt):
+        self.walk(stmt.initializer)
+        initializer = stmt.initializer
+        if isinstance(initializer, Lambda):
+            kind = FUNCTION
+        elif isinstance(initializer, List) or (
+                isinstance(initializer, Call) and
+                isinstance(initializer.callee, Variable) and
+                initializer.callee.name.lexeme == "list" and
+                self.lookup("list") is None):
+            kind = FRESH
+        else:
+            kind = VALUE
+        self.declare(stmt.name, kind)
+
+    def visit_mut_stmt(self, stmt):
+        # Mutable variables may be assigned another list later
+        self.walk(stmt.initializer)
+        self.declare(stmt.name)
+
+    def visit_unstable_stmt(self, stmt):
+        self.walk(stmt.initializer)
+        self.declare(stmt.name)
+
+    def visit_while_stmt(self, stmt):
+        self.walk(stmt.condition)
+        self.loops += 1
+        self.walk(stmt.body)
+        self.loops -= 1
+
+    def visit_for_stmt(self, stmt):
+        self.walk(stmt.collection)
+        self.scopes.append({stmt.name.lexeme: VALUE})
+        self.loops += 1
+        self.walk(stmt.body)
+        self.loops -= 1
+        self.scopes.pop()
+
+    def visit_parallelfor_stmt(self, stmt):
+        raise Serial("It contains a parallel for.")
+
+    def visit_parallelregion_stmt(self, stmt):
+        raise Serial("It contains a parallel region.")
+
+    def visit_critical_stmt(self, stmt):
+        raise Serial("It contains a critical section.")
+
+    def visit_barrier_stmt(self, stmt):
+        raise Serial("It contains a barrier.")
+
+    def visit_break_stmt(self, stmt):
+        if not self.loops:
+            raise Serial("It breaks out of the loop.")
+
+    def visit_continue_stmt(self, stmt):
+        return
+
+    # Expressions
+
+    def visit_assign_expr(self, expr):
+        name = expr.name.lexeme
+        if self.lookup(name) is not None:
+            self.walk(expr.value)
+            return
+        value = expr.value
+        if (self.functions or not isinstance(value, Binary) or
+                value.operator.type not in (TT.PLUS, TT.STAR) or
+                not isinstance(value.left, Variable) or
+                value.left.name.lexeme != name):
+            raise Serial("It assigns '{}', which is declared outside of it.".format(name))
+        declaration, _ = self.declaration(name, self.scope)
+        if isinstance(declaration, Unstable):
+            raise Serial("It reduces '{}', which is not type stable, so it may become a float whose sum depends on the order of the iterations.".format(name))
+        operator, _ = self.reductions.setdefault(name,
+                                                 (value.operator, expr.name))
+        if operator.type != value.operator.type:
+            raise Serial("It both adds to and multiplies '{}'.".format(name))
+        self.walk(value.right)
+
+    def visit_binary_expr(self, expr):
+        self.walk(expr.left)
+        self.walk(expr.right)
+
+    def visit_call_expr(self, expr):
+        self.check_call(expr.callee)
+        self.walk(expr.callee)
+        self.walk(expr.arguments)
+
+    def visit_index_expr(self, expr):
+        collection = expr.collection
+        if (isinstance(collection, Variable) and len(expr.indicies) == 1 and
+                self.is_loop_variable(expr.indicies[0]) and
+                self.lookup(collection.name.lexeme) is None):
+            # Reads the element the iteration may store into
+            return
+        self.walk(collection)
+        self.walk(expr.indicies)
+
+    def visit_setindex_expr(self, expr):
+        self.walk(expr.index)
+        self.walk(expr.value)
+        collection = expr.collection
+        if not isinstance(collection, Variable):
+            raise Serial("It stores into a list it can not name.")
+        name = collection.name.lexeme
+        kind = self.lookup(name)
+        if kind == FRESH:
+            self.walk(collection)
+            return
+        if kind is None and not self.functions and self.is_loop_variable(expr.index):
+            self.stores[name] = collection.name
+            return
+        raise Serial("It stores into '{}' at another index than the loop variable.".format(name))
+
+    def visit_spawn_expr(self, expr):
+        raise Serial("It spawns a call.")
+
+    def visit_slice_expr(self, expr):
+        self.walk(expr.collection)
+        self.walk(expr.start)
+        self.walk(expr.stop)
+
+    def visit_get_expr(self, expr):
+        self.walk(expr.object)
+
+    def visit_grouping_expr(self, expr):
+        self.walk(expr.expression)
+
+    def visit_literal_expr(self, expr):
+        return
+
+    def visit_logical_expr(self, expr):
+        self.walk(expr.left)
+        self.walk(expr.right)
+
+    def visit_set_expr(self, expr):
+        raise Serial("It assigns the field '{}'.".format(expr.name.lexeme))
+
+    def visit_listconstructor_expr(self, expr):
+        self.walk(expr.start)
+        self.walk(expr.next)
+        self.walk(expr.stop)
+
+    def visit_unary_expr(self, expr):
+        if expr.operator.type in (TT.PLUSPLUS, TT.MINUSMINUS):
+            name = expr.right.name.lexeme
+            if self.lookup(name) is None:
+                raise Serial("It assigns '{}', which is declared outside of it.".format(name))
+        self.walk(expr.right)
+
+    def visit_variable_expr(self, expr):
+        self.read(expr.name)
+
+    def visit_list_expr(self, expr):
+        self.walk(expr.expression)
+
+    def visit_lambda_expr(self, expr):
+        self.function(expr.parameters, expr.body)
+
+
+def analyse(loop, declaration):
+    """
+    The reductions, as (operator, name), and the names of the lists
+    stored into of a loop which could run in parallel. Raises Serial
+    otherwise.
+    """
+    analysis = Analysis(declaration, loop).analyse(loop.body)
+    return list(analysis.reductions.values()), list(analysis.stores.values())
+
+
+def loops(node):
+    """ The for loops of a program, in the order they are written """
+    if isinstance(node, (list, tuple)):
+        for child in node:
+            yield from loops(child)
+    elif isinstance(node, (Expr, Stmt)):
+        if isinstance(node, For):
+            yield node
+        # Every node keeps its children in its attributes, and the
+        # parallel version of a loop is a copy of it
+        for name, value in vars(node).items():
+            if name != 'parallel':
+                yield from loops(value)
+
+
+def report(statements):
+    """ Describe which loops could run in parallel, and why the others can't """
+    lines = []
+    for loop in loops(statements):
+        where = "[line {}] The for loop over {}".format(loop.keyword.line,
+                                                       loop.name.lexeme)
+        if loop.parallel is None:
+            lines.append("{} is serial. {}".format(where, loop.serial))
+        elif loop.parallel.reductions:
+            reductions = ", ".join(operator.lexeme + " " + name.lexeme
+                                   for operator, name in loop.parallel.reductions)
+            lines.append("{} can run in parallel with reduce({}).".format(
+                where, reductions))
+        else:
+            lines.append("{} can run in parallel.".format(where))
+    return lines
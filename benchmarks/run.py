@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Times the scripts in this directory with every backend.
+
+Each script is run in a fresh interpreter and the best of a few runs is
+reported, so the numbers include start up but not the noise of a single
+run. With --memory the peak resident memory of the runs is reported
+instead, and with --limit the script fails when a run needs more, so
+
+    benchmarks/run.py --memory --limit 64 benchmarks/closures.nebb
+
+checks that closures still free what they do not read.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+NEBBDYR = os.path.join(DIRECTORY, os.pardir, "nebbdyr.py")
+BACKENDS = ["tree", "closure", "vm"]
+
+
+def best_time(script, arguments, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, NEBBDYR] + arguments + [script],
+                       stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def peak_memory(script, arguments, repeat):
+    """ The largest peak resident memory of the runs, in megabytes """
+    peaks = []
+    for _ in range(repeat):
+        process = subprocess.Popen([sys.executable, NEBBDYR] + arguments +
+                                   [script], stdout=subprocess.DEVNULL)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode,
+                                                process.args)
+        # ru_maxrss is in kilobytes on Linux
+        peaks.append(usage.ru_maxrss / 1024)
+    return max(peaks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scripts', nargs='*',
+                        help="The scripts to time. Defaults to all of them.")
+    parser.add_argument('--backend', action='append', choices=BACKENDS,
+                        help="A backend to time. Defaults to all of them.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--memory', action='store_true',
+                        help="Report the peak memory of the runs instead "
+                        "of their time.")
+    parser.add_argument('--limit', type=float, default=None,
+                        metavar='MEGABYTES',
+                        help="Fail when the peak memory of a run is above "
+                        "this. Implies --memory.")
+    parser.add_argument('--options', default='',
+                        help="Further options to nebbdyr.py, like "
+                        "--options='--tier 5'.")
+    args = parser.parse_args()
+
+    scripts = args.scripts or sorted(
+        os.path.join(DIRECTORY, name) for name in os.listdir(DIRECTORY)
+        if name.endswith(".nebb"))
+    backends = args.backend or BACKENDS
+    extra = args.options.split()
+    if args.limit is not None:
+        args.memory = True
+    exceeded = []
+
+    print("{:<20}".format("script") +
+          "".join("{:>10}".format(backend) for backend in backends))
+    for script in scripts:
+        row = "{:<20}".format(os.path.basename(script))
+        for backend in backends:
+            arguments = ["--backend", backend] + extra
+            if args.memory:
+                megabytes = peak_memory(script, arguments, args.repeat)
+                row += "{:>8.0f}MB".format(megabytes)
+                if args.limit is not None and megabytes > args.limit:
+                    exceeded.append("{} with {}".format(
+                        os.path.basename(script), backend))
+            else:
+                seconds = best_time(script, arguments, args.repeat)
+                row += "{:>9.2f}s".format(seconds)
+        print(row)
+    if exceeded:
+        sys.exit("Above {:.0f}MB: {}".format(args.limit, ", ".join(exceeded)))
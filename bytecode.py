@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""
+The instruction set of the Nebbdyr virtual machine.
+
+A compiled function is a Code object. Its instructions are stored in a
+flat list of integers where every instruction takes two entries, the
+opcode followed by its argument. The token used to report runtime errors
+for an instruction is kept in a parallel list.
+"""
+
+from enum import Enum
+
+# Constants and the value stack
+CONSTANT = 0
+POP = 1
+
+# Variables
+GET_LOCAL = 2
+SET_LOCAL = 3
+DEFINE_LOCAL = 4
+INIT_LOCAL = 5
+GET_CELL = 6
+SET_CELL = 7
+DEFINE_CELL = 8
+INIT_CELL = 9
+GET_UPVALUE = 10
+SET_UPVALUE = 11
+GET_GLOBAL = 12
+SET_GLOBAL = 13
+DEFINE_GLOBAL = 14
+BOX = 15
+NOP = 16
+
+# Operators
+ADD = 17
+SUBTRACT = 18
+MULTIPLY = 19
+DIVIDE = 20
+POWER = 21
+GREATER = 22
+GREATER_EQUAL = 23
+LESS = 24
+LESS_EQUAL = 25
+EQUAL = 26
+NOT_EQUAL = 27
+NEGATE = 28
+NOT = 29
+CHECK_NUMBER = 30
+
+# Control flow
+JUMP = 31
+JUMP_IF_FALSE = 32
+JUMP_IF_FALSE_OR_POP = 33
+JUMP_IF_TRUE_OR_POP = 34
+CALL = 35
+RETURN = 36
+# A call followed by RETURN, reusing the frame when calling a Closure
+TAIL_CALL = 46
+
+# Objects
+CLOSURE = 37
+CLASS = 38
+GET_PROPERTY = 39
+SET_PROPERTY = 40
+BUILD_LIST = 41
+CHECK_BOUND = 42
+BUILD_RANGE = 43
+INDEX = 44
+PRINT = 45
+SLICE = 47
+PARALLEL = 48
+# Enters the critical section of the team with 0 and leaves it with 1
+CRITICAL = 49
+BARRIER = 50
+# Queues a call of the callee below its arguments on the executor
+SPAWN = 51
+STORE_INDEX = 52
+# Replaces the collection of a for loop with an iterator over it
+ITERATE = 53
+# Pops an iterator and pushes its next element, or jumps when it is done
+FOR_NEXT = 54
+# Runs the for loop below its stores, captures and reduction variables as
+# its parallel for, pushing the reduced values and True, or only False
+AUTO_PARALLEL = 55
+# Pushes whether the for loop over the collection on the stack may run as
+# NumPy operations
+VECTORIZABLE = 56
+# Runs the for loop below the values of its vector's names as NumPy
+# operations, pushing the values of its targets and True, or only False
+VECTOR = 57
+
+OPNAMES = {value: name for name, value in list(globals().items())
+           if name.isupper() and type(value) is int}
+
+# Instructions whose argument is an index into the constants
+HAS_CONSTANT = {CONSTANT, GET_GLOBAL, SET_GLOBAL, DEFINE_GLOBAL, CLOSURE,
+                CLASS, GET_PROPERTY, SET_PROPERTY, PARALLEL, AUTO_PARALLEL,
+                VECTOR}
+# Instructions whose argument is a local slot
+HAS_LOCAL = {GET_LOCAL, SET_LOCAL, DEFINE_LOCAL, INIT_LOCAL, GET_CELL,
+             SET_CELL, DEFINE_CELL, INIT_CELL, BOX}
+# Instructions whose argument is the target of a jump
+HAS_JUMP = {JUMP, JUMP_IF_FALSE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP,
+            FOR_NEXT}
+
+# The names of the list constructor bounds checked by CHECK_BOUND
+BOUNDS = ("Start", "Next", "Stop")
+
+# The kinds of variables, deciding how they may be assigned
+VAR = 0
+MUT = 1
+UNSTABLE = 2
+
+
+class Code:
+    """ A compiled function or script """
+    def __init__(self, name, parameters):
+        self.name = name
+        self.parameters = parameters
+        self.code = []
+        self.tokens = []
+        self.constants = []
+        self.constant_index = {}
+        # The name and kind of every local slot
+        self.local_names = []
+        self.local_kinds = []
+        # Where each captured variable is found when the closure is made,
+        # as (is_local, index, name)
+        self.captures = []
+        # The declaration of a function declared with memo
+        self.memo = None
+
+    def arity(self):
+        return len(self.parameters)
+
+    def emit(self, op, arg=0, token=None):
+        self.code.append(op)
+        self.code.append(arg)
+        self.tokens.append(token)
+        return len(self.code) - 2
+
+    def add_constant(self, value):
+        # Literals are shared by value, everything else by identity
+        if isinstance(value, (bool, int, float, str, type(None))):
+            key = (type(value), value)
+        else:
+            key = id(value)
+        if key not in self.constant_index:
+            self.constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return self.constant_index[key]
+
+    def __repr__(self):
+        return "<code {}>".format(self.name)
+
+
+def disassemble(code):
+    """ Return a human readable listing of code and its inner functions """
+    lines = ["== {} ==".format(code.name)]
+    inner = []
+    for offset in range(0, len(code.code), 2):
+        op, arg = code.code[offset], code.code[offset+1]
+        token = code.tokens[offset//2]
+        line = token.line if token is not None else ''
+        text = "{:04d} {:>4} {:<20} {:>4}".format(offset, line,
+                                                  OPNAMES[op], arg)
+        if op in HAS_CONSTANT:
+            constant = code.constants[arg]
+            if isinstance(constant, Code):
+                inner.append(constant)
+            text += "  ({})".format(describe(constant))
+        elif op in HAS_LOCAL:
+            text += "  ({})".format(code.local_names[arg].lexeme)
+        elif op == GET_UPVALUE or op == SET_UPVALUE:
+            text += "  ({})".format(code.captures[arg][2].lexeme)
+        elif op in HAS_JUMP:
+            text += "  (-> {:04d})".format(arg)
+        lines.append(text)
+
+    for function in inner:
+        lines.append('')
+        lines.append(disassemble(function))
+    return '\n'.join(lines)
+
+
+def describe(constant):
+    if isinstance(constant, tuple):
+        return ', '.join(describe(part) for part in constant)
+    if isinstance(constant, list):
+        return '[' + describe(tuple(constant)) + ']'
+    if isinstance(constant, Enum):
+        return constant.name
+    if hasattr(constant, 'lexeme'):
+        return constant.lexeme
+    return repr(constant)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-disk cache of resolved programs.
+
+A script is stored in the __nebbcache__ directory next to it after it
+has been scanned, parsed and resolved. The Resolver records its results
+on the nodes, so the pickled statements are all there is to store. The
+entry is keyed on a hash of the script and on the version of the front
+end, so a script or an interpreter that changes invalidates it. Entries
+which can't be read or written are ignored, as the cache is only an
+optimization.
+"""
+
+import hashlib
+import os
+import pickle
+
+CACHE_DIRECTORY = "__nebbcache__"
+SUFFIX = ".nebbc"
+
+# The modules deciding what a resolved program looks like
+FRONT_END = ["scanner.py", "parser.py", "resolver.py", "expr.py", "stmt.py",
+             "token.py", "tokentype.py", "environment.py", "attributes.py",
+             "nebbdyrinstance.py", "autoparallel.py", "vectorize.py",
+             "cache.py"]
+
+
+def front_end_version():
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in FRONT_END:
+        with open(os.path.join(directory, module), 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+VERSION = front_end_version()
+
+
+def source_hash(source):
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def cache_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, CACHE_DIRECTORY, name + SUFFIX)
+
+
+def load(path, source):
+    """ Return the cached statements of a script, or None """
+    try:
+        with open(cache_path(path), 'rb') as cached:
+            entry = pickle.load(cached)
+        if entry.get('version') != VERSION:
+            return None
+        if entry.get('source') != source_hash(source):
+            return None
+        return entry['statements']
+    except Exception:
+        # A corrupt entry, or one in an old format, is a miss and is
+        # replaced when the script is stored again
+        return None
+
+
+def store(path, source, statements):
+    """ Store a resolved script """
+    entry = {'version': VERSION,
+             'source': source_hash(source),
+             'statements': statements}
+    target = cache_path(path)
+    temporary = target + ".tmp{}".format(os.getpid())
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(temporary, 'wb') as cached:
+            pickle.dump(entry, cached, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, target)
+    except Exception:
+        # Scripts in read-only directories, or whose statements can't be
+        # pickled, are simply resolved every time
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return False
+    return True
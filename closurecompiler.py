@@ -0,0 +1,683 @@
+# -*- coding: utf-8 -*-
+
+from attributes import Attribute
+from environment import Environment, UNASSIGNED, capture, unassigned
+from errors import RuntimeException, IndexException
+from interpreter import Interpreter
+from nebbdyrfunction import NebbdyrFunction
+from nebbdyrclass import NebbdyrClass
+from nebbdyrinstance import NebbdyrInstance
+from tokentype import TokenType as TT
+from runtime import Completion, TailCall, BREAK, CONTINUE
+from stmt import Block
+import operator as op
+import parallel
+import runtime
+import vectorize
+
+
+NUMBERS = (int, float)
+
+# Operators with a fast path when both operands are plain numbers
+ARITHMETIC = {TT.MINUS: op.sub, TT.STAR: op.mul, TT.PLUS: op.add}
+COMPARISON = {TT.GREATER: op.gt, TT.GREATER_EQUAL: op.ge,
+              TT.LESS: op.lt, TT.LESS_EQUAL: op.le}
+
+
+def copy_function(function):
+    return function
+
+
+class CompiledFunction(NebbdyrFunction):
+    """ A function whose body has been compiled into a closure """
+    def __init__(self, declaration, closure, body, layout):
+        super(CompiledFunction, self).__init__(declaration, closure)
+        self.body = body
+        self.layout = layout
+
+    def __reduce__(self):
+        # The compiled body can't be pickled, so the workers of a parallel
+        # for get a function interpreting the declaration instead
+        function = NebbdyrFunction(self.declaration, self.closure)
+        function.memo = self.memo
+        return (copy_function, (function,))
+
+    def execute(self, interpreter, arguments):
+        environment = Environment(self.closure, self.layout)
+        for i, argument in enumerate(arguments):
+            environment.define(i, argument)
+        return self.body(environment)
+
+
+class ClosureCompiler:
+    """
+    Compiles a resolved AST into a tree of Python closures.
+
+    Every node is visited exactly once. The visit methods return a closure
+    taking the current environment, with the operator, the resolved
+    distance and the child closures bound when the closure is created.
+    Expression closures return their value, statement closures return
+    their Completion the same way as the Interpreter.
+    """
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.globals = interpreter.globals
+
+    def compile(self, node):
+        return node.accept(self)
+
+    def compile_block(self, statements):
+        if not isinstance(statements, list):
+            return self.compile(statements)
+
+        statements = tuple(self.compile(statement) for statement in statements)
+        if len(statements) == 1:
+            return statements[0]
+
+        def block(environment):
+            for statement in statements:
+                completion = statement(environment)
+                if completion is not None:
+                    return completion
+            return None
+        return block
+
+    def definition(self, stmt, attributes):
+        """ Return a function defining the variable declared by stmt """
+        slot = stmt.slot
+        if slot is None:
+            define = self.globals.define
+            name = stmt.name
+            return lambda environment, value: define(name, value, attributes)
+        return lambda environment, value: environment.define(slot, value)
+
+    def visit_block_stmt(self, stmt):
+        body = self.compile_block(stmt.statements)
+        layout = stmt.layout
+        if layout is None:
+            return body
+
+        def block(environment):
+            return body(Environment(environment, layout))
+        return block
+
+    def loop_body(self, body):
+        """
+        Return a function running a loop body, and the layout of the
+        environment it runs in for the whole loop, or None when it makes
+        its own, see Interpreter.loop_body
+        """
+        if (isinstance(body, Block) and body.layout is not None and
+                not body.captured):
+            return self.compile_block(body.statements), body.layout
+        return self.compile(body), None
+
+    def visit_class_stmt(self, stmt):
+        name = stmt.name
+        methods = [(method, self.compile_block(method.body),
+                    method.layout) for method in stmt.methods]
+        define = self.definition(stmt, [])
+
+        def klass(environment):
+            functions = {}
+            for method, body, layout in methods:
+                functions[method.name.lexeme] = CompiledFunction(
+                    method, capture(environment, method.captures), body,
+                    layout)
+            define(environment, NebbdyrClass(name.lexeme, functions))
+        return klass
+
+    def visit_expression_stmt(self, stmt):
+        expression = self.compile(stmt.expression)
+
+        def statement(environment):
+            expression(environment)
+        return statement
+
+    def visit_function_stmt(self, stmt):
+        body = self.compile_block(stmt.body)
+        layout = stmt.layout
+        captures = stmt.captures
+        define = self.definition(stmt, [Attribute.FUNCTION])
+
+        memo_for = self.interpreter.memo_for
+
+        def function(environment):
+            compiled = CompiledFunction(stmt, capture(environment, captures),
+                                        body, layout)
+            compiled.memo = memo_for(stmt)
+            define(environment, compiled)
+        return function
+
+    def visit_if_stmt(self, stmt):
+        condition = self.compile(stmt.condition)
+        then_branch = self.compile(stmt.then_branch)
+        is_truthy = runtime.is_truthy
+
+        if stmt.else_branch is None:
+            def if_then(environment):
+                if is_truthy(condition(environment)):
+                    return then_branch(environment)
+                return None
+            return if_then
+
+        else_branch = self.compile(stmt.else_branch)
+
+        def if_then_else(environment):
+            if is_truthy(condition(environment)):
+                return then_branch(environment)
+            return else_branch(environment)
+        return if_then_else
+
+    def visit_print_stmt(self, stmt):
+        expression = self.compile(stmt.expression)
+        stringify = runtime.stringify
+
+        def print_statement(environment):
+            print(stringify(expression(environment)))
+        return print_statement
+
+    def visit_return_stmt(self, stmt):
+        if stmt.value is None:
+            def return_none(environment):
+                return Completion(None)
+            return return_none
+
+        if stmt.tail:
+            call = self.compile_call(stmt.value)
+            interpreter = self.interpreter
+
+            def return_call(environment):
+                function, values = call(environment)
+                if isinstance(function, NebbdyrFunction):
+                    return TailCall(function, values)
+                return Completion(function.call(interpreter, values))
+            return return_call
+
+        value = self.compile(stmt.value)
+
+        def return_value(environment):
+            return Completion(value(environment))
+        return return_value
+
+    def declaration(self, stmt, attributes):
+        define = self.definition(stmt, attributes)
+        if stmt.initializer is None:
+            def declare(environment):
+                define(environment, None)
+            return declare
+
+        initializer = self.compile(stmt.initializer)
+
+        def declare_initialized(environment):
+            define(environment, initializer(environment))
+        return declare_initialized
+
+    def visit_var_stmt(self, stmt):
+        return self.declaration(stmt, [])
+
+    def visit_mut_stmt(self, stmt):
+        return self.declaration(stmt, [Attribute.MUTABLE])
+
+    def visit_unstable_stmt(self, stmt):
+        return self.declaration(stmt, [Attribute.UNSTABLE, Attribute.MUTABLE])
+
+    def visit_while_stmt(self, stmt):
+        condition = self.compile(stmt.condition)
+        body, body_layout = self.loop_body(stmt.body)
+        is_truthy = runtime.is_truthy
+
+        def loop(environment):
+            scope = environment
+            if body_layout is not None:
+                scope = Environment(environment, body_layout)
+            while is_truthy(condition(environment)):
+                completion = body(scope)
+                if completion is not None:
+                    if completion is BREAK:
+                        break
+                    if completion is not CONTINUE:
+                        return completion
+            return None
+        return loop
+
+    def visit_for_stmt(self, stmt):
+        collection = self.compile(stmt.collection)
+        body, body_layout = self.loop_body(stmt.body)
+        layout = stmt.layout
+        keyword = stmt.keyword
+        captured = stmt.captured
+        interpreter = self.interpreter
+        iterate = runtime.iterate
+        vector = self.compile_vector(stmt)
+        auto = self.compile_auto(stmt)
+
+        def loop(environment):
+            values = collection(environment)
+            if vector is not None and vector(environment, values):
+                return None
+            if auto is not None and auto(environment, values):
+                return None
+            scope = None
+            for value in iterate(keyword, values, interpreter):
+                # Functions in the body capture the variable of their
+                # iteration
+                if scope is None or captured:
+                    scope = inner = Environment(environment, layout)
+                    if body_layout is not None:
+                        inner = Environment(scope, body_layout)
+                scope.define(0, value)
+                completion = body(inner)
+                if completion is not None:
+                    if completion is BREAK:
+                        break
+                    if completion is not CONTINUE:
+                        return completion
+            return None
+        return loop
+
+    def compile_vector(self, stmt):
+        """
+        Return a function running a for loop as NumPy operations if it can,
+        returning whether it did, or None for loops which can't
+        """
+        vector = stmt.vector
+        if vector is None:
+            return None
+        variables = tuple(self.compile(variable)
+                          for variable in vector.variables)
+        assignments = tuple(self.assignment(target.name, target.depth,
+                                            target.slot)
+                            for target in vector.targets)
+        interpreter = self.interpreter
+        applies = vectorize.applies
+        run = vectorize.run
+
+        def vectorized(environment, collection):
+            if not (interpreter.vectorize and applies(collection)):
+                return False
+            values = run(vector, collection,
+                         [variable(environment) for variable in variables])
+            if values is None:
+                return False
+            interpreter.vectorized += 1
+            for assign, value in zip(assignments, values):
+                assign(environment, value)
+            return True
+        return vectorized
+
+    def compile_auto(self, stmt):
+        """
+        Return a function running a for loop as its parallel for if it can,
+        returning whether it did, or None for loops which can't
+        """
+        plan = stmt.parallel
+        if plan is None:
+            return None
+        stores = tuple(self.compile(store) for store in stmt.stores)
+        captures = tuple(self.compile(capture) for capture in plan.captures)
+        targets = tuple(self.compile(target) for target in plan.targets)
+        assignments = tuple(self.assignment(target.name, target.depth,
+                                            target.slot)
+                            for target in plan.targets)
+        interpreter = self.interpreter
+        run = parallel.auto
+
+        def auto(environment, collection):
+            if not interpreter.parallel.auto:
+                return False
+            values = run(interpreter, plan, collection,
+                         [store(environment) for store in stores],
+                         [capture(environment) for capture in captures],
+                         [target(environment) for target in targets])
+            if values is None:
+                return False
+            for assign, value in zip(assignments, values):
+                assign(environment, value)
+            return True
+        return auto
+
+    def visit_parallelfor_stmt(self, stmt):
+        return self.compile_parallel(stmt, self.compile(stmt.collection))
+
+    def visit_parallelregion_stmt(self, stmt):
+        return self.compile_parallel(stmt, lambda environment: None)
+
+    def compile_parallel(self, stmt, collection):
+        captures = tuple(self.compile(capture) for capture in stmt.captures)
+        targets = tuple(self.compile(target) for target in stmt.targets)
+        assignments = tuple(self.assignment(target.name, target.depth,
+                                            target.slot)
+                            for target in stmt.targets)
+        interpreter = self.interpreter
+        run = parallel.run
+
+        def parallel_for(environment):
+            values = run(interpreter, stmt, collection(environment),
+                         [capture(environment) for capture in captures],
+                         [target(environment) for target in targets])
+            for assign, value in zip(assignments, values):
+                assign(environment, value)
+            return None
+        return parallel_for
+
+    def visit_critical_stmt(self, stmt):
+        body = self.compile(stmt.body)
+        interpreter = self.interpreter
+
+        def critical(environment):
+            team = interpreter.team
+            team.enter()
+            try:
+                return body(environment)
+            finally:
+                team.exit()
+        return critical
+
+    def visit_barrier_stmt(self, stmt):
+        interpreter = self.interpreter
+        keyword = stmt.keyword
+        return lambda environment: interpreter.team.wait(keyword)
+
+    def visit_break_stmt(self, stmt):
+        return lambda environment: BREAK
+
+    def visit_continue_stmt(self, stmt):
+        return lambda environment: CONTINUE
+
+    def assignment(self, name, distance, slot):
+        """ Return a function storing a value in the resolved variable """
+        if distance is None:
+            assign = self.globals.assign
+            return lambda environment, value: assign(name, value)
+        return lambda environment, value: environment.assign_at(
+            distance, slot, name, value)
+
+    def visit_assign_expr(self, expr):
+        value = self.compile(expr.value)
+        assign = self.assignment(expr.name, expr.depth, expr.slot)
+
+        def assignment(environment):
+            result = value(environment)
+            assign(environment, result)
+            return result
+        return assignment
+
+    def visit_literal_expr(self, expr):
+        value = expr.value
+        return lambda environment: value
+
+    def visit_logical_expr(self, expr):
+        left = self.compile(expr.left)
+        right = self.compile(expr.right)
+        is_truthy = runtime.is_truthy
+
+        if expr.operator.type == TT.OR:
+            def logical_or(environment):
+                value = left(environment)
+                if is_truthy(value):
+                    return value
+                return right(environment)
+            return logical_or
+
+        def logical_and(environment):
+            value = left(environment)
+            if not is_truthy(value):
+                return value
+            return right(environment)
+        return logical_and
+
+    def visit_set_expr(self, expr):
+        object = self.compile(expr.object)
+        value = self.compile(expr.value)
+        name = expr.name
+
+        def set(environment):
+            instance = object(environment)
+            if not isinstance(instance, NebbdyrInstance):
+                raise RuntimeError(name, "Only instances have fields.")
+            instance.set(name, value(environment))
+        return set
+
+    def visit_grouping_expr(self, expr):
+        return self.compile(expr.expression)
+
+    def visit_unary_expr(self, expr):
+        right = self.compile(expr.right)
+        operator = expr.operator
+        check_number_operand = runtime.check_number_operand
+
+        if operator.type == TT.MINUS:
+            def negate(environment):
+                value = right(environment)
+                check_number_operand(operator, value)
+                return -value
+            return negate
+        elif operator.type == TT.BANG:
+            is_truthy = runtime.is_truthy
+            return lambda environment: not is_truthy(right(environment))
+
+        # Increment and decrement operators
+        step = 1 if operator.type == TT.PLUSPLUS else -1
+        assign = self.assignment(expr.right.name, expr.depth,
+                                 expr.slot)
+
+        def increment(environment):
+            value = right(environment)
+            check_number_operand(operator, value)
+            assign(environment, value + step)
+            return value + step
+        return increment
+
+    def visit_listconstructor_expr(self, expr):
+        token = expr.token
+        start = self.compile(expr.start)
+        next = self.compile(expr.next) if expr.next is not None else None
+        stop = self.compile(expr.stop)
+        range_bound = runtime.range_bound
+        construct_list = runtime.construct_list
+
+        def list_constructor(environment):
+            first = range_bound(token, start(environment), "Start")
+            second = None
+            if next is not None:
+                second = range_bound(token, next(environment), "Next")
+            last = range_bound(token, stop(environment), "Stop")
+            return construct_list(first, second, last)
+        return list_constructor
+
+    def visit_variable_expr(self, expr):
+        name = expr.name
+        distance = expr.depth
+        slot = expr.slot
+        if distance is None:
+            get = self.globals.get
+            return lambda environment: get(name)
+
+        if expr.cell:
+            return self.cell(name, distance, slot)
+
+        if distance == 0:
+            def local(environment):
+                value = environment.values[slot]
+                if value is UNASSIGNED:
+                    raise unassigned(name)
+                return value
+            return local
+
+        if distance == 1:
+            def enclosing(environment):
+                value = environment.enclosing.values[slot]
+                if value is UNASSIGNED:
+                    raise unassigned(name)
+                return value
+            return enclosing
+
+        return lambda environment: environment.get_at(distance, slot, name)
+
+    def cell(self, name, distance, slot):
+        """ Return a function reading a variable kept in a Cell """
+        if distance == 0:
+            def local_cell(environment):
+                value = environment.values[slot].value
+                if value is UNASSIGNED:
+                    raise unassigned(name)
+                return value
+            return local_cell
+
+        if distance == 1:
+            def enclosing_cell(environment):
+                value = environment.enclosing.values[slot].value
+                if value is UNASSIGNED:
+                    raise unassigned(name)
+                return value
+            return enclosing_cell
+
+        # get_at reads the value of the Cell
+        return lambda environment: environment.get_at(distance, slot, name)
+
+    def visit_list_expr(self, expr):
+        elements = tuple(self.compile(e) for e in expr.expression)
+        return lambda environment: [element(environment)
+                                    for element in elements]
+
+    def visit_binary_expr(self, expr):
+        left = self.compile(expr.left)
+        right = self.compile(expr.right)
+        operator = expr.operator
+        binary = runtime.BINARY[operator.type]
+
+        if operator.type in ARITHMETIC:
+            arithmetic = ARITHMETIC[operator.type]
+
+            def arithmetic_operation(environment):
+                a = left(environment)
+                b = right(environment)
+                if type(a) in NUMBERS and type(b) in NUMBERS:
+                    return arithmetic(a, b)
+                return binary(operator, a, b)
+            return arithmetic_operation
+
+        if operator.type in COMPARISON:
+            compare = COMPARISON[operator.type]
+
+            def comparison(environment):
+                a = left(environment)
+                b = right(environment)
+                if type(a) in NUMBERS and type(b) in NUMBERS:
+                    return b if compare(a, b) else False
+                return binary(operator, a, b)
+            return comparison
+
+        def binary_operation(environment):
+            return binary(operator, left(environment), right(environment))
+        return binary_operation
+
+    def visit_call_expr(self, expr):
+        evaluate = self.compile_call(expr)
+        paren = expr.paren
+        interpreter = self.interpreter
+        stack_overflow = runtime.stack_overflow
+
+        def call(environment):
+            function, values = evaluate(environment)
+            try:
+                return function.call(interpreter, values)
+            except RecursionError:
+                raise stack_overflow(paren)
+        return call
+
+    def visit_spawn_expr(self, expr):
+        evaluate = self.compile_call(expr.call)
+        interpreter = self.interpreter
+        keyword = expr.keyword
+        spawn = parallel.spawn
+
+        def spawned(environment):
+            function, values = evaluate(environment)
+            return spawn(interpreter, keyword, function, values)
+        return spawned
+
+    def compile_call(self, expr):
+        """ Return a function evaluating the callee and arguments of a call """
+        callee = self.compile(expr.callee)
+        arguments = tuple(self.compile(argument)
+                          for argument in expr.arguments)
+        paren = expr.paren
+        check_arity = runtime.check_arity
+
+        def evaluate(environment):
+            function = callee(environment)
+            values = [argument(environment) for argument in arguments]
+            check_arity(paren, function, values)
+            return function, values
+        return evaluate
+
+    def visit_index_expr(self, expr):
+        collection = self.compile(expr.collection)
+        indicies = tuple(self.compile(index) for index in expr.indicies)
+        paren = expr.paren
+        index = runtime.index
+
+        def indexation(environment):
+            value = collection(environment)
+            return index(paren, value, [i(environment) for i in indicies])
+        return indexation
+
+    def visit_setindex_expr(self, expr):
+        collection = self.compile(expr.collection)
+        index = self.compile(expr.index)
+        value = self.compile(expr.value)
+        paren = expr.paren
+        store = runtime.store
+
+        def assignment(environment):
+            return store(paren, collection(environment), index(environment),
+                         value(environment))
+        return assignment
+
+    def visit_slice_expr(self, expr):
+        collection = self.compile(expr.collection)
+        start = self.compile(expr.start)
+        stop = self.compile(expr.stop)
+        paren = expr.paren
+        view = runtime.view
+
+        def slice(environment):
+            value = collection(environment)
+            return view(paren, value, start(environment), stop(environment))
+        return slice
+
+    def visit_lambda_expr(self, expr):
+        body = self.compile_block(expr.body)
+        layout = expr.layout
+        captures = expr.captures
+        return lambda environment: CompiledFunction(
+            expr, capture(environment, captures), body, layout)
+
+    def visit_get_expr(self, expr):
+        object = self.compile(expr.object)
+        name = expr.name
+        cache = expr.cache
+        counters = self.interpreter.property_counters
+
+        def get(environment):
+            instance = object(environment)
+            if isinstance(instance, NebbdyrInstance):
+                return instance.get_cached(name, cache, counters)
+            raise RuntimeException(name, "Only instances have properties")
+        return get
+
+
+class ClosureInterpreter(Interpreter):
+    """ Executes programs by first compiling them with the ClosureCompiler """
+    def interpret(self, statements):
+        if not isinstance(statements, list):
+            statements = [statements]
+        program = ClosureCompiler(self).compile_block(statements)
+        try:
+            program(self.globals)
+        except RuntimeException as exc:
+            self.nebbdyr.runtime_error(exc)
+        except IndexException as exc:
+            self.nebbdyr.runtime_error(exc)
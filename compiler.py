@@ -0,0 +1,514 @@
+# -*- coding: utf-8 -*-
+
+from attributes import Attribute
+from bytecode import *
+from tokentype import TokenType as TT
+
+
+# The instruction replacing an access to a local once it is captured
+CAPTURED = {GET_LOCAL: GET_CELL, SET_LOCAL: SET_CELL,
+            DEFINE_LOCAL: DEFINE_CELL, INIT_LOCAL: INIT_CELL, NOP: BOX}
+
+ARITHMETIC = {TT.PLUS: ADD, TT.MINUS: SUBTRACT, TT.STAR: MULTIPLY,
+              TT.SLASH: DIVIDE, TT.HAT: POWER, TT.GREATER: GREATER,
+              TT.GREATER_EQUAL: GREATER_EQUAL, TT.LESS: LESS,
+              TT.LESS_EQUAL: LESS_EQUAL, TT.EQUAL: EQUAL,
+              TT.BANG_EQUAL: NOT_EQUAL}
+
+ATTRIBUTES = {VAR: [], MUT: [Attribute.MUTABLE],
+              UNSTABLE: [Attribute.UNSTABLE, Attribute.MUTABLE]}
+
+
+class Local:
+    """ A local variable of the function being compiled """
+    def __init__(self, name, slot, depth):
+        self.name = name
+        self.slot = slot
+        self.depth = depth
+        self.captured = False
+        # The offsets of every instruction accessing the variable
+        self.references = []
+
+
+class FunctionState:
+    """ The compiler's bookkeeping for a single function """
+    def __init__(self, code, enclosing):
+        self.code = code
+        self.enclosing = enclosing
+        self.locals = []
+        self.scope_depth = 0
+        # The start of the innermost loop and its pending breaks
+        self.loops = []
+
+
+class Compiler:
+    """
+    Compiles a resolved program into bytecode for the VM.
+
+    Every declaration gets its own slot in the frame of the function
+    declaring it. Top level declarations outside of blocks become globals.
+    A local captured by an inner function is kept in a cell, so the
+    instructions accessing it are patched once the capture is found.
+    """
+    def __init__(self):
+        self.function = None
+
+    def compile(self, statements, name="<script>"):
+        self.function = FunctionState(Code(name, []), None)
+        self.compile_statements(statements)
+        self.emit(CONSTANT, self.constant(None))
+        self.emit(RETURN)
+        return self.function.code
+
+    def compile_statements(self, statements):
+        if not isinstance(statements, list):
+            statements = [statements]
+        for statement in statements:
+            statement.accept(self)
+
+    def compile_function(self, declaration, name):
+        enclosing = self.function
+        code = Code(name, declaration.parameters)
+        if getattr(declaration, 'memo', None) is not None:
+            code.memo = declaration
+        self.function = FunctionState(code, enclosing)
+        self.function.scope_depth = 1
+
+        for parameter in declaration.parameters:
+            local = self.add_local(parameter, VAR)
+            # Boxes the argument in a cell if it is captured
+            local.references.append(self.emit(NOP, local.slot, parameter))
+
+        self.compile_statements(declaration.body)
+        self.emit(CONSTANT, self.constant(None))
+        self.emit(RETURN)
+
+        self.function = enclosing
+        self.emit(CLOSURE, self.constant(code))
+
+    def emit(self, op, arg=0, token=None):
+        return self.function.code.emit(op, arg, token)
+
+    def constant(self, value):
+        return self.function.code.add_constant(value)
+
+    def patch_jump(self, offset, target=None):
+        code = self.function.code.code
+        code[offset+1] = len(code) if target is None else target
+
+    def begin_scope(self):
+        self.function.scope_depth += 1
+
+    def end_scope(self):
+        self.function.scope_depth -= 1
+        locals = self.function.locals
+        while locals and locals[-1].depth > self.function.scope_depth:
+            locals.pop()
+
+    def is_global_scope(self):
+        return (self.function.enclosing is None and
+                self.function.scope_depth == 0)
+
+    # Variables
+
+    def add_local(self, name, kind):
+        code = self.function.code
+        local = Local(name, len(code.local_names), self.function.scope_depth)
+        code.local_names.append(name)
+        code.local_kinds.append(kind)
+        self.function.locals.append(local)
+        return local
+
+    def resolve_local(self, function, name):
+        for local in reversed(function.locals):
+            if local.name.lexeme == name.lexeme:
+                return local
+        return None
+
+    def resolve_upvalue(self, function, name):
+        if function.enclosing is None:
+            return None
+
+        local = self.resolve_local(function.enclosing, name)
+        if local is not None:
+            self.capture(function.enclosing, local)
+            return self.add_upvalue(function, True, local.slot, name)
+
+        upvalue = self.resolve_upvalue(function.enclosing, name)
+        if upvalue is not None:
+            return self.add_upvalue(function, False, upvalue, name)
+        return None
+
+    def add_upvalue(self, function, is_local, index, name):
+        captures = function.code.captures
+        for i, (local, other, _) in enumerate(captures):
+            if local == is_local and other == index:
+                return i
+        captures.append((is_local, index, name))
+        return len(captures) - 1
+
+    def capture(self, function, local):
+        if local.captured:
+            return
+        local.captured = True
+        code = function.code.code
+        for offset in local.references:
+            code[offset] = CAPTURED[code[offset]]
+
+    def access(self, name, local_op, cell_op, upvalue_op, global_op):
+        local = self.resolve_local(self.function, name)
+        if local is not None:
+            op = cell_op if local.captured else local_op
+            local.references.append(self.emit(op, local.slot, name))
+            return
+
+        upvalue = self.resolve_upvalue(self.function, name)
+        if upvalue is not None:
+            self.emit(upvalue_op, upvalue, name)
+        else:
+            self.emit(global_op, self.constant(name), name)
+
+    def get_variable(self, name):
+        self.access(name, GET_LOCAL, GET_CELL, GET_UPVALUE, GET_GLOBAL)
+
+    def set_variable(self, name):
+        self.access(name, SET_LOCAL, SET_CELL, SET_UPVALUE, SET_GLOBAL)
+
+    def declare(self, name, kind):
+        """ Emit a definition of name from the value on top of the stack """
+        if self.is_global_scope():
+            definition = self.constant((name, ATTRIBUTES[kind]))
+            self.emit(DEFINE_GLOBAL, definition, name)
+            return None
+        local = self.add_local(name, kind)
+        local.references.append(self.emit(DEFINE_LOCAL, local.slot, name))
+        return local
+
+    def declare_early(self, name):
+        """
+        Declare a function or class before its body is compiled, so it may
+        refer to itself. The value is stored with initialize.
+        """
+        self.emit(CONSTANT, self.constant(None))
+        return self.declare(name, VAR)
+
+    def initialize(self, name, local, attributes=None):
+        if local is None:
+            if attributes is None:
+                self.emit(SET_GLOBAL, self.constant(name), name)
+                self.emit(POP)
+            else:
+                definition = self.constant((name, attributes))
+                self.emit(DEFINE_GLOBAL, definition, name)
+            return
+        op = INIT_CELL if local.captured else INIT_LOCAL
+        local.references.append(self.emit(op, local.slot, name))
+
+    # Statements
+
+    def visit_block_stmt(self, stmt):
+        self.begin_scope()
+        self.compile_statements(stmt.statements)
+        self.end_scope()
+
+    def visit_class_stmt(self, stmt):
+        if self.is_global_scope():
+            # Mirror the Interpreter defining the class before its methods
+            self.emit(CONSTANT, self.constant(None))
+            self.emit(DEFINE_GLOBAL, self.constant((stmt.name, [])),
+                      stmt.name)
+            local = None
+        else:
+            local = self.declare_early(stmt.name)
+
+        for method in stmt.methods:
+            self.compile_function(method, method.name.lexeme)
+        self.emit(CLASS, self.constant((stmt.name, len(stmt.methods))),
+                  stmt.name)
+        self.initialize(stmt.name, local)
+
+    def visit_expression_stmt(self, stmt):
+        stmt.expression.accept(self)
+        self.emit(POP)
+
+    def visit_function_stmt(self, stmt):
+        if self.is_global_scope():
+            self.compile_function(stmt, stmt.name.lexeme)
+            self.initialize(stmt.name, None, [Attribute.FUNCTION])
+            return
+
+        local = self.declare_early(stmt.name)
+        self.compile_function(stmt, stmt.name.lexeme)
+        self.initialize(stmt.name, local)
+
+    def visit_if_stmt(self, stmt):
+        stmt.condition.accept(self)
+        then_jump = self.emit(JUMP_IF_FALSE)
+        stmt.then_branch.accept(self)
+
+        if stmt.else_branch is None:
+            self.patch_jump(then_jump)
+            return
+
+        else_jump = self.emit(JUMP)
+        self.patch_jump(then_jump)
+        stmt.else_branch.accept(self)
+        self.patch_jump(else_jump)
+
+    def visit_print_stmt(self, stmt):
+        stmt.expression.accept(self)
+        self.emit(PRINT)
+
+    def visit_return_stmt(self, stmt):
+        if stmt.value is None:
+            self.emit(CONSTANT, self.constant(None))
+        elif stmt.tail:
+            self.compile_call(stmt.value, TAIL_CALL)
+        else:
+            stmt.value.accept(self)
+        self.emit(RETURN, 0, stmt.keyword)
+
+    def declaration(self, stmt, kind):
+        if stmt.initializer is None:
+            self.emit(CONSTANT, self.constant(None))
+        else:
+            stmt.initializer.accept(self)
+        self.declare(stmt.name, kind)
+
+    def visit_var_stmt(self, stmt):
+        self.declaration(stmt, VAR)
+
+    def visit_mut_stmt(self, stmt):
+        self.declaration(stmt, MUT)
+
+    def visit_unstable_stmt(self, stmt):
+        self.declaration(stmt, UNSTABLE)
+
+    def visit_while_stmt(self, stmt):
+        start = len(self.function.code.code)
+        stmt.condition.accept(self)
+        exit_jump = self.emit(JUMP_IF_FALSE)
+
+        self.function.loops.append((start, []))
+        stmt.body.accept(self)
+        _, breaks = self.function.loops.pop()
+        self.emit(JUMP, start)
+
+        self.patch_jump(exit_jump)
+        for offset in breaks:
+            self.patch_jump(offset)
+
+    def visit_for_stmt(self, stmt):
+        stmt.collection.accept(self)
+        end_jumps = []
+        if stmt.vector is not None:
+            end_jumps.append(self.compile_vector(stmt))
+        if stmt.parallel is not None:
+            end_jumps.append(self.compile_auto(stmt))
+
+        # The iterator is kept in a local named by the keyword, which no
+        # variable can be named
+        self.emit(ITERATE, 0, stmt.keyword)
+        self.begin_scope()
+        self.declare(stmt.keyword, VAR)
+        start = len(self.function.code.code)
+        self.get_variable(stmt.keyword)
+        exit_jump = self.emit(FOR_NEXT, 0, stmt.keyword)
+
+        self.function.loops.append((start, []))
+        self.begin_scope()
+        self.declare(stmt.name, VAR)
+        stmt.body.accept(self)
+        self.end_scope()
+        _, breaks = self.function.loops.pop()
+        self.emit(JUMP, start)
+
+        self.patch_jump(exit_jump)
+        for offset in breaks:
+            self.patch_jump(offset)
+        self.end_scope()
+        for offset in end_jumps:
+            self.patch_jump(offset)
+
+    def compile_vector(self, stmt):
+        """
+        Run the loop as NumPy operations if it can, leaving the collection
+        for the other loops otherwise. Returns the jump past them.
+        """
+        vector = stmt.vector
+        self.emit(VECTORIZABLE, 0, stmt.keyword)
+        skip_jump = self.emit(JUMP_IF_FALSE)
+        for variable in vector.variables:
+            variable.accept(self)
+        self.emit(VECTOR, self.constant(stmt), stmt.keyword)
+        serial_jump = self.emit(JUMP_IF_FALSE)
+        for target in reversed(vector.targets):
+            self.set_variable(target.name)
+            self.emit(POP)
+        self.emit(POP)
+        end_jump = self.emit(JUMP)
+        self.patch_jump(skip_jump)
+        self.patch_jump(serial_jump)
+        return end_jump
+
+    def compile_auto(self, stmt):
+        """
+        Run the loop as its parallel for if it can, leaving the collection
+        for the serial loop otherwise. Returns the jump past the serial loop.
+        """
+        plan = stmt.parallel
+        for store in stmt.stores:
+            store.accept(self)
+        for capture in plan.captures:
+            capture.accept(self)
+        for target in plan.targets:
+            target.accept(self)
+        self.emit(AUTO_PARALLEL, self.constant(stmt), stmt.keyword)
+        serial_jump = self.emit(JUMP_IF_FALSE)
+        for target in reversed(plan.targets):
+            self.set_variable(target.name)
+            self.emit(POP)
+        self.emit(POP)
+        end_jump = self.emit(JUMP)
+        self.patch_jump(serial_jump)
+        return end_jump
+
+    def visit_break_stmt(self, stmt):
+        _, breaks = self.function.loops[-1]
+        breaks.append(self.emit(JUMP))
+
+    def visit_continue_stmt(self, stmt):
+        start, _ = self.function.loops[-1]
+        self.emit(JUMP, start)
+
+    # Expressions
+
+    def visit_parallelfor_stmt(self, stmt):
+        stmt.collection.accept(self)
+        self.compile_parallel(stmt)
+
+    def visit_parallelregion_stmt(self, stmt):
+        # A region has no collection
+        self.emit(CONSTANT, self.constant(None))
+        self.compile_parallel(stmt)
+
+    def compile_parallel(self, stmt):
+        for capture in stmt.captures:
+            capture.accept(self)
+        for target in stmt.targets:
+            target.accept(self)
+        # Leaves the reduced values on the stack
+        self.emit(PARALLEL, self.constant(stmt), stmt.keyword)
+        for target in reversed(stmt.targets):
+            self.set_variable(target.name)
+            self.emit(POP)
+
+    def visit_critical_stmt(self, stmt):
+        # Break, continue and return can't leave the body, so the section
+        # is left at the end of it, or by VM.execute when an error does
+        self.emit(CRITICAL, 0, stmt.keyword)
+        stmt.body.accept(self)
+        self.emit(CRITICAL, 1, stmt.keyword)
+
+    def visit_barrier_stmt(self, stmt):
+        self.emit(BARRIER, 0, stmt.keyword)
+
+    def visit_assign_expr(self, expr):
+        expr.value.accept(self)
+        self.set_variable(expr.name)
+
+    def visit_binary_expr(self, expr):
+        expr.left.accept(self)
+        expr.right.accept(self)
+        self.emit(ARITHMETIC[expr.operator.type], 0, expr.operator)
+
+    def visit_call_expr(self, expr):
+        self.compile_call(expr, CALL)
+
+    def visit_spawn_expr(self, expr):
+        self.compile_call(expr.call, SPAWN)
+
+    def compile_call(self, expr, op):
+        expr.callee.accept(self)
+        for argument in expr.arguments:
+            argument.accept(self)
+        self.emit(op, len(expr.arguments), expr.paren)
+
+    def visit_index_expr(self, expr):
+        expr.collection.accept(self)
+        for index in expr.indicies:
+            index.accept(self)
+        self.emit(INDEX, len(expr.indicies), expr.paren)
+
+    def visit_setindex_expr(self, expr):
+        expr.collection.accept(self)
+        expr.index.accept(self)
+        expr.value.accept(self)
+        self.emit(STORE_INDEX, 0, expr.paren)
+
+    def visit_slice_expr(self, expr):
+        expr.collection.accept(self)
+        expr.start.accept(self)
+        expr.stop.accept(self)
+        self.emit(SLICE, 0, expr.paren)
+
+    def visit_get_expr(self, expr):
+        expr.object.accept(self)
+        self.emit(GET_PROPERTY, self.constant((expr.name, expr.cache)),
+                  expr.name)
+
+    def visit_grouping_expr(self, expr):
+        expr.expression.accept(self)
+
+    def visit_literal_expr(self, expr):
+        self.emit(CONSTANT, self.constant(expr.value))
+
+    def visit_logical_expr(self, expr):
+        expr.left.accept(self)
+        if expr.operator.type == TT.OR:
+            jump = self.emit(JUMP_IF_TRUE_OR_POP)
+        else:
+            jump = self.emit(JUMP_IF_FALSE_OR_POP)
+        expr.right.accept(self)
+        self.patch_jump(jump)
+
+    def visit_set_expr(self, expr):
+        expr.object.accept(self)
+        expr.value.accept(self)
+        self.emit(SET_PROPERTY, self.constant(expr.name), expr.name)
+
+    def visit_listconstructor_expr(self, expr):
+        expr.start.accept(self)
+        self.emit(CHECK_BOUND, 0, expr.token)
+        if expr.next is not None:
+            expr.next.accept(self)
+            self.emit(CHECK_BOUND, 1, expr.token)
+        expr.stop.accept(self)
+        self.emit(CHECK_BOUND, 2, expr.token)
+        self.emit(BUILD_RANGE, 0 if expr.next is None else 1, expr.token)
+
+    def visit_unary_expr(self, expr):
+        expr.right.accept(self)
+        operator = expr.operator
+        if operator.type == TT.MINUS:
+            self.emit(NEGATE, 0, operator)
+        elif operator.type == TT.BANG:
+            self.emit(NOT)
+        else:
+            # Increment and decrement
+            self.emit(CHECK_NUMBER, 0, operator)
+            self.emit(CONSTANT, self.constant(1))
+            self.emit(ADD if operator.type == TT.PLUSPLUS else SUBTRACT,
+                      0, operator)
+            self.set_variable(expr.right.name)
+
+    def visit_variable_expr(self, expr):
+        self.get_variable(expr.name)
+
+    def visit_list_expr(self, expr):
+        for element in expr.expression:
+            element.accept(self)
+        self.emit(BUILD_LIST, len(expr.expression))
+
+    def visit_lambda_expr(self, expr):
+        self.compile_function(expr, "<lambda>")
@@ -5,6 +5,40 @@ from attributes import Attribute
 from nebbtypes import Type
 
 
+class Unassigned:
+    """ The value of a declared variable which has not been assigned """
+    def __repr__(self):
+        return "<unassigned>"
+
+
+UNASSIGNED = Unassigned()
+
+
+def check_assignment(name, attributes, old, value):
+    """ Raise if a variable with the attributes can't change from old to value """
+    if Attribute.MUTABLE in attributes:
+        if Attribute.UNSTABLE not in attributes:
+            if old is not UNASSIGNED and old is not None and Type.type(old) != Type.type(value):
+                raise RuntimeException(name, "Variable '{}' is type stable and can not change type to '{}'".format(name.lexeme, Type.type(value)))
+    elif old is not UNASSIGNED:
+        raise RuntimeException(name, "Variable '{}' is immutable and can not be reassigned.".format(name.lexeme))
+
+
+class Cell:
+    """
+    A captured variable which may change after the function capturing it
+    is made, shared by its environment and the copies functions keep
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def unassigned(name):
+    return RuntimeException(name, "Can not get value of unassigned variable '{}'.".format(name.lexeme))
+
+
 class Variable:
     def __init__(self, name, value, attributes):
         self.name = name
@@ -13,50 +47,87 @@ class Variable:
         self.assigned = False if value is None else True
 
     def assign(self, value):
-        if Attribute.MUTABLE in self.attributes:
-            if Attribute.UNSTABLE not in self.attributes:
-                if self.value is not None and Type.type(self.value) != Type.type(value):
-                    raise RuntimeException(self.name, "Variable '{}' is type stable and can not change type to '{}'".format(self.name.lexeme, Type.type(value)))
-            self.value = value
-        elif self.assigned:
-            raise RuntimeException(self.name, "Variable '{}' is immutable and can not be reassigned.".format(self.name.lexeme))
-        else:
-            self.value = value
+        check_assignment(self.name, self.attributes,
+                         self.value if self.assigned else UNASSIGNED, value)
+        self.value = value
         self.assigned = True
 
 
-class Environment:
-    def __init__(self, enclosing=None):
-        self.values = {}
-        self.enclosing = enclosing
+class Layout:
+    """
+    The variables of a local scope in the order of their slots.
 
-    def define(self, name, value, attributes=[]):
-        self.values[name.lexeme] = Variable(name, value, attributes)
+    The Resolver builds one for every block and function, and every
+    Environment of that scope is a list of the same length. The slots in
+    cells hold a Cell, as functions made in the scope may see them change.
+    """
+    def __init__(self):
+        self.names = []
+        self.attributes = []
+        self.slots = {}
+        self.cells = []
 
-    def get(self, name):
-        if name.lexeme in self.values:
-            if self.values[name.lexeme].assigned:
-                return self.values[name.lexeme].value
-            else:
-                raise RuntimeException(name, "Can not get value of unassigned variable '{}'.".format(name.lexeme))
+    def add(self, name, attributes):
+        slot = len(self.names)
+        self.names.append(name)
+        self.attributes.append(attributes)
+        self.slots[name.lexeme] = slot
+        return slot
 
-        if self.enclosing is not None:
-            return self.enclosing[name]
+    def __len__(self):
+        return len(self.names)
 
-        raise RuntimeException(name, "Undefined variable '{}'.".format(
-            name.lexeme))
 
-    def get_at(self, distance, name):
-        if self.ancestor(distance).values[name.lexeme].assigned:
-            return self.ancestor(distance).values[name.lexeme].value
+class Environment:
+    """
+    The variables of a local scope, stored in the slots the Resolver
+    assigned them. Unassigned variables hold UNASSIGNED, and captured
+    variables which may change hold a Cell.
+    """
+    __slots__ = ('values', 'layout', 'enclosing')
+
+    def __init__(self, enclosing, layout):
+        self.values = values = [UNASSIGNED]*len(layout.names)
+        if layout.cells:
+            for slot in layout.cells:
+                values[slot] = Cell(UNASSIGNED)
+        self.layout = layout
+        self.enclosing = enclosing
+
+    def define(self, slot, value):
+        if value is None:
+            value = UNASSIGNED
+        cell = self.values[slot]
+        if type(cell) is Cell:
+            cell.value = value
         else:
-            raise RuntimeException(name, "Can not get value of unassigned variable '{}'.".format(name.lexeme))
+            self.values[slot] = value
 
-    def assign_at(self, distance, name, value):
-        try:
-            self.ancestor(distance).values[name.lexeme].assign(value)
-        except RuntimeException as exc:
-            raise RuntimeException(name, exc.msg)
+    def get_at(self, distance, slot, name):
+        environment = self
+        for _ in range(distance):
+            environment = environment.enclosing
+        value = environment.values[slot]
+        if type(value) is Cell:
+            value = value.value
+        if value is UNASSIGNED:
+            raise unassigned(name)
+        return value
+
+    def assign_at(self, distance, slot, name, value):
+        environment = self
+        for _ in range(distance):
+            environment = environment.enclosing
+        old = environment.values[slot]
+        cell = old if type(old) is Cell else None
+        if cell is not None:
+            old = cell.value
+        check_assignment(name, environment.layout.attributes[slot], old,
+                         value)
+        if cell is not None:
+            cell.value = value
+        else:
+            environment.values[slot] = value
 
     def ancestor(self, distance):
         environment = self
@@ -65,14 +136,28 @@ class Environment:
 
         return environment
 
-    def __getitem__(self, key):
-        return self.get(key)
 
-    def assign(self, name, value):
-        if name.lexeme in self.values:
-            self.values[name.lexeme].assign(value)
-            return
-        else:
-            if self.enclosing is not None:
-                return self.enclosing.assign(name, value)
-            raise RuntimeException(name, "Undefined variable '{}'.".format(name.lexeme))
+def capture(environment, captures):
+    """
+    The closure of a function made in environment: copies of the
+    environments it reads from, holding only the slots it reads. captures
+    lists those slots by distance, see Resolver.resolve_function. Values
+    are copied as they are, so a Cell is shared with the copy.
+    """
+    if not captures:
+        return None
+    sources = []
+    for _ in captures:
+        sources.append(environment)
+        environment = environment.enclosing
+    closure = None
+    for source, slots in zip(reversed(sources), reversed(captures)):
+        values = [UNASSIGNED]*len(source.values)
+        for slot in slots:
+            values[slot] = source.values[slot]
+        copy = Environment.__new__(Environment)
+        copy.values = values
+        copy.layout = source.layout
+        copy.enclosing = closure
+        closure = copy
+    return closure
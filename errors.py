@@ -13,22 +13,6 @@ class ParseException(Exception):
         Exception.__init__(self, *args, **kwargs)
 
 
-class BreakException(Exception):
-    def __init__(self, *args, **kwargs):
-        Exception.__init__(self, *args, **kwargs)
-
-
-class ContinueException(Exception):
-    def __init__(self, *args, **kwargs):
-        Exception.__init__(self, *args, **kwargs)
-
-
-class Return(Exception):
-    def __init__(self, value, *args, **kwargs):
-        Exception.__init__(self, *args, **kwargs)
-        self.value = value
-
-
 class MutableException(Exception):
     def __init__(self, msg, *args, **kwargs):
         Exception.__init__(self, *args, **kwargs)
@@ -5,6 +5,9 @@ class Assign(Expr):
     def __init__(self, name, value):
         self.name = name
         self.value = value
+        # Filled in by the Resolver
+        self.depth = None
+        self.slot = None
 
     def accept(self, visitor):
         return visitor.visit_assign_expr(self)
@@ -44,6 +47,9 @@ class Lambda(Expr):
     def __init__(self, parameters, body):
         self.parameters = parameters
         self.body = body
+        # Filled in by the Resolver
+        self.layout = None
+        self.captures = None
 
     def accept(self, visitor):
         return visitor.visit_lambda_expr(self)
@@ -53,6 +59,8 @@ class Get(Expr):
     def __init__(self, object, name):
         self.object = object
         self.name = name
+        # Filled in by the Resolver
+        self.cache = None
 
     def accept(self, visitor):
         return visitor.visit_get_expr(self)
@@ -102,10 +110,44 @@ class Set(Expr):
         return visitor.visit_set_expr(self)
 
 
+class Slice(Expr):
+    def __init__(self, collection, paren, start, stop):
+        self.collection = collection
+        self.paren = paren
+        self.start = start
+        self.stop = stop
+
+    def accept(self, visitor):
+        return visitor.visit_slice_expr(self)
+
+
+class SetIndex(Expr):
+    def __init__(self, collection, paren, index, value):
+        self.collection = collection
+        self.paren = paren
+        self.index = index
+        self.value = value
+
+    def accept(self, visitor):
+        return visitor.visit_setindex_expr(self)
+
+
+class Spawn(Expr):
+    def __init__(self, keyword, call):
+        self.keyword = keyword
+        self.call = call
+
+    def accept(self, visitor):
+        return visitor.visit_spawn_expr(self)
+
+
 class Unary(Expr):
     def __init__(self, operator, right):
         self.operator = operator
         self.right = right
+        # Filled in by the Resolver
+        self.depth = None
+        self.slot = None
 
     def accept(self, visitor):
         return visitor.visit_unary_expr(self)
@@ -125,6 +167,10 @@ class ListConstructor(Expr):
 class Variable(Expr):
     def __init__(self, name):
         self.name = name
+        # Filled in by the Resolver
+        self.depth = None
+        self.slot = None
+        self.cell = None
 
     def accept(self, visitor):
         return visitor.visit_variable_expr(self)
@@ -12,18 +12,27 @@ def define_ast(output_dir, base_name, types):
 
         for type in types:
             class_name = type.split(":")[0].strip()
-            fields = type.split(":")[1].strip()
-            define_type(output, base_name, class_name, fields)
+            fields, _, resolved = type.split(":")[1].partition("|")
+            define_type(output, base_name, class_name, fields.strip(),
+                        resolved.strip())
             output.print('')
 
 
-def define_type(writer, base_name, class_name, fields):
+def define_type(writer, base_name, class_name, fields, resolved=''):
+    """
+    Fields after a '|' are not passed to the constructor. They start out
+    as None and are filled in by the Resolver.
+    """
     writer.print("class {}({}):".format(
         class_name, str.capitalize(base_name)))
     if len(fields) > 0:
         writer.print("    def __init__(self, {fields}):".format(**locals()))
         for field in [f.strip() for f in fields.split(',')]:
             writer.print("        self.{field} = {field}".format(**locals()))
+        if len(resolved) > 0:
+            writer.print("        # Filled in by the Resolver")
+        for field in [f.strip() for f in resolved.split(',') if f.strip()]:
+            writer.print("        self.{field} = None".format(**locals()))
         writer.print('')
 
     # Visitor pattern
@@ -38,30 +47,38 @@ if __name__ == '__main__':
     parser.add_argument('output_dir', metavar='output directory')
     args = parser.parse_args()
 
-    define_ast(args.output_dir, "expr", ["Assign : name, value",
+    define_ast(args.output_dir, "expr", ["Assign : name, value | depth, slot",
                                          "Binary : left, operator, right",
                                          "Call : callee, paren, arguments",
                                          "Index : collection, paren, indicies",
-                                         "Lambda : parameters, body",
-                                         "Get : object, name",
+                                         "Lambda : parameters, body | layout, captures",
+                                         "Get : object, name | cache",
                                          "Grouping : expression",
                                          "List : expression",
                                          "Literal : value",
                                          "Logical : left, operator, right",
                                          "Set : object, name, value",
-                                         "Unary : operator, right",
+                                         "Slice : collection, paren, start, stop",
+                                         "SetIndex : collection, paren, index, value",
+                                         "Spawn : keyword, call",
+                                         "Unary : operator, right | depth, slot",
                                          "ListConstructor : start, next, stop, token",
-                                         "Variable : name"])
-    define_ast(args.output_dir, "stmt", ["Block : statements",
-                                         "Class : name, methods",
+                                         "Variable : name | depth, slot, cell"])
+    define_ast(args.output_dir, "stmt", ["Block : statements | layout, captured",
+                                         "Class : name, methods | slot",
                                          "Expression : expression",
-                                         "Function : name, parameters, body",
+                                         "Function : name, parameters, body, memo, memo_size | slot, layout, captures",
                                          "If : condition, then_branch, else_branch",
                                          "Print : expression",
-                                         "Return : keyword, value",
-                                         "Var : name, initializer",
-                                         "Mut : name, initializer",
-                                         "Unstable : name, initializer",
+                                         "Return : keyword, value | tail",
+                                         "Var : name, initializer | slot",
+                                         "Mut : name, initializer | slot",
+                                         "Unstable : name, initializer | slot",
                                          "While : condition, body",
+                                         "For : keyword, name, collection, body | layout, captured, parallel, stores, serial, vector",
+                                         "ParallelFor : keyword, name, collection, body, reductions, workers, chunk_size | captures, targets, stores, layout",
+                                         "ParallelRegion : keyword, body, reductions, workers | captures, targets, stores, layout",
+                                         "Critical : keyword, body",
+                                         "Barrier : keyword",
                                          "Break : ",
                                          "Continue : "])
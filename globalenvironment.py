@@ -1,8 +1,11 @@
-from environment import Environment
+from environment import Variable, unassigned
 from token import Token
 from tokentype import TokenType
 from attributes import Attribute
 from errors import RuntimeException
+import nebbdyrarray
+import nebbdyrshared
+import parallel
 
 
 class CoreFunction:
@@ -10,15 +13,55 @@ class CoreFunction:
         return self._arity
 
 
-class GlobalEnvironment(Environment):
-    def __init__(self, *args):
-        super(GlobalEnvironment, self).__init__(*args)
+class GlobalEnvironment:
+    """
+    The variables of the top level, looked up by name so the REPL and
+    functions referring to globals declared later keep working.
+    """
+    def __init__(self):
+        self.values = {}
+        self.enclosing = None
+        # The core functions scripts may declare their own variables over
+        self.library = set()
         self.define_globals()
 
+    def define(self, name, value, attributes=[]):
+        self.values[name.lexeme] = Variable(name, value, attributes)
+
+    def get(self, name):
+        if name.lexeme in self.values:
+            if self.values[name.lexeme].assigned:
+                return self.values[name.lexeme].value
+            else:
+                raise unassigned(name)
+
+        raise RuntimeException(name, "Undefined variable '{}'.".format(
+            name.lexeme))
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def assign(self, name, value):
+        if name.lexeme not in self.values:
+            raise RuntimeException(name, "Undefined variable '{}'.".format(name.lexeme))
+        try:
+            self.values[name.lexeme].assign(value)
+        except RuntimeException as exc:
+            # Report the assignment rather than the declaration
+            raise RuntimeException(name, exc.msg)
+
     def define_global(self, name, value, attributes=[]):
         token = self.global_token(name)
         self.define(token, value, attributes+[Attribute.CORE])
 
+    def define_library(self, name, value):
+        """
+        Define a core function whose name scripts may still declare, as it
+        was added after scripts could use it for their own variables
+        """
+        self.define_global(name, value)
+        self.library.add(name)
+
     def global_token(self, lexeme):
         return Token(TokenType.IDENTIFIER, lexeme, None, "core")
 
@@ -60,10 +103,150 @@ class GlobalEnvironment(Environment):
                     raise RuntimeException(_self.global_token("len"),
                                            "Invalid argument type for len.")
 
+        class fun_array(CoreFunction):
+            _arity = 1
+
+            def call(self, interpreter, arguments):
+                return nebbdyrarray.to_array(_self.global_token("array"),
+                                             *arguments)
+
+        class fun_reduce(CoreFunction):
+            _arity = 1
+
+            def __init__(self, name):
+                self.name = name
+
+            def call(self, interpreter, arguments):
+                return nebbdyrarray.reduce(_self.global_token(self.name),
+                                           self.name, *arguments)
+
+        class fun_matmul(CoreFunction):
+            _arity = 2
+
+            def call(self, interpreter, arguments):
+                return nebbdyrarray.matmul(_self.global_token("matmul"),
+                                           *arguments)
+
+        class fun_shape(CoreFunction):
+            _arity = 1
+
+            def call(self, interpreter, arguments):
+                array = nebbdyrarray.to_array(_self.global_token("shape"),
+                                              *arguments)
+                return nebbdyrarray.shape_of(array.array)
+
+        class fun_reshape(CoreFunction):
+            _arity = 2
+
+            def call(self, interpreter, arguments):
+                return nebbdyrarray.reshape(_self.global_token("reshape"),
+                                            *arguments)
+
+        class fun_pmap(CoreFunction):
+            _arity = 2
+
+            def call(self, interpreter, arguments):
+                return parallel.pmap(interpreter, _self.global_token("pmap"),
+                                     *arguments)
+
+        class fun_pfilter(CoreFunction):
+            _arity = 2
+
+            def call(self, interpreter, arguments):
+                return parallel.pfilter(interpreter,
+                                        _self.global_token("pfilter"),
+                                        *arguments)
+
+        class fun_preduce(CoreFunction):
+            _arity = 3
+
+            def call(self, interpreter, arguments):
+                return parallel.preduce(interpreter,
+                                        _self.global_token("preduce"),
+                                        *arguments)
+
+        class fun_threadnum(CoreFunction):
+            _arity = 0
+
+            def call(self, interpreter, arguments):
+                return interpreter.team.id
+
+        class fun_numthreads(CoreFunction):
+            _arity = 0
+
+            def call(self, interpreter, arguments):
+                return interpreter.team.size
+
+        class fun_wait(CoreFunction):
+            _arity = 1
+
+            def call(self, interpreter, arguments):
+                return parallel.wait(interpreter, _self.global_token("wait"),
+                                     *arguments)
+
+        class fun_waitfor(CoreFunction):
+            _arity = 2
+
+            def call(self, interpreter, arguments):
+                return parallel.wait(interpreter,
+                                     _self.global_token("waitfor"),
+                                     *arguments)
+
+        class fun_cancel(CoreFunction):
+            _arity = 1
+
+            def call(self, interpreter, arguments):
+                return parallel.cancel(_self.global_token("cancel"),
+                                       *arguments)
+
+        class fun_done(CoreFunction):
+            _arity = 1
+
+            def call(self, interpreter, arguments):
+                parallel.check_future(_self.global_token("done"), *arguments)
+                return arguments[0].done()
+
+        class fun_shared(CoreFunction):
+            _arity = 1
+
+            def call(self, interpreter, arguments):
+                value, = arguments
+                if isinstance(value, nebbdyrarray.NebbdyrArray):
+                    value = value.array.tolist()
+                return nebbdyrshared.make(_self.global_token("shared"), value)
+
+        class fun_free(CoreFunction):
+            _arity = 1
+
+            def call(self, interpreter, arguments):
+                value, = arguments
+                if not isinstance(value, nebbdyrshared.NebbdyrShared):
+                    raise RuntimeException(_self.global_token("free"),
+                                           "Can only free shared lists.")
+                value.free()
+                return None
+
         _self.define_global("list", fun_list())
         _self.define_global("tostring", fun_tostr())
         _self.define_global("tonumber", fun_tonum())
         _self.define_global("len", fun_len())
+        _self.define_library("array", fun_array())
+        for name in ["sum", "min", "max", "mean"]:
+            _self.define_library(name, fun_reduce(name))
+        _self.define_library("matmul", fun_matmul())
+        _self.define_library("shape", fun_shape())
+        _self.define_library("reshape", fun_reshape())
+        _self.define_library("pmap", fun_pmap())
+        _self.define_library("pfilter", fun_pfilter())
+        _self.define_library("preduce", fun_preduce())
+        _self.define_library("threadnum", fun_threadnum())
+        _self.define_library("numthreads", fun_numthreads())
+        _self.define_library("wait", fun_wait())
+        _self.define_library("waitfor", fun_waitfor())
+        _self.define_library("cancel", fun_cancel())
+        _self.define_library("done", fun_done())
+        _self.define_library("shared", fun_shared())
+        _self.define_library("free", fun_free())
 
         [_self.define_global_var(var) for var in
         ["elements", "mass", "localomp"]]
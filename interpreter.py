@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
 
+import copy
 import datetime
 
 from attributes import Attribute
-from environment import Environment
-from errors import BreakException, ContinueException, Return, RuntimeException, IndexException
+from environment import Environment, UNASSIGNED, capture, unassigned
+from errors import RuntimeException, IndexException
 from nebbdyrfunction import NebbdyrFunction
 from nebbdyrclass import NebbdyrClass
-from nebbdyrinstance import NebbdyrInstance
+from nebbdyrinstance import NebbdyrInstance, PropertyCounters
 from tokentype import TokenType as TT
 from globalenvironment import GlobalEnvironment
+from transpiler import Transpiler, Untranslatable
+from runtime import Completion, TailCall, BREAK, CONTINUE
+from stmt import Block
+import memo
+import parallel
+import runtime
+import vectorize
 
 
 class Interpreter:
@@ -17,7 +25,21 @@ class Interpreter:
         self.nebbdyr = nebbdyr
         self.globals = GlobalEnvironment()
         self.environment = self.globals
-        self.locals = {}
+        # Functions called this many times are transpiled to Python
+        self.tier_threshold = None
+        self.tiered_up = 0
+        self.untranslatable = set()
+        # The cache size of functions declared with a plain memo, and the
+        # counters of every memoized declaration
+        self.memo_size = memo.DEFAULT_SIZE
+        self.memo_counters = {}
+        self.property_counters = PropertyCounters()
+        self.parallel = parallel.Options()
+        # Whether for loops planned by vectorize run as NumPy operations
+        self.vectorize = True
+        self.vectorized = 0
+        # The team of workers running the current parallel region
+        self.team = parallel.SOLO
 
     def interpret(self, statements):
         try:
@@ -31,54 +53,117 @@ class Interpreter:
         except IndexException as exc:
             self.nebbdyr.runtime_error(exc)
 
+    def fork(self):
+        """
+        A copy of the interpreter for running a spawned call in another
+        thread, sharing everything but the environment it executes in
+        """
+        interpreter = copy.copy(self)
+        interpreter.environment = self.globals
+        return interpreter
+
     def evaluate(self, expr):
         return expr.accept(self)
 
     def execute(self, stmt):
         return stmt.accept(self)
 
-    def resolve(self, expr, depth):
-        self.locals[expr] = depth
+    def define(self, stmt, value, attributes=[]):
+        """ Define the variable declared by stmt in the current environment """
+        if stmt.slot is None:
+            self.globals.define(stmt.name, value, attributes)
+        else:
+            self.environment.define(stmt.slot, value)
+
+    def statistics(self):
+        """ Counters describing the run, printed by nebbdyr.py --stats """
+        statistics = {"functions tiered up": self.tiered_up,
+                      "loops vectorized": self.vectorized,
+                      "property cache": str(self.property_counters)}
+        for counters in self.memo_counters.values():
+            statistics["memo " + counters.name] = str(counters)
+        return statistics
+
+    def memo_for(self, declaration):
+        """ A new cache for a function declared with memo, or None """
+        if declaration.memo is None:
+            return None
+        counters = self.memo_counters.get(declaration)
+        if counters is None:
+            counters = memo.MemoCounters(declaration.name.lexeme)
+            self.memo_counters[declaration] = counters
+        size = declaration.memo_size or self.memo_size
+        return memo.Memo(size, counters)
+
+    def tier_up(self, function):
+        """ Transpile a hot function, returning None if it can't be done """
+        if function.declaration in self.untranslatable:
+            return None
+        try:
+            compiled = Transpiler(self).compile(function)
+        except Untranslatable:
+            self.untranslatable.add(function.declaration)
+            return None
+        self.tiered_up += 1
+        return compiled
 
     def execute_block(self, statements, environment):
+        """ Execute statements in environment, returning their Completion """
         previous = self.environment
         try:
             self.environment = environment
             if not isinstance(statements, list):
-                self.execute(statements)
-            else:
-                for statement in statements:
-                    self.execute(statement)
+                return self.execute(statements)
+            for statement in statements:
+                completion = self.execute(statement)
+                if completion is not None:
+                    return completion
+            return None
         finally:
             self.environment = previous
 
     def visit_block_stmt(self, stmt):
-        self.execute_block(stmt.statements, Environment(self.environment))
+        if stmt.layout is None:
+            return self.execute_block(stmt.statements, self.environment)
+        return self.execute_block(stmt.statements,
+                                  Environment(self.environment, stmt.layout))
+
+    def loop_body(self, body, environment):
+        """
+        What a loop runs for every iteration, and the environment it runs
+        in. A block declaring variables gets one environment for the whole
+        loop, unless functions in it may capture those of an iteration.
+        """
+        if (isinstance(body, Block) and body.layout is not None and
+                not body.captured):
+            return body.statements, Environment(environment, body.layout)
+        return body, environment
 
     def visit_class_stmt(self, stmt):
-        self.environment.define(stmt.name, None)
-
         methods = {}
         for method in stmt.methods:
-            function = NebbdyrFunction(method, self.environment)
+            function = NebbdyrFunction(method, capture(self.environment,
+                                                       method.captures))
             methods[method.name.lexeme] = function
 
         klasse = NebbdyrClass(stmt.name.lexeme, methods)
-        self.environment.assign(stmt.name, klasse)
+        self.define(stmt, klasse)
         return None
 
     def visit_expression_stmt(self, stmt):
         self.evaluate(stmt.expression)
 
     def visit_function_stmt(self, stmt):
-        function = NebbdyrFunction(stmt, self.environment)
-        self.environment.define(stmt.name, function, (Attribute.FUNCTION))
+        function = NebbdyrFunction(stmt, capture(self.environment,
+                                                 stmt.captures))
+        function.memo = self.memo_for(stmt)
+        self.define(stmt, function, [Attribute.FUNCTION])
 
     def visit_if_stmt(self, stmt):
         if self.is_truthy(self.evaluate(stmt.condition)):
-            self.execute(stmt.then_branch)
+            return self.execute(stmt.then_branch)
         elif stmt.else_branch is not None:
-            self.execute(stmt.else_branch)
+            return self.execute(stmt.else_branch)
         return None
 
     def visit_print_stmt(self, stmt):
@@ -86,49 +171,137 @@ class Interpreter:
         print(self.stringify(value))
 
     def visit_return_stmt(self, stmt):
+        if stmt.tail:
+            callee, arguments = self.evaluate_call(stmt.value)
+            if isinstance(callee, NebbdyrFunction):
+                return TailCall(callee, arguments)
+            return Completion(callee.call(self, arguments))
         value = self.evaluate(stmt.value) if stmt.value is not None else None
-        raise Return(value)
+        return Completion(value)
 
     def visit_var_stmt(self, stmt):
         value = None
         if stmt.initializer is not None:
             value = self.evaluate(stmt.initializer)
-        self.environment.define(stmt.name, value)
+        self.define(stmt, value)
 
     def visit_mut_stmt(self, stmt):
         value = None
         if stmt.initializer is not None:
             value = self.evaluate(stmt.initializer)
-        self.environment.define(stmt.name, value, [Attribute.MUTABLE])
+        self.define(stmt, value, [Attribute.MUTABLE])
 
     def visit_unstable_stmt(self, stmt):
         value = None
         if stmt.initializer is not None:
             value = self.evaluate(stmt.initializer)
-        self.environment.define(stmt.name, value, [Attribute.UNSTABLE,
-                                                   Attribute.MUTABLE])
+        self.define(stmt, value, [Attribute.UNSTABLE, Attribute.MUTABLE])
 
     def visit_while_stmt(self, stmt):
+        body, environment = self.loop_body(stmt.body, self.environment)
         while self.is_truthy(self.evaluate(stmt.condition)):
-            try:
-                self.execute(stmt.body)
-            except BreakException:
-                break
-            except ContinueException:
-                pass
+            completion = self.execute_block(body, environment)
+            if completion is not None:
+                if completion is BREAK:
+                    break
+                if completion is not CONTINUE:
+                    return completion
+        return None
+
+    def visit_for_stmt(self, stmt):
+        collection = self.evaluate(stmt.collection)
+        if stmt.vector is not None and self.run_vector(stmt, collection):
+            return None
+        if (stmt.parallel is not None and self.parallel.auto and
+                self.run_auto(stmt, collection)):
+            return None
+        environment = None
+        for value in runtime.iterate(stmt.keyword, collection, self):
+            # Functions in the body capture the variable of their iteration
+            if environment is None or stmt.captured:
+                environment = Environment(self.environment, stmt.layout)
+                body, body_environment = self.loop_body(stmt.body,
+                                                        environment)
+            environment.define(0, value)
+            completion = self.execute_block(body, body_environment)
+            if completion is not None:
+                if completion is BREAK:
+                    break
+                if completion is not CONTINUE:
+                    return completion
+        return None
+
+    def run_vector(self, stmt, collection):
+        """ Run a for loop as NumPy operations if it can, returning whether it did """
+        vector = stmt.vector
+        if not (self.vectorize and vectorize.applies(collection)):
+            return False
+        values = vectorize.run(vector, collection,
+                               [self.evaluate(variable)
+                                for variable in vector.variables])
+        if values is None:
+            return False
+        self.vectorized += 1
+        self.assign_targets(vector.targets, values)
+        return True
+
+    def run_auto(self, stmt, collection):
+        """ Run a for loop as its parallel for if it can, returning whether it did """
+        plan = stmt.parallel
+        values = parallel.auto(
+            self, plan, collection,
+            [self.evaluate(store) for store in stmt.stores],
+            [self.evaluate(capture) for capture in plan.captures],
+            [self.evaluate(target) for target in plan.targets])
+        if values is None:
+            return False
+        self.assign_targets(plan.targets, values)
+        return True
+
+    def visit_parallelfor_stmt(self, stmt):
+        return self.run_parallel(stmt, self.evaluate(stmt.collection))
+
+    def visit_parallelregion_stmt(self, stmt):
+        return self.run_parallel(stmt, None)
+
+    def run_parallel(self, stmt, collection):
+        captures = [self.evaluate(capture) for capture in stmt.captures]
+        reductions = [self.evaluate(target) for target in stmt.targets]
+        values = parallel.run(self, stmt, collection, captures, reductions)
+        self.assign_targets(stmt.targets, values)
+        return None
+
+    def assign_targets(self, targets, values):
+        for target, value in zip(targets, values):
+            if target.depth is not None:
+                self.environment.assign_at(target.depth, target.slot,
+                                           target.name, value)
+            else:
+                self.globals.assign(target.name, value)
+
+    def visit_critical_stmt(self, stmt):
+        team = self.team
+        team.enter()
+        try:
+            return self.execute(stmt.body)
+        finally:
+            team.exit()
+
+    def visit_barrier_stmt(self, stmt):
+        self.team.wait(stmt.keyword)
+        return None
 
     def visit_break_stmt(self, stmt):
-        raise BreakException()
+        return BREAK
 
     def visit_continue_stmt(self, stmt):
-        raise ContinueException()
+        return CONTINUE
 
     def visit_assign_expr(self, expr):
         value = self.evaluate(expr.value)
 
-        distance = self.locals.get(expr)
-        if distance is not None:
-            self.environment.assign_at(distance, expr.name, value)
+        if expr.depth is not None:
+            self.environment.assign_at(expr.depth, expr.slot, expr.name, value)
         else:
             self.globals.assign(expr.name, value)
         return value
@@ -171,17 +344,17 @@ class Interpreter:
         # Increment and decrement operators
         elif expr.operator.type == TT.PLUSPLUS:
             self.check_number_operand(expr.operator, right)
-            distance = self.locals.get(expr)
-            if distance is not None:
-                self.environment.assign_at(distance, expr.right.name, right+1)
+            if expr.depth is not None:
+                self.environment.assign_at(expr.depth, expr.slot,
+                                           expr.right.name, right+1)
             else:
                 self.globals.assign(expr.right.name, right+1)
             return right + 1
         elif expr.operator.type == TT.MINUSMINUS:
             self.check_number_operand(expr.operator, right)
-            distance = self.locals.get(expr)
-            if distance is not None:
-                self.environment.assign_at(distance, expr.right.name, right-1)
+            if expr.depth is not None:
+                self.environment.assign_at(expr.depth, expr.slot,
+                                           expr.right.name, right-1)
             else:
                 self.globals.assign(expr.right.name, right-1)
             return right - 1
@@ -189,102 +362,56 @@ class Interpreter:
         # Unreachable
 
     def visit_listconstructor_expr(self, expr):
-        start = self.evaluate(expr.start)
-        if not isinstance(start, (int, float)):
-            raise RuntimeException(expr.token, "Start must be iterable.")
-
-        next_is_none = False
+        start = runtime.range_bound(expr.token, self.evaluate(expr.start),
+                                    "Start")
+        next = None
         if expr.next is not None:
-            next = self.evaluate(expr.next)
-            if not isinstance(next, (int, float)):
-                raise RuntimeException(expr.token, "Next must be iterable.")
-        else:
-            next_is_none = True
-
-        stop = self.evaluate(expr.stop)
-        if not isinstance(stop, (int, float)):
-            raise RuntimeException(expr.token, "Stop must be iterable.")
-
-        if next_is_none:
-            return list(range(start, stop+1))
-        else:
-            return list(range(start, stop+1, next-start))
+            next = runtime.range_bound(expr.token, self.evaluate(expr.next),
+                                       "Next")
+        stop = runtime.range_bound(expr.token, self.evaluate(expr.stop),
+                                   "Stop")
+        return runtime.construct_list(start, next, stop)
 
     def visit_variable_expr(self, expr):
         return self.lookup_variable(expr.name, expr)
 
     def lookup_variable(self, name, expr):
-        distance = self.locals.get(expr)
-        if distance is not None:
-            return self.environment.get_at(distance, name)
-        else:
+        if expr.depth is None:
             return self.globals.get(name)
+        environment = self.environment
+        for _ in range(expr.depth):
+            environment = environment.enclosing
+        value = environment.values[expr.slot]
+        if expr.cell:
+            value = value.value
+        if value is UNASSIGNED:
+            raise unassigned(name)
+        return value
 
     def visit_list_expr(self, expr):
         return [self.evaluate(e) for e in expr.expression]
 
     def check_number_operand(self, operator, operand):
-        # Can't use isinstance since bools are of instance int
-        if not type(operand) in (int, float):
-            raise RuntimeException(operator, "Operand must be a number.")
+        runtime.check_number_operand(operator, operand)
 
     def visit_binary_expr(self, expr):
         left = self.evaluate(expr.left)
         right = self.evaluate(expr.right)
+        return runtime.BINARY[expr.operator.type](expr.operator, left, right)
 
-        if expr.operator.type == TT.MINUS:
-            self.check_number_operands(expr.operator, left, right)
-            return left - right
-        elif expr.operator.type == TT.SLASH:
-            self.check_number_operands(expr.operator, left, right)
-            if right == 0:
-                raise RuntimeException(expr.operator,
-                                       "Attempted to divide by zero.")
-            return left/right
-        elif expr.operator.type == TT.STAR:
-            self.check_number_operands(expr.operator, left, right)
-            return left*right
-        elif expr.operator.type == TT.PLUS:
-            # Allow both float+float and str+str
-            if type(left) == type(right):
-                return left + right
-            # Case of int + float
-            if (isinstance(left, (int, float)) and
-               isinstance(right, (int, float))):
-                return left + right
-            raise RuntimeException(expr.operator,
-                                   "Operands must both be numbers or strings.")
-        elif expr.operator.type == TT.GREATER:
-            if left is False or right is False:
-                return False
-            self.check_number_operands(expr.operator, left, right)
-            return right if left > right else False
-        elif expr.operator.type == TT.GREATER_EQUAL:
-            if left is False or right is False:
-                return False
-            self.check_number_operands(expr.operator, left, right)
-            return right if left >= right else False
-        elif expr.operator.type == TT.LESS:
-            if left is False or right is False:
-                return False
-            self.check_number_operands(expr.operator, left, right)
-            return right if left < right else False
-        elif expr.operator.type == TT.LESS_EQUAL:
-            if left is False or right is False:
-                return False
-            self.check_number_operands(expr.operator, left, right)
-            return right if left <= right else False
-        elif expr.operator.type == TT.BANG_EQUAL:
-            return right if not self.is_equal(left, right) else False
-        elif expr.operator.type == TT.EQUAL:
-            return right if self.is_equal(left, right) else False
-        elif expr.operator.type == TT.HAT:
-            self.check_number_operands(expr.operator, left, right)
-            return left**right
+    def visit_call_expr(self, expr):
+        callee, arguments = self.evaluate_call(expr)
+        try:
+            return callee.call(self, arguments)
+        except RecursionError:
+            raise runtime.stack_overflow(expr.paren)
 
-        # Unreachable
+    def visit_spawn_expr(self, expr):
+        callee, arguments = self.evaluate_call(expr.call)
+        return parallel.spawn(self, expr.keyword, callee, arguments)
 
-    def visit_call_expr(self, expr):
+    def evaluate_call(self, expr):
+        """ Evaluate the callee and arguments of a call and check them """
         callee = self.evaluate(expr.callee)
 
         arguments = []
@@ -292,28 +419,10 @@ class Interpreter:
             argument = self.evaluate(argument)
             arguments.append(argument)
 
-        if len(arguments) != callee.arity():
-            raise RuntimeException(expr.paren, "Expected " + str(callee.arity()) +
-                                   " arguments, but got " + str(len(arguments))
-                                   + ".")
-        try:
-            return callee.call(self, arguments)
-        except Exception as e:
-            raise e
-            raise RuntimeException(expr.paren, "Can only call functions")
+        runtime.check_arity(expr.paren, callee, arguments)
+        return callee, arguments
 
     def visit_index_expr(self, expr):
-        def is_valid(collection, index):
-            if not isinstance(collection, (list)):
-                raise IndexException(expr.paren, f"Can not index type '{type(collection)}'.")
-            if len(collection) <= index:
-                col = str(collection)
-                if(len(collection) > 4):
-                    col = (f'[{collection[0]}, {collection[1]}, ..., '
-                           f'{collection[-2]}, {collection[-1]}]')
-
-                raise IndexException(expr.paren, f"Index {index} is out of bounds of collection {col} of length {len(collection)}.")
-
         collection = self.evaluate(expr.collection)
 
         indicies = []
@@ -321,51 +430,41 @@ class Interpreter:
             index = self.evaluate(index)
             indicies.append(index)
 
-        indicies = [int(i) for i in indicies]
-        if len(indicies) == 1:
-            is_valid(collection, indicies[0])
-            return collection[indicies[0]]
-        else:
-            for index in indicies:
-                is_valid(collection, index)
-            return [collection[i] for i in indicies]
+        return runtime.index(expr.paren, collection, indicies)
+
+    def visit_setindex_expr(self, expr):
+        collection = self.evaluate(expr.collection)
+        index = self.evaluate(expr.index)
+        value = self.evaluate(expr.value)
+        return runtime.store(expr.paren, collection, index, value)
+
+    def visit_slice_expr(self, expr):
+        collection = self.evaluate(expr.collection)
+        start = self.evaluate(expr.start)
+        stop = self.evaluate(expr.stop)
+        return runtime.view(expr.paren, collection, start, stop)
 
     def visit_lambda_expr(self, expr):
-        function = NebbdyrFunction(expr, self.environment)
+        function = NebbdyrFunction(expr, capture(self.environment,
+                                                 expr.captures))
         return function
 
     def visit_get_expr(self, expr):
         object = self.evaluate(expr.object)
         if isinstance(object, NebbdyrInstance):
-            return object.get(expr.name)
+            return object.get_cached(expr.name, expr.cache,
+                                     self.property_counters)
 
         raise RuntimeException(expr.name, "Only instances have properties")
 
     def check_number_operands(self, operator, left, right):
-        if not isinstance(left, (float, int)):
-            raise RuntimeException(
-                operator, "Left operand '{}' must be number.".format(
-                    self.stringify(left)))
-        if not isinstance(right, (float, int)):
-            raise RuntimeException(
-                operator, "Right operand '{}' must be number.".format(
-                    self.stringify(right)))
+        runtime.check_number_operands(operator, left, right)
 
     def is_truthy(self, object):
-        # Inherit Python's definitions of True and False
-        return True if object or (object is 0) else False
+        return runtime.is_truthy(object)
 
     def is_equal(self, left, right):
-        # none is not equal to anything
-        if left is None and right is None:
-            return False
-        return left == right
+        return runtime.is_equal(left, right)
 
     def stringify(self, object):
-        if object is None:
-            return "none"
-        if object is True:
-            return "true"
-        if object is False:
-            return "false"
-        return str(object)
+        return runtime.stringify(object)
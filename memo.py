@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+Caches of the results of functions declared with 'memo fun'.
+
+Every function object gets its own cache, since closures created from
+the same declaration may capture different values. The counters are
+shared by all caches of a declaration and reported by --stats.
+"""
+
+from collections import OrderedDict
+
+# Results are only cached for arguments of these types, which are
+# compared by value. Calls with lists or instances are always run.
+KEY_TYPES = (bool, int, float, str, type(None))
+
+DEFAULT_SIZE = 128
+
+MISSING = object()
+
+
+class MemoCounters:
+    """ The hits, misses and evictions of the caches of a declaration """
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __str__(self):
+        return "{} hits, {} misses, {} evictions".format(
+            self.hits, self.misses, self.evictions)
+
+
+class Memo:
+    """ A cache of results keyed on the arguments, evicting the least recently used """
+    __slots__ = ('size', 'results', 'counters')
+
+    def __init__(self, size, counters):
+        self.size = size
+        self.results = OrderedDict()
+        self.counters = counters
+
+    def key(self, arguments):
+        """ The key of the arguments, or None if they can't be cached """
+        for argument in arguments:
+            if type(argument) not in KEY_TYPES:
+                return None
+        # The types keep 1, 1.0 and true apart
+        return tuple((type(argument), argument) for argument in arguments)
+
+    def get(self, key):
+        result = self.results.get(key, MISSING)
+        if result is MISSING:
+            self.counters.misses += 1
+        else:
+            self.counters.hits += 1
+            self.results.move_to_end(key)
+        return result
+
+    def store(self, key, value):
+        self.results[key] = value
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+            self.counters.evictions += 1
@@ -5,7 +5,8 @@
       (let* (
             ;; define several category of keywords
              (x-keywords '("break" "while" "in" ".." "for" "unstable" "continue" "else" "print"
-                           "if" "fun" "return" "ensure" "mut" "var" "class"))
+                           "if" "fun" "return" "ensure" "mut" "var" "class" "memo"
+                           "parallel" "critical" "barrier" "spawn"))
 
             ;; generate regex string for each category of keywords
             (x-keywords-regexp (regexp-opt x-keywords 'words)))
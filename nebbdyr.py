@@ -1,29 +1,81 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import standardlibrary
 import argparse
+import os
+import sys
+import threading
+import autoparallel
+import cache
+import parallel
+import remote
 from scanner import Scanner
 from token import Token
 from tokentype import TokenType
 from parser import Parser
 from astprinter import AstPrinter
 from interpreter import Interpreter
+from closurecompiler import ClosureInterpreter
+from vm import VMInterpreter
 from resolver import Resolver
 
 
+BACKENDS = {'tree': Interpreter,
+            'closure': ClosureInterpreter,
+            'vm': VMInterpreter}
+
+# The stack of the thread and the recursion limit used by --deep
+DEEP_STACK_SIZE = 512 * 1024 * 1024
+DEEP_RECURSION_LIMIT = 10**7
+
+
+def run_deep(function):
+    """
+    Run function in a thread with a large stack and a recursion limit
+    high enough that deep recursion is limited by memory instead.
+    """
+    threading.stack_size(DEEP_STACK_SIZE)
+    sys.setrecursionlimit(DEEP_RECURSION_LIMIT)
+    thread = threading.Thread(target=function)
+    thread.start()
+    thread.join()
+
+
 class Nebbdyr:
-    def __init__(self):
-        self.interpreter = Interpreter(self)
+    def __init__(self, backend='tree'):
+        self.interpreter = BACKENDS[backend](self)
         self.hadError = False
         self.had_runtime_error = False
+        # Whether to tell which for loops can run in parallel before running
+        self.parallel_report = False
 
-    def run_file(self, path):
+    def run_file(self, path, use_cache=True):
         with open(path) as text:
-            self.run(text.read())
+            source = text.read()
+
+        statements = cache.load(path, source) if use_cache else None
+        if statements is not None:
+            self.interpret(statements)
+        else:
+            statements = self.compile(source)
+            if statements is not None:
+                if use_cache:
+                    cache.store(path, source, statements)
+                self.interpret(statements)
 
         if self.hadError:
             print("Running failed.")
 
+    def compile_file(self, path):
+        """ Resolve a script and store it in the cache without running it """
+        with open(path) as text:
+            source = text.read()
+        statements = self.compile(source)
+        if statements is None:
+            return False
+        return cache.store(path, source, statements)
+
     def run_prompt(self):
         while True:
             self.run(input("> ")+"\n")
@@ -31,6 +83,21 @@ class Nebbdyr:
             self.had_runtime_error = False
 
     def run(self, source):
+        statements = self.compile(source)
+        if statements is not None:
+            self.interpret(statements)
+
+    def interpret(self, statements):
+        if self.parallel_report:
+            for line in autoparallel.report(statements):
+                print(line, file=sys.stderr)
+        try:
+            self.interpreter.interpret(statements)
+        finally:
+            parallel.shutdown(self.interpreter.parallel)
+
+    def compile(self, source):
+        """ Scan, parse and resolve source, returning None on errors """
         scanner = Scanner(source, self)
         tokens = scanner.scan_tokens()
 
@@ -38,17 +105,17 @@ class Nebbdyr:
         statements = parser.parse()
 
         if self.hadError:
-            return
+            return None
         if self.had_runtime_error:
-            return
+            return None
 
         resolver = Resolver(self.interpreter, self)
         resolver.resolve(statements)
 
         if self.hadError:
-            return
+            return None
 
-        self.interpreter.interpret(statements)
+        return statements
 
     def report(self, line, where, message, type):
         print("[line {line}] {type} Error{where}: {message}".format(
@@ -74,9 +141,113 @@ class Nebbdyr:
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('script', nargs='?', default=None)
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='tree',
+                        help="Execute by walking the AST, by compiling "
+                        "it into closures or by compiling it to bytecode.")
+    parser.add_argument('--disassemble', action='store_true',
+                        help="Print the bytecode before running it with "
+                        "the vm backend.")
+    parser.add_argument('--tier', type=int, default=None, metavar='CALLS',
+                        help="Transpile functions to Python once they have "
+                        "been called this many times.")
+    parser.add_argument('--memo-size', type=int, default=None, metavar='SIZE',
+                        help="The number of results cached by functions "
+                        "declared with memo but without a size.")
+    parser.add_argument('--deep', action='store_true',
+                        help="Allow recursion as deep as memory permits. "
+                        "The vm backend always does.")
+    parser.add_argument('--workers', type=int, default=None, metavar='COUNT',
+                        help="The number of workers running a parallel for. "
+                        "Defaults to the number of CPUs.")
+    parser.add_argument('--chunk-size', type=int, default=None, metavar='SIZE',
+                        help="The number of iterations of a parallel for "
+                        "each worker runs at a time.")
+    parser.add_argument('--threads', action='store_true',
+                        help="Run parallel loops in threads instead of "
+                        "processes.")
+    parser.add_argument('--auto-parallel', action='store_true',
+                        help="Run the for loops whose iterations are "
+                        "independent as parallel for loops.")
+    parser.add_argument('--auto-minimum', type=int, default=None,
+                        metavar='COUNT',
+                        help="The fewest iterations a for loop runs in "
+                        "parallel with by --auto-parallel. Defaults to " +
+                        str(parallel.AUTO_MINIMUM) + ".")
+    parser.add_argument('--parallel-report', action='store_true',
+                        help="Tell which for loops can run in parallel, and "
+                        "why the others can't, before running.")
+    parser.add_argument('--no-vectorize', action='store_true',
+                        help="Run every for loop one iteration at a time, "
+                        "instead of running loops doing arithmetic on "
+                        "lists of numbers as NumPy operations.")
+    parser.add_argument('--hosts', default=None, metavar='ADDRESSES',
+                        help="Send the work of parallel loops, pmap, pfilter, "
+                        "preduce and spawn to the workers at these comma "
+                        "separated [HOST:]PORT addresses.")
+    parser.add_argument('--worker', default=None, metavar='[HOST:]PORT',
+                        help="Listen for work sent by --hosts instead of "
+                        "running a script. The host defaults to " +
+                        remote.DEFAULT_HOST + ".")
+    parser.add_argument('--stats', action='store_true',
+                        help="Print the interpreter's counters after running.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always scan, parse and resolve the script "
+                        "instead of using " + cache.CACHE_DIRECTORY + ".")
+    parser.add_argument('--compile', metavar='DIRECTORY', default=None,
+                        help="Store every script in a directory in the "
+                        "cache without running them.")
     args = parser.parse_args()
-    nebb = Nebbdyr()
+
+    if args.worker is not None:
+        try:
+            parallel.serve(args.worker)
+        except (ValueError, OSError) as error:
+            parser.error(str(error))
+        sys.exit(0)
+    hosts = None
+    if args.hosts is not None:
+        hosts = [address for address in args.hosts.split(',') if address]
+        try:
+            for address in hosts:
+                remote.parse_address(address)
+        except ValueError as error:
+            parser.error(str(error))
+
+    if args.compile is not None:
+        failed = False
+        for root, directories, files in os.walk(args.compile):
+            directories[:] = [d for d in directories
+                              if d != cache.CACHE_DIRECTORY]
+            for name in sorted(files):
+                if name.endswith(".nebb"):
+                    path = os.path.join(root, name)
+                    if not Nebbdyr().compile_file(path):
+                        print("Could not compile " + path)
+                        failed = True
+        sys.exit(1 if failed else 0)
+
+    nebb = Nebbdyr(args.backend)
+    nebb.interpreter.disassemble = args.disassemble
+    nebb.interpreter.tier_threshold = args.tier
+    if args.memo_size is not None:
+        nebb.interpreter.memo_size = args.memo_size
+    nebb.interpreter.vectorize = not args.no_vectorize
+    nebb.interpreter.parallel.workers = args.workers
+    nebb.interpreter.parallel.chunk_size = args.chunk_size
+    nebb.interpreter.parallel.threads = args.threads
+    nebb.interpreter.parallel.hosts = hosts
+    nebb.interpreter.parallel.auto = args.auto_parallel
+    if args.auto_minimum is not None:
+        nebb.interpreter.parallel.auto_minimum = args.auto_minimum
+    nebb.parallel_report = args.parallel_report
     if args.script is not None:
-        nebb.run_file(args.script)
+        run = lambda: nebb.run_file(args.script, not args.no_cache)
+    else:
+        run = nebb.run_prompt
+    if args.deep:
+        run_deep(run)
     else:
-        nebb.run_prompt()
+        run()
+    if args.stats:
+        for name, value in nebb.interpreter.statistics().items():
+            print("{}: {}".format(name, value), file=sys.stderr)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+Numeric arrays backed by NumPy.
+
+Arrays are made by the array builtin from lists, ranges and nested
+lists. Arithmetic and comparisons with arrays work element-wise and
+broadcast like NumPy's, so an operation on a million elements is a
+single call. NumPy is only imported once a script makes an array.
+
+Comparisons differ from those of numbers: instead of their right
+operand or false, they give an array of true and false for every
+element, as NumPy does. So they don't chain, as 1 < a < 4 compares that
+array with 4, and like every array which is not empty it is true in an
+if statement. Use sum, min or max to test the elements as a whole.
+"""
+
+import standardlibrary
+from errors import RuntimeException
+from nebbdyrrange import NebbdyrRange, is_range
+from nebbdyrshared import NebbdyrShared
+from nebbdyrslice import NebbdyrSlice
+from tokentype import TokenType as TT
+
+numpy = None
+
+
+def load_numpy(token):
+    """ Import NumPy, raising a RuntimeException at token if it is missing """
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            raise RuntimeException(token, "Arrays need NumPy to be installed.")
+        numpy = module
+    return numpy
+
+
+class NebbdyrArray:
+    __slots__ = ('array',)
+
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        return wrap(self.array[index])
+
+    def __setitem__(self, index, value):
+        self.array[index] = value
+
+    def __iter__(self):
+        return (wrap(value) for value in self.array)
+
+    def __eq__(self, other):
+        try:
+            return wrap(self.array == unwrap(other))
+        except ValueError:
+            # Arrays of shapes which don't broadcast are never equal
+            return False
+
+    def __str__(self):
+        return format_value(self.array.tolist())
+
+    def __repr__(self):
+        return str(self)
+
+
+def format_value(value):
+    if isinstance(value, list):
+        return "[" + ", ".join(format_value(item) for item in value) + "]"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    return str(value)
+
+
+def wrap(value):
+    """ Wrap NumPy arrays and turn NumPy scalars into Python numbers """
+    if isinstance(value, numpy.ndarray):
+        if value.ndim == 0:
+            return value.item()
+        return NebbdyrArray(value)
+    if isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+
+def unwrap(value):
+    return value.array if isinstance(value, NebbdyrArray) else value
+
+
+def logical_not(value):
+    return wrap(numpy.logical_not(value.array))
+
+
+# The NumPy functions of the binary operators
+OPERATIONS = {
+    TT.MINUS: 'subtract',
+    TT.SLASH: 'true_divide',
+    TT.STAR: 'multiply',
+    TT.PLUS: 'add',
+    TT.GREATER: 'greater',
+    TT.GREATER_EQUAL: 'greater_equal',
+    TT.LESS: 'less',
+    TT.LESS_EQUAL: 'less_equal',
+    TT.HAT: 'power',
+}
+
+
+def binary(operator, left, right):
+    """ Apply a binary operator to an array and an array or a number """
+    left, right = unwrap(left), unwrap(right)
+    for operand in (left, right):
+        if not isinstance(operand, (int, float, numpy.ndarray)):
+            raise RuntimeException(operator, "Operands must be numbers or arrays.")
+    if operator.type == TT.SLASH and numpy.any(right == 0):
+        raise RuntimeException(operator, "Attempted to divide by zero.")
+    if operator.type == TT.HAT and numpy.any(numpy.asarray(right) < 0):
+        # NumPy refuses negative integer powers of integers
+        left = numpy.asarray(left, dtype=float)
+
+    try:
+        return wrap(getattr(numpy, OPERATIONS[operator.type])(left, right))
+    except ValueError:
+        raise RuntimeException(operator, "Can not combine arrays of shapes {} and {}.".format(
+            shape_of(left), shape_of(right)))
+
+
+def shape_of(value):
+    return list(numpy.shape(value))
+
+
+def to_array(token, value):
+    """ The array of a list, range, slice or array """
+    load_numpy(token)
+    if isinstance(value, NebbdyrArray):
+        return value
+    if is_range(value):
+        values = value.range
+        return NebbdyrArray(numpy.arange(values.start, values.stop, values.step))
+    if isinstance(value, (NebbdyrRange, NebbdyrSlice, NebbdyrShared)):
+        value = value.to_list()
+    if not isinstance(value, list):
+        raise RuntimeException(token, "Arrays are made from lists, ranges, slices or arrays.")
+
+    try:
+        array = numpy.array([unwrap(item) for item in value])
+    except ValueError:
+        array = None
+    if array is None or array.dtype.kind not in 'biuf':
+        raise RuntimeException(token, "Arrays can only hold numbers, and "
+                               "nested lists must have equal lengths.")
+    return NebbdyrArray(array)
+
+
+def reduce(token, name, value):
+    """ Reduce a list, range or array with sum, min, max or mean """
+    array = to_array(token, value).array
+    if array.size == 0 and name != 'sum':
+        raise RuntimeException(token, "Can not take the {} of an empty array.".format(name))
+    return wrap(getattr(numpy, name)(array))
+
+
+def matmul(token, left, right):
+    left, right = to_array(token, left), to_array(token, right)
+    try:
+        return wrap(numpy.matmul(left.array, right.array))
+    except ValueError:
+        raise RuntimeException(token, "Can not multiply matrices of shapes {} and {}.".format(
+            shape_of(left.array), shape_of(right.array)))
+
+
+def reshape(token, value, shape):
+    array = to_array(token, value).array
+    try:
+        return wrap(array.reshape([int(size) for size in shape]))
+    except (TypeError, ValueError):
+        raise RuntimeException(token, "Can not reshape an array of shape {} to {}.".format(
+            shape_of(array), format_value(list(shape))))
@@ -1,9 +1,11 @@
-from nebbdyrinstance import NebbdyrInstance
+from nebbdyrinstance import NebbdyrInstance, Shape
 
 class NebbdyrClass:
     def __init__(self, name, methods):
         self.name = name
         self.methods = methods
+        # The shape of instances without fields
+        self.shape = Shape(self, {})
 
     def find_method(self, instance, name):
         if name in self.methods:
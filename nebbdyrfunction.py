@@ -1,22 +1,81 @@
 # -*- coding: utf-8 -*-
 
 from environment import Environment
-from errors import Return
+from memo import MISSING
+from runtime import TailCall
 
 
 class NebbdyrFunction:
     def __init__(self, declaration, closure):
         self.declaration = declaration
         self.closure = closure
+        # Counts the calls until the function is hot enough to be tiered up
+        self.calls = 0
+        self.compiled = None
+        # The cache of a function declared with memo
+        self.memo = None
 
     def call(self, interpreter, arguments):
-        environment = Environment(self.closure)
-        for i, parameter in enumerate(self.declaration.parameters):
-            environment.define(parameter, arguments[i])
-        try:
-            interpreter.execute_block(self.declaration.body, environment)
-        except Return as return_value:
-            return return_value.value
+        function = self
+        # The caches waiting for the result of this call
+        pending = None
+        # Tail calls come back as a TailCall and run in this loop, so they
+        # don't grow the Python stack
+        while True:
+            memo = function.memo
+            if memo is not None:
+                key = memo.key(arguments)
+                if key is not None:
+                    value = memo.get(key)
+                    if value is not MISSING:
+                        break
+                    if pending is None:
+                        pending = []
+                    pending.append((memo, key))
+
+            if (function.compiled is None and
+                    interpreter.tier_threshold is not None):
+                function.calls += 1
+                if function.calls == interpreter.tier_threshold:
+                    function.compiled = interpreter.tier_up(function)
+
+            if function.compiled is not None:
+                # Transpiled functions return their value or a TailCall
+                completion = function.compiled(arguments)
+                if type(completion) is not TailCall:
+                    value = completion
+                    break
+            else:
+                completion = function.execute(interpreter, arguments)
+                if completion is None:
+                    value = None
+                    break
+                if type(completion) is not TailCall:
+                    value = completion.value
+                    break
+            function = completion.function
+            arguments = completion.arguments
+
+        if pending is not None:
+            # A tail call returns the result of the call it was made from.
+            # The outermost call is stored last, as the most recently used
+            for memo, key in reversed(pending):
+                memo.store(key, value)
+        return value
+
+    def __getstate__(self):
+        # Sent to the workers of a parallel for without the transpiled code
+        state = self.__dict__.copy()
+        state['calls'] = 0
+        state['compiled'] = None
+        return state
+
+    def execute(self, interpreter, arguments):
+        """ Run the body on the arguments, returning its Completion """
+        environment = Environment(self.closure, self.declaration.layout)
+        for i, argument in enumerate(arguments):
+            environment.define(i, argument)
+        return interpreter.execute_block(self.declaration.body, environment)
 
     def Nebbdyr_function(self, declaration):
         self.declaration = declaration
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+
+class NebbdyrFuture:
+    """
+    The result of a call made by spawn. The call is queued on the
+    executor of the interpreter, and the first thread waiting for it
+    runs it itself if no worker has started it yet.
+    """
+    __slots__ = ('submitted', 'callee', 'arguments', 'decode', 'result',
+                 'cancelled', 'lock')
+
+    def __init__(self, submitted, callee, arguments, decode):
+        # The concurrent.futures.Future of the queued call
+        self.submitted = submitted
+        self.callee = callee
+        self.arguments = arguments
+        # Turns what the worker returned into (value, error)
+        self.decode = decode
+        # (value, error) once the call is done
+        self.result = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def __reduce__(self):
+        # Futures sent to worker processes keep their result, but can't be
+        # waited for there
+        return (finished, (self.result,))
+
+    def done(self):
+        return (self.result is not None or self.cancelled or
+                self.submitted is None or self.submitted.done())
+
+    def __str__(self):
+        return "<future>"
+
+    def __repr__(self):
+        return str(self)
+
+
+def finished(result):
+    """ A future of another process, with the result it had when it was sent """
+    future = NebbdyrFuture(None, None, None, None)
+    future.result = result
+    return future
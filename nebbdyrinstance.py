@@ -1,22 +1,117 @@
 from errors import RuntimeException
 
+class PropertyCounters:
+    """ The hits and misses of the inline caches of Get expressions """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0
+        return "{} hits, {} misses ({:.0%} hits)".format(self.hits,
+                                                         self.misses, rate)
+
+
+class InlineCache:
+    """
+    The cache of a Get expression. It remembers what the name means on
+    instances of the shape it last saw: the index of the field, or the
+    method when the shape has no such field. They are kept together in
+    one tuple, replaced at once, as threads running the same function
+    share its caches.
+    """
+    __slots__ = ('entry',)
+
+    def __init__(self):
+        # (shape, index, method)
+        self.entry = (None, None, None)
+
+    def __repr__(self):
+        return "<inline cache>"
+
+    def __reduce__(self):
+        # Pickled and copied ASTs start out with empty caches
+        return (InlineCache, ())
+
+
+class Shape:
+    """
+    The fields of instances, mapping each name to its index in the values
+    of the instance. Instances of a class which got the same fields in the
+    same order share a shape, and setting a new field moves an instance on
+    to the shape with that field added.
+    """
+    __slots__ = ('klass', 'indices', 'transitions')
+
+    def __init__(self, klass, indices):
+        self.klass = klass
+        self.indices = indices
+        self.transitions = {}
+
+    def add(self, name):
+        shape = self.transitions.get(name)
+        if shape is None:
+            indices = dict(self.indices)
+            indices[name] = len(indices)
+            shape = Shape(self.klass, indices)
+            self.transitions[name] = shape
+        return shape
+
+
 class NebbdyrInstance:
+    __slots__ = ('shape', 'values')
+
     def __init__(self, klasse):
-        self.klasse = klasse
-        self.fields = {}
+        self.shape = klasse.shape
+        self.values = []
+
+    @property
+    def klasse(self):
+        return self.shape.klass
 
     def __str__(self):
-        return self.klasse.name + " instance"
+        return self.shape.klass.name + " instance"
 
     def get(self, name):
-        if name in self.fields:
-            return self.fields[name]
+        index = self.shape.indices.get(name.lexeme)
+        if index is not None:
+            return self.values[index]
 
-        method = self.klasse.find_method(self, name.lexeme)
+        method = self.shape.klass.find_method(self, name.lexeme)
         if method is not None:
             return method
 
         raise RuntimeException(name, f"Undefined property {name.lexeme}.")
 
+    def get_cached(self, name, cache, counters):
+        """ Get a property, using and updating the cache of the Get """
+        shape = self.shape
+        entry = cache.entry
+        if entry[0] is not shape:
+            counters.misses += 1
+            entry = self.fill_cache(name, cache, shape)
+        else:
+            counters.hits += 1
+
+        _, index, method = entry
+        if index is not None:
+            return self.values[index]
+        if method is not None:
+            return method
+
+        raise RuntimeException(name, f"Undefined property {name.lexeme}.")
+
+    def fill_cache(self, name, cache, shape):
+        entry = (shape, shape.indices.get(name.lexeme),
+                 shape.klass.find_method(self, name.lexeme))
+        cache.entry = entry
+        return entry
+
     def set(self, name, value):
-        self.fields[name] = value
+        index = self.shape.indices.get(name.lexeme)
+        if index is None:
+            self.shape = self.shape.add(name.lexeme)
+            self.values.append(value)
+        else:
+            self.values[index] = value
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+
+class NebbdyrRange:
+    """
+    The list built by [start..stop] or [start, next..stop]. It behaves
+    like the list when indexed, iterated, printed and compared, but only
+    holds the bounds until an element is assigned, when it turns into a
+    real list. Slices made before then are ranges of their own. Operations
+    producing a new list build a real one.
+    """
+    __slots__ = ('range',)
+
+    def __init__(self, range):
+        self.range = range
+
+    def __len__(self):
+        return len(self.range)
+
+    def __getitem__(self, index):
+        return self.range[index]
+
+    def __setitem__(self, index, value):
+        self.materialize()[index] = value
+
+    def __iter__(self):
+        return iter(self.range)
+
+    def __eq__(self, other):
+        if is_range(self) and is_range(other):
+            return self.range == other.range
+        if isinstance(other, (NebbdyrRange, list)):
+            return (len(other) == len(self.range) and
+                    all(a == b for a, b in zip(self.range, other)))
+        return NotImplemented
+
+    def __add__(self, other):
+        if isinstance(other, (NebbdyrRange, list)):
+            return self.to_list() + list(other)
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, list):
+            return other + self.to_list()
+        return NotImplemented
+
+    def to_list(self):
+        return list(self.range)
+
+    def materialize(self):
+        """ The elements as a list, which the range holds from then on """
+        if type(self.range) is range:
+            self.range = list(self.range)
+        return self.range
+
+    def __str__(self):
+        return "[" + ", ".join(str(value) for value in self.range) + "]"
+
+    def __repr__(self):
+        return str(self)
+
+
+def is_range(value):
+    """ Whether value is a range which still only holds its bounds """
+    return type(value) is NebbdyrRange and type(value.range) is range
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lists of numbers in shared memory, made by the shared builtin.
+
+A shared list is pickled as the name of its segment, so worker processes
+attach to the same memory instead of getting a copy, and what they store
+in it is seen by every process. The segments a process has made or
+attached to are closed when it exits, and the ones it made are removed
+then, or by free.
+"""
+
+import standardlibrary
+import array
+import atexit
+from multiprocessing import shared_memory
+
+from errors import RuntimeException
+from token import Token
+from tokentype import TokenType
+
+# The size of an element, which are 64 bit integers or doubles
+ITEMSIZE = 8
+
+# The error of using a list after it was freed, which the shared builtin
+# reports when there is no token of the script to report it at
+FREED = "The shared list has been freed."
+CORE_TOKEN = Token(TokenType.IDENTIFIER, "shared", None, "core")
+OUT_OF_RANGE = "The value is out of range of the 64 bit numbers of a shared list."
+
+# The segments of this process by name
+SEGMENTS = {}
+
+
+class Segment:
+    """ A shared memory segment and the typed view of its elements """
+    def __init__(self, memory, typecode, length, owner):
+        self.memory = memory
+        self.view = memory.buf[:length*ITEMSIZE].cast(typecode)
+        # Whether this process made the segment, and removes it
+        self.owner = owner
+
+    def free(self):
+        if self.view is None:
+            return
+        # The view has to be released before the memory can be closed
+        self.view.release()
+        self.view = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+        del SEGMENTS[self.memory.name]
+        # A freed list is pickled as it is, instead of attaching again
+        self.memory = None
+
+
+@atexit.register
+def free_all():
+    for segment in list(SEGMENTS.values()):
+        segment.free()
+
+
+class NebbdyrShared:
+    """
+    A list of whole numbers or of decimal numbers in a shared memory
+    segment. It behaves like a list when indexed, iterated, printed and
+    compared, and its elements can be assigned.
+    """
+    __slots__ = ('segment', 'typecode', 'length')
+
+    def __init__(self, segment, typecode, length):
+        self.segment = segment
+        self.typecode = typecode
+        self.length = length
+
+    def __reduce__(self):
+        if self.freed():
+            return (NebbdyrShared, (self.segment, self.typecode, self.length))
+        return (attach, (self.segment.memory.name, self.typecode,
+                         self.length))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.view()[index].tolist()
+        return self.view()[index]
+
+    def __setitem__(self, index, value):
+        view = self.view()
+        if type(value) is not (int if self.typecode == 'q' else float):
+            if type(value) is not int:
+                kind = "whole" if self.typecode == 'q' else "decimal"
+                raise TypeError("A shared list of {} numbers can not hold {}.".format(kind, value))
+        try:
+            view[index] = float(value) if self.typecode == 'd' else value
+        except (ValueError, OverflowError):
+            raise ValueError(OUT_OF_RANGE)
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __eq__(self, other):
+        if isinstance(other, (NebbdyrShared, list)):
+            return (len(other) == len(self) and
+                    all(a == b for a, b in zip(self, other)))
+        return NotImplemented
+
+    def __add__(self, other):
+        if isinstance(other, NebbdyrShared):
+            return self.to_list() + other.to_list()
+        return NotImplemented
+
+    def to_list(self):
+        return self.view().tolist()
+
+    def view(self):
+        """ The typed view of the elements, unless the list was freed """
+        if self.segment.view is None:
+            raise RuntimeException(CORE_TOKEN, FREED)
+        return self.segment.view
+
+    def freed(self):
+        return self.segment.view is None
+
+    def free(self):
+        self.segment.free()
+
+    def __str__(self):
+        return str(self.to_list())
+
+    def __repr__(self):
+        return str(self)
+
+
+def make(token, value):
+    """ The shared list of a list, range or slice of numbers, or of zeros """
+    if type(value) in (int, float):
+        if value < 0 or value != int(value):
+            raise RuntimeException(token, "The length of a shared list must be a whole number.")
+        return create([0.0]*int(value))
+    if not hasattr(value, '__len__') or isinstance(value, str):
+        raise RuntimeException(token, "Shared lists are made from lists, ranges, slices, arrays or a length.")
+    values = list(value)
+    if any(type(item) not in (int, float) for item in values):
+        raise RuntimeException(token, "Shared lists can only hold numbers.")
+    try:
+        return create(values)
+    except OverflowError:
+        raise RuntimeException(token, OUT_OF_RANGE)
+
+
+def create(values):
+    """ A shared list holding values, which must all be numbers """
+    typecode = 'q' if all(type(value) is int for value in values) else 'd'
+    length = len(values)
+    # Converted before the memory is made, which fails for large numbers
+    values = array.array(typecode, values)
+    memory = shared_memory.SharedMemory(create=True,
+                                        size=max(1, length*ITEMSIZE))
+    segment = Segment(memory, typecode, length, True)
+    SEGMENTS[memory.name] = segment
+    segment.view[:] = values
+    return NebbdyrShared(segment, typecode, length)
+
+
+def attach(name, typecode, length):
+    """ The shared list of the segment name, attaching to it at most once """
+    segment = SEGMENTS.get(name)
+    if segment is None:
+        segment = Segment(shared_memory.SharedMemory(name=name), typecode,
+                          length, False)
+        SEGMENTS[name] = segment
+    return NebbdyrShared(segment, typecode, length)
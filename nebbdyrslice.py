@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+from itertools import islice
+from nebbdyrshared import NebbdyrShared
+
+
+class NebbdyrSlice:
+    """
+    The elements start up to stop of a list, made by a[i..j]. It shares
+    the storage of the list instead of copying it, and behaves like a
+    list when indexed, iterated, printed and compared. Slicing a slice
+    gives a slice of the same list.
+    """
+    __slots__ = ('list', 'start', 'stop')
+
+    def __init__(self, list, start, stop):
+        self.list = list
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        length = self.stop - self.start
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("slice index out of range")
+        return self.list[self.start + index]
+
+    def __setitem__(self, index, value):
+        length = self.stop - self.start
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("slice index out of range")
+        self.list[self.start + index] = value
+
+    def __iter__(self):
+        return islice(self.list, self.start, self.stop)
+
+    def __eq__(self, other):
+        if isinstance(other, (NebbdyrSlice, list, NebbdyrShared)):
+            return (len(other) == len(self) and
+                    all(a == b for a, b in zip(self, other)))
+        return NotImplemented
+
+    def __add__(self, other):
+        if isinstance(other, NebbdyrSlice):
+            return self.to_list() + other.to_list()
+        return NotImplemented
+
+    def to_list(self):
+        return self.list[self.start:self.stop]
+
+    def __str__(self):
+        return str(self.to_list())
+
+    def __repr__(self):
+        return str(self)
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 
 from enum import Enum, unique
+from nebbdyrrange import NebbdyrRange
+from nebbdyrslice import NebbdyrSlice
+from nebbdyrarray import NebbdyrArray
+from nebbdyrfuture import NebbdyrFuture
+from nebbdyrshared import NebbdyrShared
 
 
 @unique
@@ -13,6 +18,8 @@ class Type(Enum):
     DICTIONARY = 5
     NONE = 6
     FLOAT = 7
+    ARRAY = 8
+    FUTURE = 9
 
     @classmethod
     def type(cls, var):
@@ -22,8 +29,12 @@ class Type(Enum):
             return cls.INT
         if isinstance(var, str):
             return cls.STRING
-        if isinstance(var, list):
+        if isinstance(var, (list, NebbdyrRange, NebbdyrSlice, NebbdyrShared)):
             return cls.LIST
+        if isinstance(var, NebbdyrArray):
+            return cls.ARRAY
+        if isinstance(var, NebbdyrFuture):
+            return cls.FUTURE
         if isinstance(var, tuple):
             return cls.TUPLE
         if isinstance(var, dict):
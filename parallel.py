@@ -0,0 +1,954 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs parallel for loops, parallel regions, spawned calls and the pmap,
+pfilter and preduce builtins in worker processes or threads.
+
+The collection is cut into chunks, and every chunk is run by a fresh
+interpreter of the same backend. The worker gets the globals of the
+program and, for loops, the body and the values of the outer locals it
+reads, all of which become globals of the worker. The body was resolved
+where it was written, so the worker resolves it again inside a loop over
+its chunk.
+
+What the workers print is collected and printed in order once the chunks
+are done. The body of a loop may only assign the reduction variables of
+the loop, which every chunk starts at the identity of their operator.
+The parts are combined with the operator in order, so the result is the
+same as running the loop serially, except that sums and products of
+floats may round differently. For loops run in parallel by
+--auto-parallel only reduce integers, strings and lists, so they
+always give the same result.
+
+A parallel region is run by a team of workers instead, every one of
+them running the whole body. The workers of a team share a lock for
+their critical sections and a barrier, and what they print inside a
+critical section is printed at once.
+
+Spawned calls are queued on an executor shared by the interpreter and
+the threads it forks. Waiting for a call no worker has started runs it
+in the waiting thread, so divide and conquer scripts waiting for their
+subtasks don't run out of workers.
+
+For loops the Resolver found independent iterations in run as parallel
+for loops with --auto-parallel, when the values they are run with allow
+it, see autoparallel.
+
+Given the addresses of workers started by nebbdyr.py --worker, parallel
+loops, the builtins and spawned calls are sent to them instead, see
+remote. Parallel regions always run on this machine, as their workers
+share a lock and a barrier.
+"""
+
+import standardlibrary
+import concurrent.futures
+import copy
+import io
+import math
+import multiprocessing
+import os
+import pickle
+import queue
+import sys
+import threading
+
+import stmt as st
+import remote
+import runtime
+from attributes import Attribute
+from errors import RuntimeException, IndexException
+from expr import Assign, Binary, Index, Literal, Variable
+from nebbdyrarray import NebbdyrArray
+from nebbdyrfuture import NebbdyrFuture
+from nebbdyrrange import NebbdyrRange, is_range
+from nebbdyrshared import NebbdyrShared
+from nebbdyrslice import NebbdyrSlice
+from resolver import Resolver
+from token import Token
+from tokentype import TokenType as TT
+
+# Without a chunk size, every chunk is this share of the iterations left
+# for each worker, so the first chunks are large and the last ones small
+GUIDED_SHARE = 2
+
+# The fewest iterations a for loop is run in parallel with by default.
+# Every run starts a pool of workers, which takes as long as some
+# thousands of iterations of a small body
+AUTO_MINIMUM = 10000
+
+# The names of the worker's variables, which scripts can't use
+CHUNK = "$chunk"
+INDEX = "$index"
+
+# Stand in for the globals and core functions of the program when pickled
+GLOBALS = "globals"
+CORE = "core"
+
+# The error of the workers of a team waiting for one which failed
+BROKEN = "Another worker of the parallel region stopped at an error."
+
+# The error of parallel work assigning a global in a function it calls
+ASSIGNED = "Parallel work can not assign to the global '{}', as every worker only changes its own copy of it. Make it a reduction of a parallel for or assign it after the work is done."
+
+
+class Options:
+    """ How parallel loops are run, set by nebbdyr.py """
+    def __init__(self):
+        self.workers = None
+        self.chunk_size = None
+        self.threads = False
+        # Whether for loops run in parallel when they can, and the fewest
+        # iterations they do so with
+        self.auto = False
+        self.auto_minimum = AUTO_MINIMUM
+        # The addresses of the remote workers, if any
+        self.hosts = None
+        # The executor running spawned calls, made by the first spawn
+        self.executor = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['executor'] = None
+        return state
+
+
+class Unsendable(RuntimeException):
+    """ Raised when the task of a worker process can not be pickled """
+    pass
+
+
+class Reporter:
+    """ Stands in for Nebbdyr in the workers, keeping the first error """
+    def __init__(self):
+        self.hadError = False
+        self.had_runtime_error = False
+        self.error_token = None
+        self.error_message = None
+
+    def error(self, origin, message):
+        self.hadError = True
+        if self.error_message is None:
+            self.error_message = message
+
+    def runtime_error(self, error):
+        self.had_runtime_error = True
+        if self.error_message is None:
+            self.error_token = error.token
+            self.error_message = error.msg
+
+
+class Solo:
+    """ The team of the program outside of parallel regions """
+    id = 0
+    size = 1
+
+    def enter(self):
+        pass
+
+    def exit(self):
+        pass
+
+    def wait(self, token):
+        pass
+
+    def abort(self):
+        pass
+
+
+SOLO = Solo()
+
+
+class Team(Solo):
+    """ A worker of a parallel region and what it shares with the others """
+    def __init__(self, id, size, lock, barrier):
+        self.id = id
+        self.size = size
+        self.lock = lock
+        self.barrier = barrier
+        # The number of critical sections the worker is in, and where its
+        # output went before the outermost
+        self.depth = 0
+        self.output = None
+
+    def enter(self):
+        self.lock.acquire()
+        self.depth += 1
+        if self.depth == 1:
+            self.output = capture(None)
+
+    def exit(self):
+        if self.depth == 0:
+            return
+        self.depth -= 1
+        if self.depth == 0:
+            sys.stdout.flush()
+            capture(self.output)
+        self.lock.release()
+
+    def wait(self, token):
+        try:
+            self.barrier.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeException(token, BROKEN)
+
+    def abort(self):
+        """ Let the other workers go on after this one failed """
+        while self.depth > 0:
+            self.exit()
+        self.barrier.abort()
+
+
+class Task:
+    """ Everything a worker needs besides its backend and chunk """
+    def __init__(self, interpreter, variables):
+        self.tier_threshold = interpreter.tier_threshold
+        self.memo_size = interpreter.memo_size
+        self.vectorize = interpreter.vectorize
+        self.options = interpreter.parallel
+        # The globals and captured locals as (name, value, attributes)
+        self.variables = variables
+        # The names of the variables the workers may assign
+        self.reduced = set()
+        # The names of the captured locals
+        self.captured = set()
+
+    def check_assigned(self, globals, names=None):
+        """
+        Raise when one of the variables sent, or of those of them named by
+        names, no longer holds the value sent to the workers
+        """
+        for name, value, _ in self.variables:
+            if (name not in self.reduced and
+                    (names is None or name in names) and
+                    globals.values[name].value is not value):
+                raise RuntimeException(None, ASSIGNED.format(name))
+
+    def check_globals(self, interpreter, token):
+        """
+        Raise at token when the functions run by threads assigned one of
+        the globals of the program, which some backends write directly
+        """
+        globals = interpreter.globals
+        names = {name for name in globals.values
+                 if name not in self.captured}
+        try:
+            self.check_assigned(globals, names)
+        except RuntimeException as error:
+            raise RuntimeException(token, error.msg)
+
+
+class RegionTask(Task):
+    def __init__(self, interpreter, variables, stmt, reductions):
+        super(RegionTask, self).__init__(interpreter, variables)
+        self.line = stmt.keyword.line
+        self.body = stmt.body
+        # The reduction variables as (name, identity)
+        self.reductions = reductions
+        self.reduced = {name for name, _ in reductions}
+        self.captured = {variable.name.lexeme for variable in stmt.captures}
+
+    def copy(self):
+        # Threads resolve their own copy of the body
+        task = copy.copy(self)
+        task.body = copy.deepcopy(self.body)
+        return task
+
+    def program(self, globals, chunk):
+        return [self.body]
+
+
+class LoopTask(RegionTask):
+    def __init__(self, interpreter, variables, stmt, reductions):
+        super(LoopTask, self).__init__(interpreter, variables, stmt,
+                                       reductions)
+        self.name = stmt.name
+
+    def program(self, globals, chunk):
+        globals.define(make_token(CHUNK, self.line), chunk, [])
+        return loop(self.name, self.body, len(chunk))
+
+
+class FunctionTask(Task):
+    def __init__(self, interpreter, variables, kind, function,
+                 arguments=None):
+        super(FunctionTask, self).__init__(interpreter, variables)
+        # 'map', 'filter', 'reduce' or 'call'
+        self.kind = kind
+        self.function = function
+        # The arguments of a spawned call
+        self.arguments = arguments
+
+    def copy(self):
+        return self
+
+
+class ThreadOutput:
+    """ Sends what every worker thread prints to the buffer of the thread """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class Pickler(pickle.Pickler):
+    """
+    Pickles the globals and core functions of the program as references
+    to those of the interpreter unpickling them
+    """
+    def __init__(self, file, globals):
+        super(Pickler, self).__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.globals = globals
+        self.core = {id(variable.value): name
+                     for name, variable in globals.values.items()
+                     if Attribute.CORE in variable.attributes and
+                     hasattr(variable.value, 'call')}
+
+    def persistent_id(self, value):
+        if value is self.globals:
+            return GLOBALS
+        name = self.core.get(id(value))
+        if name is not None and self.globals.values[name].value is value:
+            return (CORE, name)
+        return None
+
+
+class Unpickler(pickle.Unpickler):
+    def __init__(self, file, globals):
+        super(Unpickler, self).__init__(file)
+        self.globals = globals
+
+    def persistent_load(self, id):
+        if id == GLOBALS:
+            return self.globals
+        return self.globals.values[id[1]].value
+
+
+def dumps(value, globals):
+    buffer = io.BytesIO()
+    Pickler(buffer, globals).dump(value)
+    return buffer.getvalue()
+
+
+def loads(data, globals):
+    return Unpickler(io.BytesIO(data), globals).load()
+
+
+def make_token(lexeme, line, type=TT.IDENTIFIER):
+    return Token(type, lexeme, None, line)
+
+
+def loop(name, body, length):
+    """ The program running body for every element of the chunk """
+    line = name.line
+    index = make_token(INDEX, line)
+    element = Index(Variable(make_token(CHUNK, line)),
+                    make_token("]", line, TT.RIGHT_BRACKET), [Variable(index)])
+    # The index is incremented before the body, so continue moves on
+    step = Assign(index, Binary(Variable(index), make_token("+", line, TT.PLUS),
+                                Literal(1)))
+    iteration = st.Block([st.Var(name, element), st.Expression(step), body])
+    condition = Binary(Variable(index), make_token("<", line, TT.LESS),
+                       Literal(length))
+    return [st.Block([st.Mut(index, Literal(0)),
+                      st.While(condition, iteration)])]
+
+
+def capture(buffer):
+    """
+    Send what the worker prints to buffer, or straight out when buffer is
+    None, returning where it went before
+    """
+    if isinstance(sys.stdout, ThreadOutput):
+        previous = getattr(sys.stdout.local, 'buffer', None)
+        sys.stdout.local.buffer = buffer
+    else:
+        previous = None if sys.stdout is sys.__stdout__ else sys.stdout
+        sys.stdout = sys.__stdout__ if buffer is None else buffer
+    return previous
+
+
+def captured(output, action):
+    """ Run action, sending what it prints to output """
+    previous = capture(output)
+    try:
+        return action()
+    finally:
+        capture(previous)
+
+
+def run_chunk(backend, task, chunk, team=SOLO):
+    """
+    Run a task on a chunk in a worker, returning what it printed, its
+    result and the error it stopped at. Processes get the task and return
+    the result pickled.
+    """
+    reporter = Reporter()
+    interpreter = backend(reporter)
+    interpreter.team = team
+    globals = interpreter.globals
+    pickled = isinstance(task, bytes)
+    task = loads(task, globals) if pickled else task.copy()
+    interpreter.tier_threshold = task.tier_threshold
+    interpreter.memo_size = task.memo_size
+    interpreter.vectorize = task.vectorize
+    interpreter.parallel = copy.copy(task.options)
+    # The for loops of a worker run serially
+    interpreter.parallel.auto = False
+    if pickled:
+        # Parallel work in a worker process runs in threads, instead of
+        # every worker starting processes of its own
+        interpreter.parallel.threads = True
+    line = 0
+    for name, value, attributes in task.variables:
+        globals.define(make_token(name, line), value, attributes)
+
+    output = io.StringIO()
+    if isinstance(task, RegionTask):
+        result = run_program(interpreter, reporter, task, chunk, output)
+    else:
+        try:
+            result = captured(output, lambda: apply(interpreter, task, chunk))
+        except (RuntimeException, IndexException) as error:
+            reporter.runtime_error(error)
+            result = None
+    if reporter.error_message is None:
+        try:
+            task.check_assigned(globals)
+        except RuntimeException as error:
+            reporter.runtime_error(error)
+    if reporter.error_message is not None:
+        team.abort()
+    if pickled:
+        result = dumps(result, globals)
+    return (output.getvalue(), result,
+            (reporter.error_token, reporter.error_message))
+
+
+def run_program(interpreter, reporter, task, chunk, output):
+    """ The values of the reduction variables after running a loop or region """
+    globals = interpreter.globals
+    for name, identity in task.reductions:
+        globals.define(make_token(name, task.line), identity,
+                       [Attribute.UNSTABLE, Attribute.MUTABLE])
+
+    program = task.program(globals, chunk)
+    Resolver(interpreter, reporter).resolve(program)
+    if not reporter.hadError:
+        captured(output, lambda: interpreter.interpret(program))
+    return [globals.values[name].value for name, _ in task.reductions]
+
+
+def apply(interpreter, task, chunk):
+    """ Map, filter or reduce a chunk with the function of the task """
+    function = task.function
+    if task.kind == 'call':
+        return function.call(interpreter, task.arguments)
+    if task.kind == 'map':
+        return [function.call(interpreter, [value]) for value in chunk]
+    if task.kind == 'filter':
+        return [value for value in chunk
+                if runtime.is_truthy(function.call(interpreter, [value]))]
+    values = iter(chunk)
+    result = next(values)
+    for value in values:
+        result = function.call(interpreter, [result, value])
+    return result
+
+
+def schedule(length, workers, size=None):
+    """
+    The sizes of the chunks to cut length iterations into. Without a
+    size, every chunk takes a share of what is left, so the large early
+    chunks amortize the cost of sending a chunk and the small late ones
+    keep the workers busy until the end.
+    """
+    sizes = []
+    while length > 0:
+        chunk = size or math.ceil(length / (workers * GUIDED_SHARE))
+        chunk = min(chunk, length)
+        sizes.append(chunk)
+        length -= chunk
+    return sizes
+
+
+def chunks(collection, sizes):
+    """ Cut a list, range, slice or array into chunks of the given sizes """
+    if isinstance(collection, NebbdyrRange):
+        values = collection.range
+        cut = lambda start, stop: NebbdyrRange(values[start:stop])
+    elif isinstance(collection, NebbdyrArray):
+        cut = lambda start, stop: NebbdyrArray(collection.array[start:stop])
+    elif isinstance(collection, NebbdyrShared):
+        # Slices of a shared list are sent without copying the elements
+        cut = lambda start, stop: NebbdyrSlice(collection, start, stop)
+    elif (isinstance(collection, NebbdyrSlice) and
+          isinstance(collection.list, NebbdyrShared)):
+        offset = collection.start
+        cut = lambda start, stop: NebbdyrSlice(collection.list, offset + start,
+                                               offset + stop)
+    else:
+        if isinstance(collection, NebbdyrSlice):
+            collection = collection.to_list()
+        cut = lambda start, stop: collection[start:stop]
+    parts = []
+    start = 0
+    for size in sizes:
+        parts.append(cut(start, start + size))
+        start += size
+    return parts
+
+
+def identity(operator, name, value):
+    """ The value every chunk starts a reduction variable at """
+    if type(value) not in (int, float, str, list):
+        raise RuntimeException(name, "Reduction variable '{}' must hold a number, a string or a list, not {}.".format(name.lexeme, runtime.stringify(value)))
+    if operator.type == TT.PLUS:
+        return type(value)()
+    if type(value) not in (int, float):
+        raise RuntimeException(name, "Only numbers can be reduced with '*'.")
+    return type(value)(1)
+
+
+def executor(options, workers):
+    if options.threads:
+        return concurrent.futures.ThreadPoolExecutor(workers)
+    if options.hosts:
+        return remote.Executor(options.hosts)
+    return concurrent.futures.ProcessPoolExecutor(workers)
+
+
+def shutdown(options):
+    """
+    Stop the executor of spawned calls, cancelling those no worker has
+    started. A cancelled call still runs in the thread waiting for it.
+    """
+    if options.executor is not None:
+        options.executor.shutdown(cancel_futures=True)
+        options.executor = None
+
+
+def global_variables(interpreter):
+    """ The globals the program has declared, as (name, value, attributes) """
+    return [(name, variable.value, variable.attributes)
+            for name, variable in interpreter.globals.values.items()
+            if Attribute.CORE not in variable.attributes]
+
+
+def dispatch(interpreter, token, task, parts, workers):
+    """
+    Run the task on every part in the pool, printing what the workers
+    printed and returning their results in order
+    """
+    options = interpreter.parallel
+    backend = type(interpreter)
+    if options.threads:
+        stdout = sys.stdout
+        sys.stdout = ThreadOutput(stdout)
+    else:
+        # Pickle once instead of once for every chunk
+        try:
+            task = dumps(task, interpreter.globals)
+        except (pickle.PicklingError, TypeError, AttributeError) as error:
+            raise Unsendable(token, "Can not send the variables to worker processes ({}). Run with --threads instead.".format(error))
+    try:
+        with executor(options, min(workers, len(parts))) as pool:
+            results = list(pool.map(run_chunk, [backend]*len(parts),
+                                    [task]*len(parts), parts))
+    except remote.WorkerError as error:
+        raise RuntimeException(token, str(error))
+    finally:
+        if options.threads:
+            sys.stdout = stdout
+
+    return collect(interpreter, token, results)
+
+
+def collect(interpreter, token, results):
+    """
+    Print what the workers printed and return their results, raising the
+    error of the first which failed. What the workers after it printed is
+    dropped, as a serial loop would have stopped there. Workers only
+    stopped at a barrier by that failure are printed, but never reported.
+    """
+    broken = None
+    for output, _, (error_token, message) in results:
+        sys.stdout.write(output)
+        if message == BROKEN:
+            broken = broken or (error_token, message)
+        elif message is not None:
+            raise RuntimeException(error_token or token, message)
+    if broken is not None:
+        error_token, message = broken
+        raise RuntimeException(error_token or token, message)
+    if interpreter.parallel.threads:
+        return [value for _, value, _ in results]
+    return [loads(value, interpreter.globals) for _, value, _ in results]
+
+
+def assemble(interpreter, token, task, size):
+    """ Run the task on a team of size workers, returning their results """
+    backend = type(interpreter)
+    sys.stdout.flush()
+    if interpreter.parallel.threads:
+        lock = threading.RLock()
+        barrier = threading.Barrier(size)
+        results = [None]*size
+
+        def member(id):
+            team = Team(id, size, lock, barrier)
+            results[id] = run_chunk(backend, task, None, team)
+
+        stdout = sys.stdout
+        sys.stdout = ThreadOutput(stdout)
+        try:
+            threads = [threading.Thread(target=member, args=(id,))
+                       for id in range(size)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.stdout = stdout
+        return collect(interpreter, token, results)
+
+    try:
+        task = dumps(task, interpreter.globals)
+    except (pickle.PicklingError, TypeError, AttributeError) as error:
+        raise RuntimeException(token, "Can not send the variables to worker processes ({}). Run with --threads instead.".format(error))
+    context = multiprocessing.get_context()
+    lock = context.RLock()
+    barrier = context.Barrier(size)
+    results = context.Queue()
+    processes = [context.Process(target=member_process,
+                                 args=(backend, task, id, size, lock,
+                                       barrier, results))
+                 for id in range(size)]
+    for process in processes:
+        process.start()
+    collected = [None]*size
+    try:
+        for _ in range(size):
+            id, result = receive(results, processes, collected)
+            collected[id] = result
+    finally:
+        barrier.abort()
+        for process in processes:
+            process.join()
+    return collect(interpreter, token, collected)
+
+
+def receive(results, processes, collected):
+    """ The next result of a team, or None for a worker which died """
+    while True:
+        try:
+            return results.get(timeout=0.1)
+        except queue.Empty:
+            for id, process in enumerate(processes):
+                if collected[id] is None and process.exitcode is not None:
+                    return id, ('', None, (None, "A worker of the parallel region died."))
+
+
+def member_process(backend, task, id, size, lock, barrier, results):
+    results.put((id, run_chunk(backend, task, None,
+                               Team(id, size, lock, barrier))))
+
+
+def serve(address):
+    """ Run the work other interpreters send to address, see remote """
+    # Connections are run in threads of their own
+    sys.stdout = ThreadOutput(sys.stdout)
+    remote.serve(address)
+
+
+def worker_count(interpreter, workers=None):
+    options = interpreter.parallel
+    if options.hosts and not options.threads:
+        return workers or options.workers or len(options.hosts)
+    return workers or options.workers or os.cpu_count() or 1
+
+
+def team_size(interpreter, stmt):
+    """
+    The number of workers of a parallel region, from the region, the
+    localomp global, the OMP_NUM_THREADS environment variable or
+    --workers, in that order
+    """
+    if stmt.workers is not None:
+        return stmt.workers
+    localomp = interpreter.globals.values["localomp"].value
+    if localomp is not None:
+        if (type(localomp) not in (int, float) or localomp < 1 or
+                localomp != int(localomp)):
+            raise RuntimeException(stmt.keyword, "localomp must be a positive whole number, not {}.".format(runtime.stringify(localomp)))
+        return int(localomp)
+    variable = os.environ.get("OMP_NUM_THREADS")
+    if variable:
+        # OpenMP takes a list of sizes for nested regions
+        try:
+            size = int(variable.split(',')[0])
+        except ValueError:
+            size = 0
+        if size < 1:
+            raise RuntimeException(stmt.keyword, "OMP_NUM_THREADS must be a positive whole number, not '{}'.".format(variable))
+        return size
+    return interpreter.parallel.workers or os.cpu_count() or 1
+
+
+def identities(stmt, reductions):
+    return [(name.lexeme, identity(operator, name, value))
+            for (operator, name), value in zip(stmt.reductions, reductions)]
+
+
+def variables(interpreter, stmt, captures):
+    """ The globals and the captured locals of a parallel for or region """
+    return global_variables(interpreter) + [
+        (variable.name.lexeme, value, [])
+        for variable, value in zip(stmt.captures, captures)]
+
+
+def shares(value):
+    """ Whether the stores of worker processes into value are seen by all """
+    return (isinstance(value, NebbdyrShared) or
+            (isinstance(value, NebbdyrSlice) and
+             isinstance(value.list, NebbdyrShared)))
+
+
+def check_stores(interpreter, stmt, variables):
+    """
+    Reject a parallel for or region storing into outer lists which worker
+    processes would only change their copies of
+    """
+    if interpreter.parallel.threads:
+        return
+    values = {name: value for name, value, _ in variables}
+    kind = "region" if isinstance(stmt, st.ParallelRegion) else "for"
+    for name in stmt.stores:
+        if name.lexeme in values and not shares(values[name.lexeme]):
+            raise RuntimeException(name, "Parallel {} can not store into '{}', which is declared outside of it, unless it is a shared list. Make it with shared(...) or run with --threads.".format(kind, name.lexeme))
+
+
+def combine(stmt, reductions, results):
+    """ Reduce the values of the reduction variables of the workers in order """
+    values = list(reductions)
+    for partials in results:
+        for i, (operator, _) in enumerate(stmt.reductions):
+            values[i] = runtime.BINARY[operator.type](operator, values[i],
+                                                      partials[i])
+    return values
+
+
+def run_region(interpreter, stmt, captures, reductions):
+    """ Run a parallel region, returning the reduced reduction variables """
+    size = team_size(interpreter, stmt)
+    sent = variables(interpreter, stmt, captures)
+    check_stores(interpreter, stmt, sent)
+    task = RegionTask(interpreter, sent, stmt, identities(stmt, reductions))
+    results = assemble(interpreter, stmt.keyword, task, size)
+    task.check_globals(interpreter, stmt.keyword)
+    return combine(stmt, reductions, results)
+
+
+def run(interpreter, stmt, collection, captures, reductions):
+    """
+    Run a parallel for on a collection, or a parallel region, which has
+    no collection. captures are the values of the outer locals read by
+    the body and reductions the values of the reduction variables, which
+    are returned reduced.
+    """
+    if isinstance(stmt, st.ParallelRegion):
+        return run_region(interpreter, stmt, captures, reductions)
+    if not isinstance(collection, runtime.SEQUENCES):
+        raise RuntimeException(stmt.keyword, "Can only run a parallel for over a list, range or array.")
+    workers = worker_count(interpreter, stmt.workers)
+    sizes = schedule(len(collection), workers,
+                     stmt.chunk_size or interpreter.parallel.chunk_size)
+    if not sizes:
+        return reductions
+
+    sent = variables(interpreter, stmt, captures)
+    check_stores(interpreter, stmt, sent)
+    task = LoopTask(interpreter, sent, stmt, identities(stmt, reductions))
+    results = dispatch(interpreter, stmt.keyword, task,
+                       chunks(collection, sizes), workers)
+    task.check_globals(interpreter, stmt.keyword)
+    return combine(stmt, reductions, results)
+
+
+def auto(interpreter, stmt, collection, stores, captures, reductions):
+    """
+    Run the parallel version of a for loop, returning the reduced values
+    of its reduction variables, or None when the loop has to run serially
+    after all. stores are the lists the loop stores into at the loop
+    variable.
+    """
+    options = interpreter.parallel
+    if not options.auto or interpreter.team is not SOLO:
+        return None
+    if (not isinstance(collection, runtime.SEQUENCES) or
+            len(collection) < options.auto_minimum):
+        return None
+    if stores:
+        # Only the elements of a range are sure to be different indices,
+        # and only threads and shared lists see the stores of the others
+        if not is_range(collection):
+            return None
+        if not options.threads and not all(shares(store)
+                                           for store in stores):
+            return None
+    if worker_count(interpreter) < 2 and not options.hosts:
+        return None
+    for (operator, _), value in zip(stmt.reductions, reductions):
+        # Sums and products of floats depend on the order they are made
+        # in, which the chunks change
+        if type(value) is not int and (operator.type != TT.PLUS or
+                                       type(value) not in (str, list)):
+            return None
+    try:
+        return run(interpreter, stmt, collection, captures, reductions)
+    except Unsendable:
+        return None
+
+
+def check_function(token, function, arity):
+    if not hasattr(function, 'arity'):
+        raise RuntimeException(token, "Expected a function as the first argument.")
+    if function.arity() != arity:
+        raise RuntimeException(token, "Expected a function of {} arguments, but got one of {}.".format(arity, function.arity()))
+
+
+def apply_parallel(interpreter, token, kind, function, collection):
+    """ Run pmap, pfilter or preduce, returning the results of the chunks """
+    check_function(token, function, 2 if kind == 'reduce' else 1)
+    if not isinstance(collection, runtime.SEQUENCES):
+        raise RuntimeException(token, "Expected a list, range or array.")
+    workers = worker_count(interpreter)
+    sizes = schedule(len(collection), workers, interpreter.parallel.chunk_size)
+    if not sizes:
+        return []
+    task = FunctionTask(interpreter, global_variables(interpreter), kind,
+                        function)
+    results = dispatch(interpreter, token, task, chunks(collection, sizes),
+                       workers)
+    task.check_globals(interpreter, token)
+    return results
+
+
+def pmap(interpreter, token, function, collection):
+    parts = apply_parallel(interpreter, token, 'map', function, collection)
+    return [value for part in parts for value in part]
+
+
+def pfilter(interpreter, token, function, collection):
+    parts = apply_parallel(interpreter, token, 'filter', function, collection)
+    return [value for part in parts for value in part]
+
+
+def preduce(interpreter, token, function, collection, initial):
+    """
+    Reduce the collection with an associative function. Every chunk is
+    reduced by a worker, and the results of the chunks are combined
+    pairwise, as a tree, before being combined with initial.
+    """
+    values = apply_parallel(interpreter, token, 'reduce', function,
+                            collection)
+    while len(values) > 1:
+        pairs = [function.call(interpreter, values[i:i+2])
+                 for i in range(0, len(values) - 1, 2)]
+        if len(values) % 2:
+            pairs.append(values[-1])
+        values = pairs
+    for value in values:
+        initial = function.call(interpreter, [initial, value])
+    return initial
+
+
+def spawn(interpreter, token, callee, arguments):
+    """ Queue a call on the executor of the interpreter """
+    options = interpreter.parallel
+    if options.executor is None:
+        options.executor = executor(options, worker_count(interpreter))
+    if options.threads:
+        submitted = options.executor.submit(call, interpreter.fork(), callee,
+                                            arguments)
+        return NebbdyrFuture(submitted, callee, arguments,
+                             lambda interpreter, result: result)
+
+    task = FunctionTask(interpreter, global_variables(interpreter), 'call',
+                        callee, arguments)
+    try:
+        task = dumps(task, interpreter.globals)
+    except (pickle.PicklingError, TypeError, AttributeError) as error:
+        raise RuntimeException(token, "Can not send the call to a worker process ({}). Run with --threads instead.".format(error))
+    submitted = options.executor.submit(run_chunk, type(interpreter), task,
+                                        None)
+
+    def decode(interpreter, result):
+        # What the call printed comes out when it is waited for
+        output, value, (error_token, message) = result
+        sys.stdout.write(output)
+        if message is not None:
+            return (None, RuntimeException(error_token or token, message))
+        return (loads(value, interpreter.globals), None)
+    return NebbdyrFuture(submitted, callee, arguments, decode)
+
+
+def call(interpreter, callee, arguments):
+    """ Make a call, returning its value and the error it stopped at """
+    try:
+        return (callee.call(interpreter, arguments), None)
+    except (RuntimeException, IndexException) as error:
+        return (None, error)
+
+
+def check_future(token, future):
+    if not isinstance(future, NebbdyrFuture):
+        raise RuntimeException(token, "Expected a future made by spawn.")
+
+
+def wait(interpreter, token, future, timeout=None):
+    """
+    The value of a spawned call. Without a timeout, a call no worker has
+    started is run by the waiting thread.
+    """
+    check_future(token, future)
+    if timeout is not None and (type(timeout) not in (int, float) or
+                                timeout < 0):
+        raise RuntimeException(token, "The timeout must be a number of seconds.")
+    if future.result is None and future.submitted is None:
+        raise RuntimeException(token, "Can only wait for a future in the process which spawned it.")
+    with future.lock:
+        if (timeout is None and future.result is None and
+                not future.cancelled and future.submitted.cancel()):
+            future.result = call(interpreter, future.callee, future.arguments)
+    if future.result is None:
+        if future.cancelled:
+            raise RuntimeException(token, "The task was cancelled.")
+        try:
+            result = future.submitted.result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise RuntimeException(token, "Timed out waiting for the task.")
+        except remote.WorkerError as error:
+            raise RuntimeException(token, str(error))
+        with future.lock:
+            if future.result is None:
+                future.result = future.decode(interpreter, result)
+    value, error = future.result
+    if error is not None:
+        raise error
+    return value
+
+
+def cancel(token, future):
+    """ Cancel a spawned call no worker has started, returning whether it was """
+    check_future(token, future)
+    with future.lock:
+        if (future.result is None and not future.cancelled and
+                future.submitted is not None):
+            future.cancelled = future.submitted.cancel()
+        return future.cancelled
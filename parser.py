@@ -3,7 +3,8 @@
 from tokentype import TokenType as TT
 from expr import (Binary, Grouping, Literal, Unary,
                   Variable, Assign, Logical, Call,
-                  List, Get, Set, Index, Lambda, ListConstructor)
+                  List, Get, Set, Index, Lambda, ListConstructor, Slice,
+                  Spawn, SetIndex)
 import stmt
 
 from errors import ParseException
@@ -14,6 +15,10 @@ class Parser:
         self.nebbdyr = nebbdyr
         self.tokens = tokens
         self.loop_level = 0
+        # The loop level of the body of the enclosing parallel for or region
+        self.parallel_level = None
+        # The loop level where the enclosing critical section starts
+        self.critical_level = None
         self.current = 0
 
     def parse(self):
@@ -31,6 +36,8 @@ class Parser:
                 return self.class_declaration()
             if self.match(TT.FUN):
                 return self.function("function")
+            if self.match(TT.MEMO):
+                return self.memo_declaration()
             if self.match(TT.VAR):
                 return self.var_declaration()
             if self.match(TT.MUT):
@@ -58,6 +65,8 @@ class Parser:
     def statement(self):
         if self.match(TT.FOR):
             return self.for_statement()
+        if self.match(TT.PARALLEL):
+            return self.parallel_statement()
         if self.match(TT.IF):
             return self.if_statement()
         if self.match(TT.PRINT):
@@ -72,50 +81,114 @@ class Parser:
             return self.break_statement()
         if self.match(TT.CONTINUE):
             return self.continue_statement()
+        if self.match(TT.CRITICAL):
+            return self.critical_statement()
+        if self.match(TT.BARRIER):
+            return self.barrier_statement()
         return self.expression_statement()
 
     def for_statement(self):
-        next = self.consume(TT.IDENTIFIER, "Expect variable name.")
+        keyword = self.previous()
+        name = self.consume(TT.IDENTIFIER, "Expect variable name.")
         self.consume(TT.IN, "Expect 'in' after variable name.")
-        collection = self.consume(TT.IDENTIFIER, "Expect collection to iterate over.")
+        collection = self.expression()
         self.consume(TT.COLON, "Expect ':' to end 'for'.")
         self.consume(TT.NEWLINE, "Expect newline after ':'.")
 
-        # self.consume(TT.LEFT_PAREN, "Expect '(' after 'for'.")
-        # if self.match(TT.SEMICOLON):
-        #     initializer = None
-        # elif self.match(TT.VAR):
-        #     initializer = self.var_declaration()
-        # else:
-        #     initializer = self.expression_statement()
-
-        # condition = None
-        # if not self.check(TT.SEMICOLON):
-        #     condition = self.expression()
-        # self.consume(TT.SEMICOLON, "Expect ';' after loop condition")
-
-        # increment = None
-        # if not self.check(TT.RIGHT_PAREN):
-        #     increment = self.expression()
-        # self.consume(TT.RIGHT_PAREN, "Expect ')' after for clauses.")
-        iterator = stmt.Mut('')
-
-        body = self.statement()
-        body = stmt.Block([body, Assign(iterator, collection)])
-        body = stmt.While(None, body)
-        body = stmt.Block([stmt.Unstable(iterator, None), body])
+        try:
+            self.loop_level += 1
+            body = self.statement()
+            return stmt.For(keyword, name, collection, body)
+        finally:
+            self.loop_level -= 1
 
-        # if increment is not None:
-        #     body = stmt.Block([body, stmt.Expression(increment)])
+    def parallel_statement(self):
+        # parallel for, parallel(workers) for or parallel(workers, chunk size)
+        # for, and parallel: or parallel(workers): for a region
+        keyword = self.previous()
+        if self.parallel_level is not None:
+            raise self.error(keyword, "Parallel loops and regions can not be nested.")
+        workers = chunk_size = None
+        if self.match(TT.LEFT_PAREN):
+            workers = self.consume(TT.INT, "Expect worker count after '('.").literal
+            if workers < 1:
+                self.error(self.previous(), "Worker count must be positive.")
+            if self.match(TT.COMMA):
+                chunk_size = self.consume(TT.INT, "Expect chunk size after ','.").literal
+                if chunk_size < 1:
+                    self.error(self.previous(), "Chunk size must be positive.")
+            self.consume(TT.RIGHT_PAREN, "Expect ')' after worker count.")
+
+        if not self.match(TT.FOR):
+            if chunk_size is not None:
+                self.error(keyword, "Only a parallel for has a chunk size.")
+            reductions = self.reductions()
+            self.consume(TT.COLON, "Expect 'for' or ':' after 'parallel'.")
+            self.consume(TT.NEWLINE, "Expect newline after ':'.")
+            # The region is run by every worker, so it isn't a loop
+            enclosing_level = self.loop_level
+            try:
+                self.loop_level = 0
+                self.parallel_level = 0
+                body = self.statement()
+            finally:
+                self.loop_level = enclosing_level
+                self.parallel_level = None
+            return stmt.ParallelRegion(keyword, body, reductions, workers)
 
-        # if condition is None:
-        #     condition = Literal(True)
-        # body = stmt.While(condition, body)
+        name = self.consume(TT.IDENTIFIER, "Expect variable name.")
+        self.consume(TT.IN, "Expect 'in' after variable name.")
+        collection = self.expression()
+        reductions = self.reductions()
+        self.consume(TT.COLON, "Expect ':' to end 'for'.")
+        self.consume(TT.NEWLINE, "Expect newline after ':'.")
 
-        # if initializer is not None:
-        #     body = stmt.Block([initializer, body])
+        enclosing_level = self.loop_level
+        try:
+            self.loop_level += 1
+            self.parallel_level = self.loop_level
+            body = self.statement()
+        finally:
+            self.loop_level = enclosing_level
+            self.parallel_level = None
+        return stmt.ParallelFor(keyword, name, collection, body, reductions,
+                                workers, chunk_size)
+
+    def reductions(self):
+        # reduce(+ total, * product)
+        reductions = []
+        if self.check(TT.IDENTIFIER) and self.peek().lexeme == "reduce":
+            self.advance()
+            self.consume(TT.LEFT_PAREN, "Expect '(' after 'reduce'.")
+            while True:
+                if not self.match(TT.PLUS, TT.STAR):
+                    raise self.error(self.peek(), "Expect '+' or '*' before reduction variable.")
+                operator = self.previous()
+                variable = self.consume(TT.IDENTIFIER, "Expect reduction variable.")
+                reductions.append((operator, variable))
+                if not self.match(TT.COMMA):
+                    break
+            self.consume(TT.RIGHT_PAREN, "Expect ')' after reductions.")
+        return reductions
+
+    def critical_statement(self):
+        keyword = self.previous()
+        self.consume(TT.COLON, "Expect ':' after 'critical'.")
+        self.consume(TT.NEWLINE, "Expect newline after ':'.")
+        enclosing_level = self.critical_level
+        try:
+            self.critical_level = self.loop_level
+            body = self.statement()
+        finally:
+            self.critical_level = enclosing_level
+        return stmt.Critical(keyword, body)
 
-        return body
+    def barrier_statement(self):
+        keyword = self.previous()
+        if self.critical_level is not None:
+            raise self.error(keyword, "Can not wait at a barrier inside a critical section.")
+        self.consume(TT.NEWLINE, "Expect newline after 'barrier'.")
+        return stmt.Barrier(keyword)
 
     def if_statement(self):
         condition = self.expression()
@@ -204,15 +277,24 @@ class Parser:
 
     def break_statement(self):
         if self.loop_level <= 0:
-            raise ParseException(self.previous(),
-                                 "'break' statement must be inside a loop.")
+            raise self.error(self.previous(),
+                             "'break' statement must be inside a loop.")
+        if self.loop_level == self.parallel_level:
+            raise self.error(self.previous(),
+                             "Can not break out of a parallel for.")
+        if self.loop_level == self.critical_level:
+            raise self.error(self.previous(),
+                             "Can not break out of a critical section.")
         self.consume(TT.NEWLINE, "Expect newline after 'break' statement.")
         return stmt.Break()
 
     def continue_statement(self):
         if self.loop_level <= 0:
-            raise ParseException(self.previous(),
-                                 "'continue' statement must be inside a loop.")
+            raise self.error(self.previous(),
+                             "'continue' statement must be inside a loop.")
+        if self.loop_level == self.critical_level:
+            raise self.error(self.previous(),
+                             "Can not continue out of a critical section.")
         self.consume(TT.NEWLINE, "Expect newline after 'continue' statement.")
         return stmt.Continue()
 
@@ -222,7 +304,19 @@ class Parser:
             self.consume(TT.NEWLINE, "Expect newline after expression.")
         return stmt.Expression(expr)
 
-    def function(self, kind):
+    def memo_declaration(self):
+        # memo fun or memo(size) fun
+        keyword = self.previous()
+        size = None
+        if self.match(TT.LEFT_PAREN):
+            size = self.consume(TT.INT, "Expect cache size after '('.").literal
+            if size < 1:
+                self.error(self.previous(), "Cache size must be positive.")
+            self.consume(TT.RIGHT_PAREN, "Expect ')' after cache size.")
+        self.consume(TT.FUN, "Expect 'fun' after 'memo'.")
+        return self.function("function", keyword, size)
+
+    def function(self, kind, memo=None, memo_size=None):
         name = self.consume(TT.IDENTIFIER, "Expect " + kind + " name.")
         self.consume(TT.LEFT_PAREN, "Expect '(' after " + kind + " name.")
         parameters = []
@@ -240,7 +334,7 @@ class Parser:
         self.consume(TT.NEWLINE, "Expect newline after ':'.")
         self.consume(TT.INDENT, "Expect indent after ':'.")
         body = self.block()
-        return stmt.Function(name, parameters, body)
+        return stmt.Function(name, parameters, body, memo, memo_size)
 
     def lambda_declaration(self):
         # Parentheses are optional
@@ -289,6 +383,11 @@ class Parser:
                 return Assign(name, value)
             elif isinstance(expr, Get):
                 return Set(expr.object, expr.name, value)
+            elif isinstance(expr, Index):
+                if len(expr.indicies) != 1:
+                    self.error(equals, "Can only assign one element at a time.")
+                return SetIndex(expr.collection, expr.paren,
+                                expr.indicies[0], value)
 
             self.error(equals, "Invalid assignment target.")
 
@@ -392,6 +491,12 @@ class Parser:
                 if not isinstance(right, Variable):
                     self.error(operator, "Invalid assignment target.")
             return Unary(operator, right)
+        if self.match(TT.SPAWN):
+            keyword = self.previous()
+            call = self.call()
+            if not isinstance(call, Call):
+                raise self.error(keyword, "Expect a call after 'spawn'.")
+            return Spawn(keyword, call)
 
         return self.call()
 
@@ -434,6 +539,12 @@ class Parser:
         indicies = []
         if not self.check(TT.RIGHT_BRACKET):
             indicies.append(self.expression())
+            # Case for a[1..3]
+            if self.match(TT.ELLIPSIS):
+                stop = self.expression()
+                paren = self.consume(TT.RIGHT_BRACKET,
+                                     "Expect ']' after slice.")
+                return Slice(collection, paren, indicies[0], stop)
             while self.match(TT.COMMA):
                 indicies.append(self.expression())
         paren = self.consume(TT.RIGHT_BRACKET, "Expect ']' after indicies.")
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs the work of parallel loops, pmap, pfilter, preduce and spawn on
+worker processes listening on TCP ports, started by nebbdyr.py --worker.
+
+A request is a function, which is always parallel.run_chunk, and its
+arguments: the backend, the pickled task with the body or function, the
+globals and captured locals, and the chunk. The worker sends back what
+the function returned, or the exception it raised. Every message is
+pickled and sent after its length.
+
+The coordinator keeps a connection and a thread for every worker, which
+takes the next request off a shared queue, so fast workers take more of
+the chunks. A request whose worker dies is put back on the queue and
+sent to another worker, and the worker is not sent more requests.
+
+Unpickling a request can run any code, so workers listen on localhost
+unless given a host, and should only be reachable by trusted machines.
+"""
+
+import standardlibrary
+import concurrent.futures
+import pickle
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+
+# The host workers listen on when only given a port
+DEFAULT_HOST = "127.0.0.1"
+
+# The number of times a request is sent again after its worker died
+RETRIES = 2
+
+# The length sent before every message
+HEADER = struct.Struct("!Q")
+
+
+class WorkerError(Exception):
+    """ Raised when no worker can run a request """
+    pass
+
+
+def parse_address(text):
+    """ (host, port) of 'host:port' or 'port' """
+    host, _, port = text.rpartition(':')
+    try:
+        return (host or DEFAULT_HOST, int(port))
+    except ValueError:
+        raise ValueError("Expected an address as host:port or port, not '{}'.".format(text))
+
+
+def send(connection, data):
+    connection.sendall(HEADER.pack(len(data)) + data)
+
+
+def receive(connection):
+    length, = HEADER.unpack(receive_exactly(connection, HEADER.size))
+    return receive_exactly(connection, length)
+
+
+def receive_exactly(connection, size):
+    parts = []
+    while size > 0:
+        part = connection.recv(min(size, 1 << 20))
+        if not part:
+            raise EOFError("The connection was closed.")
+        parts.append(part)
+        size -= len(part)
+    return b''.join(parts)
+
+
+class Handler(socketserver.BaseRequestHandler):
+    """
+    Runs the requests sent on a connection one at a time. Every
+    connection has a thread, so callers printing have to keep what they
+    print apart, as parallel.serve does.
+    """
+    def handle(self):
+        while True:
+            try:
+                request = receive(self.request)
+            except (EOFError, OSError):
+                return
+            try:
+                function, arguments = pickle.loads(request)
+                reply = (True, function(*arguments))
+            except Exception as error:
+                reply = (False, error)
+            try:
+                data = pickle.dumps(reply, pickle.HIGHEST_PROTOCOL)
+            except Exception as error:
+                data = pickle.dumps((False, WorkerError(
+                    "The worker could not send its result ({}).".format(error))))
+            send(self.request, data)
+
+
+class Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def serve(address):
+    """ Run requests sent to address until interrupted """
+    with Server(parse_address(address), Handler) as server:
+        host, port = server.server_address[:2]
+        print("Worker listening on {}:{}".format(host, port),
+              file=sys.stderr, flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+class Executor(concurrent.futures.Executor):
+    """
+    Runs calls on workers at addresses, sending a call again to another
+    worker when its worker dies
+    """
+    def __init__(self, addresses):
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.alive = len(addresses)
+        self.threads = [threading.Thread(target=self.run,
+                                         args=(parse_address(address),),
+                                         daemon=True)
+                        for address in addresses]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, function, *arguments):
+        future = concurrent.futures.Future()
+        request = pickle.dumps((function, arguments), pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            if self.alive:
+                # The request and the number of times it has been sent
+                self.requests.put((future, request, 0))
+                return future
+        future.set_exception(WorkerError("Every worker has died."))
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        if cancel_futures:
+            with self.lock:
+                # Keep the requests being sent again, as they have started
+                retried = []
+                while True:
+                    try:
+                        item = self.requests.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None and item[2]:
+                        retried.append(item)
+                    elif item is not None:
+                        item[0].cancel()
+                for item in retried:
+                    self.requests.put(item)
+        for _ in self.threads:
+            self.requests.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def run(self, address):
+        """ Send requests to the worker at address until it dies """
+        connection = None
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            future, request, attempts = item
+            if attempts == 0 and not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if connection is None:
+                    connection = socket.create_connection(address)
+                send(connection, request)
+                succeeded, value = pickle.loads(receive(connection))
+            except (EOFError, OSError) as error:
+                self.retry(address, error, future, request, attempts)
+                break
+            except Exception as error:
+                # A reply which can't be read fails its call, instead of
+                # the thread, which would leave the call waiting forever
+                future.set_exception(WorkerError("The reply of the worker at {}:{} could not be read ({}).".format(address[0], address[1], error)))
+                continue
+            if succeeded:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        if connection is not None:
+            connection.close()
+
+    def retry(self, address, error, future, request, attempts):
+        """ Send a request whose worker died again, and stop using the worker """
+        with self.lock:
+            self.alive -= 1
+            if attempts < RETRIES and self.alive:
+                self.requests.put((future, request, attempts + 1))
+            else:
+                future.set_exception(WorkerError("The worker at {}:{} died ({}).".format(address[0], address[1], error)))
+            if not self.alive:
+                # Fail what is left, as no worker will take it
+                while True:
+                    try:
+                        item = self.requests.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        continue
+                    future, _, attempts = item
+                    if attempts or future.set_running_or_notify_cancel():
+                        future.set_exception(WorkerError("Every worker has died."))
@@ -1,7 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import copy
 from enum import Enum, unique
 
+import autoparallel
+import vectorize
+from attributes import Attribute
+from environment import Layout
+from expr import (Call, Get, Grouping, Index, Lambda, List, ListConstructor,
+                  Literal, Slice, Variable)
+from nebbdyrinstance import InlineCache
+from stmt import Class, Function, Mut, ParallelFor, ParallelRegion, Unstable, Var
+from tokentype import TokenType
+
 
 @unique
 class FunctionType(Enum):
@@ -9,6 +20,7 @@ class FunctionType(Enum):
     FUNCTION = 1
     METHOD = 2
     LAMBDA = 3
+    PARALLEL = 4
 
 
 @unique
@@ -19,36 +31,104 @@ class VariableState(Enum):
     CORE = 3
 
 
+def declares(statements):
+    """ Whether statements declare variables in the scope they run in """
+    return any(isinstance(statement, (Var, Mut, Unstable, Function, Class))
+               for statement in statements)
+
+
+def root(expr):
+    """ The variable an expression like a.b[i].c reads from, if any """
+    while True:
+        if isinstance(expr, Get):
+            expr = expr.object
+        elif isinstance(expr, Grouping):
+            expr = expr.expression
+        elif isinstance(expr, (Index, Slice)):
+            expr = expr.collection
+        else:
+            return expr if isinstance(expr, Variable) else None
+
+
+def never_none(expr):
+    """ Whether an initializer is known to never evaluate to none """
+    if isinstance(expr, Literal):
+        return expr.value is not None
+    return isinstance(expr, (Lambda, List, ListConstructor))
+
+
 class Resolver:
     def __init__(self, interpreter, nebbdyr):
         self.interpreter = interpreter
         self.nebbdyr = nebbdyr
         self.scopes = [{}]
+        # The slots of the local scopes. The global scope is looked up by name
+        self.layouts = [None]
+        # The statements declaring the names of each scope, with None for
+        # loop variables and parameters
+        self.declarations = [{}]
+        # The variables read from each scope by name, marked when the
+        # variable is kept in a Cell
+        self.references = [{}]
         for name in self.interpreter.globals.values:
-            self.scopes[0][name] = VariableState.CORE
+            if name not in self.interpreter.globals.library:
+                self.scopes[0][name] = VariableState.CORE
         self.current_function = FunctionType.NONE
+        # The innermost memoized function and the index of its scope
+        self.memo = None
+        # The parallel for or region being resolved, the index of its scope
+        # and the outer locals read by its body
+        self.parallel = None
+        # Whether a critical section of the current function is resolved
+        self.critical = False
+        # The number of functions, methods and lambdas resolved so far
+        self.functions = 0
+        # The functions being resolved, as the index of their scope and the
+        # slots they capture by distance
+        self.closures = []
+        # The functions and classes being resolved, as the index of the
+        # scope declaring them and their name
+        self.initializing = set()
 
     def visit_block_stmt(self, stmt):
-        self.begin_scope()
+        if not declares(stmt.statements):
+            # Nothing needs a slot, so the block runs in the enclosing
+            # environment instead of one of its own
+            stmt.layout = None
+            stmt.captured = False
+            self.resolve(stmt.statements)
+            return
+        self.begin_scope(stmt)
+        functions = self.functions
         self.resolve(stmt.statements)
+        # A loop runs a body without functions in one environment
+        stmt.captured = self.functions != functions
         self.end_scope()
 
     def visit_class_stmt(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt, stmt.name, [])
         self.define(stmt.name)
 
+        # The class is defined once its methods are made
+        initializing = (len(self.scopes) - 1, stmt.name.lexeme)
+        self.initializing.add(initializing)
         for method in stmt.methods:
             declaration = FunctionType.METHOD
             self.resolve_function(method, declaration)
+        self.initializing.discard(initializing)
 
     def visit_expression_stmt(self, stmt):
         self.resolve(stmt.expression)
 
     def visit_function_stmt(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt, stmt.name, [Attribute.FUNCTION])
         self.define(stmt.name)
 
+        # The function is defined once it is made
+        initializing = (len(self.scopes) - 1, stmt.name.lexeme)
+        self.initializing.add(initializing)
         self.resolve_function(stmt, FunctionType.FUNCTION)
+        self.initializing.discard(initializing)
 
     def visit_if_stmt(self, stmt):
         self.resolve(stmt.condition)
@@ -57,16 +137,27 @@ class Resolver:
             self.resolve(stmt.else_branch)
 
     def visit_print_stmt(self, stmt):
+        if self.memo is not None:
+            function, _ = self.memo
+            self.nebbdyr.error(function.name, "Memoized function '{}' can not print.".format(function.name.lexeme))
         self.resolve(stmt.expression)
 
     def visit_return_stmt(self, stmt):
-        if self.current_function not in (FunctionType.FUNCTION,
+        if self.current_function == FunctionType.PARALLEL:
+            self.nebbdyr.error(stmt.keyword,
+                               "Cannot return from a parallel for or region.")
+        elif self.critical:
+            self.nebbdyr.error(stmt.keyword,
+                               "Cannot return from a critical section.")
+        elif self.current_function not in (FunctionType.FUNCTION,
                                          FunctionType.LAMBDA):
             self.nebbdyr.error(stmt.keyword,
                                "Cannot return from top-level code.")
 
         if stmt.value is not None:
             self.resolve(stmt.value)
+        # The frame of the function may be reused for a call it returns
+        stmt.tail = isinstance(stmt.value, Call)
 
         return None
 
@@ -74,6 +165,132 @@ class Resolver:
         self.resolve(stmt.condition)
         self.resolve(stmt.body)
 
+    def visit_for_stmt(self, stmt):
+        self.resolve(stmt.collection)
+        self.begin_scope(stmt)
+        self.declare(None, stmt.name, [])
+        self.define(stmt.name)
+        functions = self.functions
+        self.resolve(stmt.body)
+        # Without functions in the body every iteration binds the loop
+        # variable in the same environment
+        stmt.captured = self.functions != functions
+        self.end_scope()
+        self.plan_parallel(stmt)
+        self.plan_vector(stmt)
+
+    def plan_parallel(self, stmt):
+        """
+        Make the parallel for a for loop could run as, if any, or record
+        why it can't, see autoparallel
+        """
+        stmt.parallel = None
+        stmt.stores = []
+        if self.parallel is not None:
+            stmt.serial = "It is inside a parallel for or region."
+            return
+        try:
+            reductions, stores = autoparallel.analyse(stmt, self.declaration)
+        except autoparallel.Serial as serial:
+            stmt.serial = serial.reason
+            return
+
+        # The workers resolve their own copy of the body
+        plan = ParallelFor(stmt.keyword, stmt.name, stmt.collection,
+                           copy.deepcopy(stmt.body), reductions, None, None)
+        nebbdyr = self.nebbdyr
+        self.nebbdyr = errors = autoparallel.Errors()
+        try:
+            self.resolve_parallel(plan, plan.name)
+        finally:
+            self.nebbdyr = nebbdyr
+        if errors.messages:
+            stmt.serial = errors.messages[0]
+            return
+        for name in stores:
+            target = Variable(name)
+            self.resolve_local(target, name, True)
+            stmt.stores.append(target)
+        stmt.parallel = plan
+
+    def plan_vector(self, stmt):
+        """ Plan running a for loop as NumPy operations, see vectorize """
+        vector = stmt.vector = vectorize.plan(stmt, self.declaration)
+        if vector is None:
+            return
+        for name in vector.names:
+            variable = Variable(name)
+            self.resolve_local(variable, name, True)
+            vector.variables.append(variable)
+        if vector.kind != vectorize.MAP:
+            target = Variable(vector.target)
+            self.resolve_local(target, vector.target, False)
+            vector.targets.append(target)
+
+    def declaration(self, name, scope=None):
+        """
+        The statement declaring name, or None for loop variables and
+        parameters, and the index of its scope, looking from the scope with
+        the index scope outwards. Names not declared yet are in the global
+        scope.
+        """
+        if scope is None:
+            scope = len(self.scopes) - 1
+        for i in range(scope, -1, -1):
+            if name in self.scopes[i]:
+                return self.declarations[i].get(name), i
+        return None, 0
+
+    def visit_parallelfor_stmt(self, stmt):
+        self.resolve(stmt.collection)
+        self.resolve_parallel(stmt, stmt.name)
+
+    def visit_parallelregion_stmt(self, stmt):
+        self.resolve_parallel(stmt, None)
+
+    def resolve_parallel(self, stmt, name):
+        """ Resolve a parallel for or region declaring the loop variable name """
+        stmt.targets = []
+        stmt.stores = []
+        for _, name in stmt.reductions:
+            target = Variable(name)
+            # The reduced value is read and assigned when the loop is done
+            self.resolve_local(target, name, False)
+            self.resolve_local(target, name, True)
+            stmt.targets.append(target)
+
+        enclosing_function = self.current_function
+        self.current_function = FunctionType.PARALLEL
+        captures = {}
+        self.parallel = (stmt, len(self.scopes), captures)
+        enclosing_critical = self.critical
+        self.critical = False
+        self.begin_scope(stmt)
+        if name is not None:
+            self.declare(None, name, [])
+            self.define(name)
+        self.resolve(stmt.body)
+        self.end_scope()
+        self.parallel = None
+        self.critical = enclosing_critical
+        self.current_function = enclosing_function
+
+        # The values of the captured locals are read where it starts
+        stmt.captures = []
+        for name in captures.values():
+            capture = Variable(name)
+            self.resolve_local(capture, name, True)
+            stmt.captures.append(capture)
+
+    def visit_critical_stmt(self, stmt):
+        enclosing_critical = self.critical
+        self.critical = True
+        self.resolve(stmt.body)
+        self.critical = enclosing_critical
+
+    def visit_barrier_stmt(self, stmt):
+        return
+
     def visit_continue_stmt(self, stmt):
         return
 
@@ -81,19 +298,19 @@ class Resolver:
         return
 
     def visit_var_stmt(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt, stmt.name, [])
         if stmt.initializer is not None:
             self.resolve(stmt.initializer)
         self.define(stmt.name)
 
     def visit_mut_stmt(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt, stmt.name, [Attribute.MUTABLE])
         if stmt.initializer is not None:
             self.resolve(stmt.initializer)
         self.define(stmt.name)
 
     def visit_unstable_stmt(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt, stmt.name, [Attribute.UNSTABLE, Attribute.MUTABLE])
         if stmt.initializer is not None:
             self.resolve(stmt.initializer)
         self.define(stmt.name)
@@ -118,8 +335,25 @@ class Resolver:
         for index in expr.indicies:
             self.resolve(index)
 
+    def visit_setindex_expr(self, expr):
+        self.resolve(expr.collection)
+        self.resolve(expr.index)
+        self.resolve(expr.value)
+        self.check_memo_store(expr.collection)
+        if self.parallel is not None:
+            self.check_parallel_store(expr)
+
+    def visit_spawn_expr(self, expr):
+        self.resolve(expr.call)
+
+    def visit_slice_expr(self, expr):
+        self.resolve(expr.collection)
+        self.resolve(expr.start)
+        self.resolve(expr.stop)
+
     def visit_get_expr(self, expr):
         self.resolve(expr.object)
+        expr.cache = InlineCache()
 
     def visit_grouping_expr(self, expr):
         self.resolve(expr.expression)
@@ -134,6 +368,9 @@ class Resolver:
     def visit_set_expr(self, expr):
         self.resolve(expr.value)
         self.resolve(expr.object)
+        self.check_memo_store(expr.object)
+        if self.parallel is not None:
+            self.check_parallel_field(expr)
 
     def visit_listconstructor_expr(self, expr):
         self.resolve(expr.start)
@@ -143,6 +380,9 @@ class Resolver:
 
     def visit_unary_expr(self, expr):
         self.resolve(expr.right)
+        if expr.operator.type in (TokenType.PLUSPLUS, TokenType.MINUSMINUS):
+            # Increment and decrement assign the variable they read
+            self.resolve_local(expr, expr.right.name, False)
 
     def visit_variable_expr(self, expr):
         if (len(self.scopes) > 0 and
@@ -166,23 +406,51 @@ class Resolver:
             statements.accept(self)
 
     def resolve_function(self, function, type):
+        self.functions += 1
         enclosing_function = self.current_function
+        enclosing_memo = self.memo
+        enclosing_critical = self.critical
         self.current_function = type
-
-        self.begin_scope()
+        self.critical = False
+        if type == FunctionType.FUNCTION and function.memo is not None:
+            self.memo = (function, len(self.scopes))
+
+        # The parameters take the first slots of the function's scope
+        self.begin_scope(function)
+        captures = {}
+        self.closures.append((len(self.scopes) - 1, captures))
         for param in function.parameters:
-            self.declare(param)
+            self.declare(None, param, [])
             self.define(param)
         self.resolve(function.body)
         self.end_scope()
+        self.closures.pop()
+        # The slots of enclosing scopes the function reads, by their
+        # distance from the environment it is made in, see capture
+        distances = range(max(captures, default=-1) + 1)
+        function.captures = [sorted(captures.get(distance, ()))
+                             for distance in distances]
 
         self.current_function = enclosing_function
+        self.memo = enclosing_memo
+        self.critical = enclosing_critical
 
-    def begin_scope(self):
+    def begin_scope(self, node):
         self.scopes.append(dict())
+        self.declarations.append(dict())
+        self.references.append(dict())
+        node.layout = Layout()
+        self.layouts.append(node.layout)
 
     def end_scope(self):
         scope = self.scopes.pop()
+        self.declarations.pop()
+        references = self.references.pop()
+        layout = self.layouts.pop()
+        for name, variables in references.items():
+            if layout.slots[name] in layout.cells:
+                for variable in variables:
+                    variable.cell = True
         for name, state in scope.items():
             if state == VariableState.DECLARED:
                 self.nebbdyr.error('', "Local variable '{}' is declared but not used.".format(name))
@@ -190,7 +458,7 @@ class Resolver:
                 if self.current_function != FunctionType.LAMBDA:
                     self.nebbdyr.error('', "Local variable '{}' is defined but not used.".format(name))
 
-    def declare(self, name):
+    def declare(self, stmt, name, attributes):
         if not self.scopes:
             return
 
@@ -203,6 +471,13 @@ class Resolver:
                 self.nebbdyr.error(name,
                                    "A variable with this name already declared in this scope.")
         scope[name.lexeme] = VariableState.DECLARED
+        self.declarations[-1][name.lexeme] = stmt
+
+        layout = self.layouts[-1]
+        if layout is not None:
+            slot = layout.add(name, attributes)
+            if stmt is not None:
+                stmt.slot = slot
 
     def define(self, name):
         if not self.scopes:
@@ -211,12 +486,145 @@ class Resolver:
         self.scopes[-1][name.lexeme] = VariableState.DEFINED
 
     def resolve_local(self, expr, name, is_read):
+        # A parallel for resolves its body again in the workers
+        expr.depth = expr.slot = None
         for i in range(len(self.scopes)-1, -1, -1):
             if name.lexeme in self.scopes[i]:
-                self.interpreter.resolve(expr, len(self.scopes)-1-i)
+                # Variables of the global scope keep a depth of None and
+                # are looked up by name
+                if i > 0:
+                    expr.depth = len(self.scopes)-1-i
+                    expr.slot = self.layouts[i].slots[name.lexeme]
+                    if is_read:
+                        expr.cell = False
+                        self.references[i].setdefault(name.lexeme,
+                                                      []).append(expr)
+                    self.capture(name, i)
+                if not is_read:
+                    self.check_memo_assignment(name, i)
+                if self.parallel is not None:
+                    self.check_parallel_access(name, i, is_read)
 
                 if is_read and self.scopes[i][name.lexeme] != VariableState.CORE:
                     self.scopes[i][name.lexeme] = VariableState.USED
                 return
 
         # Not found. Assume it is global
+        if not is_read:
+            self.check_memo_assignment(name, 0)
+        if self.parallel is not None:
+            self.check_parallel_access(name, 0, is_read)
+
+    def capture(self, name, scope):
+        """
+        Record the functions being resolved reading the variable name of
+        the scope with the index scope from outside of them, keeping it in
+        a Cell if it may change after they are made
+        """
+        layout = self.layouts[scope]
+        slot = layout.slots[name.lexeme]
+        captured = False
+        for function_scope, captures in reversed(self.closures):
+            if function_scope <= scope:
+                break
+            captures.setdefault(function_scope - 1 - scope, set()).add(slot)
+            captured = True
+        if captured and slot not in layout.cells and self.changes(name,
+                                                                  scope):
+            layout.cells.append(slot)
+
+    def changes(self, name, scope):
+        """ Whether a variable may change after a function reads it """
+        layout = self.layouts[scope]
+        if Attribute.MUTABLE in layout.attributes[layout.slots[name.lexeme]]:
+            return True
+        # Read in its own initializer or body, before it is defined
+        if (self.scopes[scope][name.lexeme] == VariableState.DECLARED or
+                (scope, name.lexeme) in self.initializing):
+            return True
+        # A variable bound to none is unassigned and may be assigned once.
+        # Only functions, classes and some initializers are never none
+        declaration = self.declarations[scope].get(name.lexeme)
+        if isinstance(declaration, Var):
+            return not never_none(declaration.initializer)
+        return not isinstance(declaration, (Class, Function))
+
+    def check_memo_assignment(self, name, scope):
+        """ Reject a memoized function assigning a variable outside of it """
+        if self.memo is None:
+            return
+        function, function_scope = self.memo
+        if scope < function_scope:
+            self.nebbdyr.error(name, "Memoized function '{}' can not assign to '{}', which is declared outside of it.".format(function.name.lexeme, name.lexeme))
+
+    def check_memo_store(self, target):
+        """
+        Reject a memoized function storing into an element or a field of a
+        variable outside of it, which calls answered from the cache skip
+        """
+        if self.memo is None:
+            return
+        variable = root(target)
+        if variable is None:
+            return
+        function, function_scope = self.memo
+        name = variable.name
+        scope = next((i for i in range(len(self.scopes)-1, -1, -1)
+                      if name.lexeme in self.scopes[i]), 0)
+        if scope < function_scope:
+            self.nebbdyr.error(name, "Memoized function '{}' can not store into '{}', which is declared outside of it.".format(function.name.lexeme, name.lexeme))
+
+    def is_outer(self, name):
+        """ Whether name is declared outside of the parallel for or region """
+        _, loop_scope, _ = self.parallel
+        for i in range(len(self.scopes)-1, -1, -1):
+            if name.lexeme in self.scopes[i]:
+                return i < loop_scope
+        return True
+
+    def check_parallel_field(self, expr):
+        """
+        Reject the body of a parallel for assigning a field of an instance
+        declared outside of it, as the workers only change their copies
+        """
+        object = root(expr.object)
+        if object is None or not self.is_outer(object.name):
+            return
+        stmt, _, _ = self.parallel
+        kind = "region" if isinstance(stmt, ParallelRegion) else "for"
+        self.nebbdyr.error(expr.name, "Parallel {} can not assign to the field '{}' of '{}', which is declared outside of it. Make a variable a reduction with reduce(+ {}) and assign the field when it is done.".format(kind, expr.name.lexeme, object.name.lexeme, expr.name.lexeme))
+
+    def check_parallel_store(self, expr):
+        """
+        Record the outer lists the body of a parallel for or region stores
+        into, which have to be shared lists unless it runs in threads, and
+        reject storing into other outer collections
+        """
+        stmt, _, _ = self.parallel
+        collection = root(expr.collection)
+        if collection is None or not self.is_outer(collection.name):
+            return
+        name = collection.name
+        if collection is expr.collection:
+            if all(store.lexeme != name.lexeme for store in stmt.stores):
+                stmt.stores.append(name)
+            return
+        kind = "region" if isinstance(stmt, ParallelRegion) else "for"
+        self.nebbdyr.error(name, "Parallel {} can not store into an element of '{}', which is declared outside of it. Only outer shared lists can be stored into.".format(kind, name.lexeme))
+
+    def check_parallel_access(self, name, scope, is_read):
+        """
+        Record the outer locals read by the body of a parallel for, and
+        reject it assigning outer variables which are not reductions
+        """
+        stmt, loop_scope, captures = self.parallel
+        if scope >= loop_scope:
+            return
+        reductions = [variable.lexeme for _, variable in stmt.reductions]
+        if name.lexeme in reductions:
+            return
+        if not is_read:
+            kind = "region" if isinstance(stmt, ParallelRegion) else "for"
+            self.nebbdyr.error(name, "Parallel {} can not assign to '{}', which is declared outside of it. Make it a reduction with reduce(+ {}).".format(kind, name.lexeme, name.lexeme))
+        elif scope > 0:
+            captures.setdefault(name.lexeme, name)
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+from errors import RuntimeException, IndexException
+from nebbdyrrange import NebbdyrRange, is_range
+from nebbdyrslice import NebbdyrSlice
+from nebbdyrarray import NebbdyrArray
+from nebbdyrshared import NebbdyrShared, FREED
+from nebbdyrinstance import NebbdyrInstance
+import nebbdyrarray
+from operator import itemgetter
+from token import Token
+from tokentype import TokenType as TT
+
+
+class Completion:
+    """
+    How a statement ended, if it did not simply run to its end.
+
+    Executing a statement returns None, BREAK, CONTINUE or the Completion
+    of a return statement holding the returned value. Blocks and loops
+    pass on what they can't handle, and the function call takes the value.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+BREAK = Completion()
+CONTINUE = Completion()
+
+
+class TailCall(Completion):
+    """
+    The Completion of returning a call to a NebbdyrFunction. The caller
+    runs the function in its own loop instead of growing the stack.
+    """
+    __slots__ = ('function', 'arguments')
+
+    def __init__(self, function, arguments):
+        self.value = None
+        self.function = function
+        self.arguments = arguments
+
+
+def is_truthy(object):
+    # Inherit Python's definitions of True and False, except that the
+    # integer 0 is truthy
+    return True if object or (type(object) is int and object == 0) else False
+
+
+def is_equal(left, right):
+    # none is not equal to anything
+    if left is None and right is None:
+        return False
+    return left == right
+
+
+def stringify(object):
+    if object is None:
+        return "none"
+    if object is True:
+        return "true"
+    if object is False:
+        return "false"
+    return str(object)
+
+
+def check_number_operand(operator, operand):
+    # Can't use isinstance since bools are of instance int
+    if not type(operand) in (int, float):
+        raise RuntimeException(operator, "Operand must be a number.")
+
+
+def check_number_operands(operator, left, right):
+    """ Raise unless the operands are numbers or arrays, returning whether
+    both are numbers """
+    if isinstance(left, (float, int)) and isinstance(right, (float, int)):
+        return True
+    if isinstance(left, NebbdyrArray) or isinstance(right, NebbdyrArray):
+        return False
+    if not isinstance(left, (float, int)):
+        raise RuntimeException(
+            operator, "Left operand '{}' must be number.".format(
+                stringify(left)))
+    if not isinstance(right, (float, int)):
+        raise RuntimeException(
+            operator, "Right operand '{}' must be number.".format(
+                stringify(right)))
+
+
+def minus(operator, left, right):
+    if check_number_operands(operator, left, right):
+        return left - right
+    return nebbdyrarray.binary(operator, left, right)
+
+
+def slash(operator, left, right):
+    if not check_number_operands(operator, left, right):
+        return nebbdyrarray.binary(operator, left, right)
+    if right == 0:
+        raise RuntimeException(operator, "Attempted to divide by zero.")
+    return left/right
+
+
+def star(operator, left, right):
+    if check_number_operands(operator, left, right):
+        return left*right
+    return nebbdyrarray.binary(operator, left, right)
+
+
+def plus(operator, left, right):
+    # Allow both float+float and str+str
+    if type(left) == type(right) and type(left) is not NebbdyrArray:
+        return left + right
+    # Case of int + float
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return left + right
+    if isinstance(left, NebbdyrArray) or isinstance(right, NebbdyrArray):
+        return nebbdyrarray.binary(operator, left, right)
+    # Case of a list, a range, a slice or a shared list
+    if isinstance(left, LISTS) and isinstance(right, LISTS):
+        return list(left) + list(right)
+    raise RuntimeException(operator,
+                           "Operands must both be numbers or strings.")
+
+
+def greater(operator, left, right):
+    if left is False or right is False:
+        return False
+    if not check_number_operands(operator, left, right):
+        return nebbdyrarray.binary(operator, left, right)
+    return right if left > right else False
+
+
+def greater_equal(operator, left, right):
+    if left is False or right is False:
+        return False
+    if not check_number_operands(operator, left, right):
+        return nebbdyrarray.binary(operator, left, right)
+    return right if left >= right else False
+
+
+def less(operator, left, right):
+    if left is False or right is False:
+        return False
+    if not check_number_operands(operator, left, right):
+        return nebbdyrarray.binary(operator, left, right)
+    return right if left < right else False
+
+
+def less_equal(operator, left, right):
+    if left is False or right is False:
+        return False
+    if not check_number_operands(operator, left, right):
+        return nebbdyrarray.binary(operator, left, right)
+    return right if left <= right else False
+
+
+def bang_equal(operator, left, right):
+    result = is_equal(left, right)
+    if type(result) is NebbdyrArray:
+        return nebbdyrarray.logical_not(result)
+    return right if not result else False
+
+
+def equal(operator, left, right):
+    result = is_equal(left, right)
+    if type(result) is NebbdyrArray:
+        return result
+    return right if result else False
+
+
+def hat(operator, left, right):
+    if check_number_operands(operator, left, right):
+        return left**right
+    return nebbdyrarray.binary(operator, left, right)
+
+
+# The binary operators, keyed on the token type of the operator
+BINARY = {
+    TT.MINUS: minus,
+    TT.SLASH: slash,
+    TT.STAR: star,
+    TT.PLUS: plus,
+    TT.GREATER: greater,
+    TT.GREATER_EQUAL: greater_equal,
+    TT.LESS: less,
+    TT.LESS_EQUAL: less_equal,
+    TT.BANG_EQUAL: bang_equal,
+    TT.EQUAL: equal,
+    TT.HAT: hat,
+}
+
+
+def check_arity(paren, callee, arguments):
+    if len(arguments) != callee.arity():
+        raise RuntimeException(paren, "Expected " + str(callee.arity()) +
+                               " arguments, but got " + str(len(arguments))
+                               + ".")
+
+
+def stack_overflow(paren):
+    return RuntimeException(paren, "Stack overflow.")
+
+
+def range_bound(token, value, what):
+    """ Check that a bound of a list constructor is a number """
+    if not isinstance(value, (int, float)):
+        raise RuntimeException(token, what + " must be iterable.")
+    return value
+
+
+def construct_list(start, next, stop):
+    """ The list described by [start..stop] or [start, next..stop] """
+    if next is None:
+        return NebbdyrRange(range(start, stop+1))
+    else:
+        return NebbdyrRange(range(start, stop+1, next-start))
+
+
+def out_of_bounds(paren, collection, index):
+    col = str(collection)
+    if(len(collection) > 4):
+        col = (f'[{collection[0]}, {collection[1]}, ..., '
+               f'{collection[-2]}, {collection[-1]}]')
+
+    return IndexException(paren, f"Index {index} is out of bounds of collection {col} of length {len(collection)}.")
+
+
+def check_indexable(paren, collection):
+    if not isinstance(collection, SEQUENCES):
+        raise IndexException(paren, f"Can not index type '{type(collection)}'.")
+    if isinstance(collection, NebbdyrSlice):
+        collection = collection.list
+    if type(collection) is NebbdyrShared and collection.freed():
+        raise RuntimeException(paren, FREED)
+
+
+def index(paren, collection, indicies):
+    """ Look up one or several indicies of a collection """
+    check_indexable(paren, collection)
+    length = len(collection)
+    indicies = [int(i) for i in indicies]
+    if len(indicies) == 1:
+        index = indicies[0]
+        if not -length <= index < length:
+            raise out_of_bounds(paren, collection, index)
+        return collection[index]
+
+    # Gather, checking the bounds of all the indicies at once
+    if not (-length <= min(indicies) and max(indicies) < length):
+        index = next(i for i in indicies if not -length <= i < length)
+        raise out_of_bounds(paren, collection, index)
+    if isinstance(collection, NebbdyrArray):
+        return collection[indicies]
+    return list(itemgetter(*indicies)(collection))
+
+
+def view(paren, collection, start, stop):
+    """ The elements start to stop of a collection, sharing its storage """
+    check_indexable(paren, collection)
+    length = len(collection)
+    bounds = []
+    for index in (int(start), int(stop)):
+        if not -length <= index < length:
+            raise out_of_bounds(paren, collection, index)
+        bounds.append(index + length if index < 0 else index)
+    first, last = bounds
+    # Like the list [5..1], a slice ending before it starts is empty
+    end = max(first, last + 1)
+
+    if is_range(collection):
+        return NebbdyrRange(collection.range[first:end])
+    if isinstance(collection, (list, NebbdyrShared, NebbdyrRange)):
+        return NebbdyrSlice(collection, first, end)
+    if isinstance(collection, NebbdyrSlice):
+        return NebbdyrSlice(collection.list, collection.start + first,
+                            collection.start + end)
+    # NumPy's slices are views already
+    return NebbdyrArray(collection.array[first:end])
+
+
+def store(paren, collection, index, value):
+    """
+    Assign an element of a list, range, slice, array or shared list. A
+    range turns into the list of its elements
+    """
+    check_indexable(paren, collection)
+    length = len(collection)
+    index = int(index)
+    if not -length <= index < length:
+        raise out_of_bounds(paren, collection, index)
+    if isinstance(collection, NebbdyrArray) and type(value) not in (int, float):
+        raise RuntimeException(paren, "Arrays can only hold numbers.")
+    try:
+        collection[index] = value
+    except (TypeError, ValueError) as error:
+        # Shared lists hold 64 bit numbers of one type
+        raise RuntimeException(paren, str(error))
+    return value
+
+
+def iterate(keyword, collection, interpreter):
+    """
+    An iterator over the elements a for loop binds its variable to: those
+    of a list, range or array, the characters of a string, or the values
+    the next method of an instance returns until it returns none
+    """
+    if isinstance(collection, str):
+        return iter(collection)
+    if isinstance(collection, NebbdyrInstance):
+        return iterate_instance(keyword, collection, interpreter)
+    if not isinstance(collection, SEQUENCES):
+        raise RuntimeException(keyword, "Can only loop over a list, range, array, string or an instance with a next method.")
+    # Rejects freed shared lists
+    check_indexable(keyword, collection)
+    return iter(collection)
+
+
+def iterate_instance(keyword, instance, interpreter):
+    method = instance.get(Token(TT.IDENTIFIER, "next", None, keyword.line))
+    if not hasattr(method, 'arity'):
+        raise RuntimeException(keyword, "The next property of an instance looped over must be a function.")
+    check_arity(keyword, method, [])
+    return iter(lambda: method.call(interpreter, []), None)
+
+
+# The values behaving like lists, and everything which can be indexed
+LISTS = (list, NebbdyrRange, NebbdyrSlice, NebbdyrShared)
+SEQUENCES = LISTS + (NebbdyrArray,)
@@ -33,6 +33,11 @@ class Scanner:
             "break": TT.BREAK,
             "continue": TT.CONTINUE,
             "unstable": TT.UNSTABLE,
+            "memo": TT.MEMO,
+            "parallel": TT.PARALLEL,
+            "critical": TT.CRITICAL,
+            "barrier": TT.BARRIER,
+            "spawn": TT.SPAWN,
             "class": TT.CLASS
         }
 
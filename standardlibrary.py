@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+"""
+Makes the standard library's tokenize importable.
+
+The front end's token module shadows the standard library's, which
+tokenize needs. tokenize is imported by logging, traceback and inspect,
+and through them by concurrent.futures and NumPy. Importing this module
+loads tokenize against the standard library's token module and then puts
+ours back, so later imports of tokenize find it ready.
+"""
+
+import os
+import sys
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+if 'tokenize' not in sys.modules:
+    ours = sys.modules.pop('token', None)
+    path = sys.path[:]
+    sys.path[:] = [entry for entry in path
+                   if os.path.abspath(entry or os.curdir) != DIRECTORY]
+    try:
+        import tokenize
+    finally:
+        sys.path[:] = path
+        del sys.modules['token']
+        if ours is not None:
+            sys.modules['token'] = ours
@@ -4,6 +4,9 @@ from expression import Expr, Stmt
 class Block(Stmt):
     def __init__(self, statements):
         self.statements = statements
+        # Filled in by the Resolver
+        self.layout = None
+        self.captured = None
 
     def accept(self, visitor):
         return visitor.visit_block_stmt(self)
@@ -13,6 +16,8 @@ class Class(Stmt):
     def __init__(self, name, methods):
         self.name = name
         self.methods = methods
+        # Filled in by the Resolver
+        self.slot = None
 
     def accept(self, visitor):
         return visitor.visit_class_stmt(self)
@@ -27,10 +32,16 @@ class Expression(Stmt):
 
 
 class Function(Stmt):
-    def __init__(self, name, parameters, body):
+    def __init__(self, name, parameters, body, memo, memo_size):
         self.name = name
         self.parameters = parameters
         self.body = body
+        self.memo = memo
+        self.memo_size = memo_size
+        # Filled in by the Resolver
+        self.slot = None
+        self.layout = None
+        self.captures = None
 
     def accept(self, visitor):
         return visitor.visit_function_stmt(self)
@@ -58,6 +69,8 @@ class Return(Stmt):
     def __init__(self, keyword, value):
         self.keyword = keyword
         self.value = value
+        # Filled in by the Resolver
+        self.tail = None
 
     def accept(self, visitor):
         return visitor.visit_return_stmt(self)
@@ -67,6 +80,8 @@ class Var(Stmt):
     def __init__(self, name, initializer):
         self.name = name
         self.initializer = initializer
+        # Filled in by the Resolver
+        self.slot = None
 
     def accept(self, visitor):
         return visitor.visit_var_stmt(self)
@@ -76,6 +91,8 @@ class Mut(Stmt):
     def __init__(self, name, initializer):
         self.name = name
         self.initializer = initializer
+        # Filled in by the Resolver
+        self.slot = None
 
     def accept(self, visitor):
         return visitor.visit_mut_stmt(self)
@@ -85,6 +102,8 @@ class Unstable(Stmt):
     def __init__(self, name, initializer):
         self.name = name
         self.initializer = initializer
+        # Filled in by the Resolver
+        self.slot = None
 
     def accept(self, visitor):
         return visitor.visit_unstable_stmt(self)
@@ -99,6 +118,76 @@ class While(Stmt):
         return visitor.visit_while_stmt(self)
 
 
+class For(Stmt):
+    def __init__(self, keyword, name, collection, body):
+        self.keyword = keyword
+        self.name = name
+        self.collection = collection
+        self.body = body
+        # Filled in by the Resolver
+        self.layout = None
+        self.captured = None
+        self.parallel = None
+        self.stores = None
+        self.serial = None
+        self.vector = None
+
+    def accept(self, visitor):
+        return visitor.visit_for_stmt(self)
+
+
+class ParallelFor(Stmt):
+    def __init__(self, keyword, name, collection, body, reductions, workers, chunk_size):
+        self.keyword = keyword
+        self.name = name
+        self.collection = collection
+        self.body = body
+        self.reductions = reductions
+        self.workers = workers
+        self.chunk_size = chunk_size
+        # Filled in by the Resolver
+        self.captures = None
+        self.targets = None
+        self.stores = None
+        self.layout = None
+
+    def accept(self, visitor):
+        return visitor.visit_parallelfor_stmt(self)
+
+
+class ParallelRegion(Stmt):
+    def __init__(self, keyword, body, reductions, workers):
+        self.keyword = keyword
+        self.body = body
+        self.reductions = reductions
+        self.workers = workers
+        # Filled in by the Resolver
+        self.captures = None
+        self.targets = None
+        self.stores = None
+        self.layout = None
+
+    def accept(self, visitor):
+        return visitor.visit_parallelregion_stmt(self)
+
+
+class Critical(Stmt):
+    def __init__(self, keyword, body):
+        self.keyword = keyword
+        self.body = body
+
+    def accept(self, visitor):
+        return visitor.visit_critical_stmt(self)
+
+
+class Barrier(Stmt):
+    def __init__(self, keyword):
+        self.keyword = keyword
+
+    def accept(self, visitor):
+        return visitor.visit_barrier_stmt(self)
+
+
 class Break(Stmt):
     def accept(self, visitor):
         return visitor.visit_break_stmt(self)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that work sent to remote workers survives a worker dying.
+
+Starts two --worker processes on localhost, runs a script with --hosts
+set to them, kills one of the workers while the script runs and compares
+what the script printed with a local run. Exits with an error when they
+differ or the killed worker had already finished.
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+NEBBDYR = os.path.join(DIRECTORY, os.pardir, "nebbdyr.py")
+SCRIPT = os.path.join(DIRECTORY, "pmap_failover.nebb")
+
+
+def start_worker():
+    """ A worker on a free port of localhost, and its address """
+    worker = subprocess.Popen([sys.executable, NEBBDYR, "--worker",
+                               "127.0.0.1:0"],
+                              stderr=subprocess.PIPE, text=True)
+    # "Worker listening on HOST:PORT"
+    line = worker.stderr.readline()
+    if not line.startswith("Worker listening on "):
+        worker.kill()
+        sys.exit("The worker did not start: " + line)
+    return worker, line.split()[-1]
+
+
+def run(arguments):
+    return subprocess.run([sys.executable, NEBBDYR, "--no-cache"] +
+                          arguments, stdout=subprocess.PIPE, text=True,
+                          check=True).stdout
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('script', nargs='?', default=SCRIPT,
+                        help="The script to run. Defaults to " +
+                        os.path.basename(SCRIPT) + ".")
+    parser.add_argument('--delay', type=float, default=0.5,
+                        help="The seconds to wait before killing a worker.")
+    args = parser.parse_args()
+
+    expected = run([args.script])
+    workers = [start_worker() for _ in range(2)]
+    try:
+        hosts = ",".join(address for _, address in workers)
+        remote = subprocess.Popen([sys.executable, NEBBDYR, "--no-cache",
+                                   "--hosts", hosts, "--chunk-size", "1",
+                                   args.script],
+                                  stdout=subprocess.PIPE, text=True)
+        time.sleep(args.delay)
+        finished = remote.poll() is not None
+        workers[0][0].send_signal(signal.SIGKILL)
+        output, _ = remote.communicate()
+    finally:
+        for worker, _ in workers:
+            worker.kill()
+            worker.wait()
+
+    if finished:
+        sys.exit("The script finished before the worker was killed. "
+                 "Use a shorter --delay.")
+    if output != expected:
+        sys.exit("The remote run printed\n{}instead of\n{}".format(
+            output, expected))
+    print("The remote run printed the same as the local run.")
@@ -68,5 +68,10 @@ class TokenType(Enum):
     CONTINUE = 47
     CLASS = 51
     UNSTABLE = 52
+    MEMO = 57
+    PARALLEL = 58
+    CRITICAL = 59
+    BARRIER = 60
+    SPAWN = 61
 
     EOF = 50
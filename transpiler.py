@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+from environment import UNASSIGNED, unassigned as unassigned_error
+from errors import RuntimeException
+from nebbdyrfunction import NebbdyrFunction
+from nebbdyrinstance import NebbdyrInstance
+from runtime import TailCall
+from nebbtypes import Type
+from tokentype import TokenType as TT
+import expr as ex
+import runtime
+import stmt as st
+
+
+class Untranslatable(Exception):
+    """ Raised when a function uses a construct the Transpiler can't handle """
+    pass
+
+
+ARITHMETIC = {TT.PLUS: '+', TT.MINUS: '-', TT.STAR: '*'}
+COMPARISON = {TT.GREATER: '>', TT.GREATER_EQUAL: '>=', TT.LESS: '<',
+              TT.LESS_EQUAL: '<='}
+
+VAR = 'var'
+MUT = 'mut'
+UNSTABLE = 'unstable'
+
+
+def unassigned(name):
+    raise unassigned_error(name)
+
+
+def immutable(name):
+    return RuntimeException(name, "Variable '{}' is immutable and can not be reassigned.".format(name.lexeme))
+
+
+def check_mutable(old, value, name):
+    if old is not UNASSIGNED and old is not None:
+        if Type.type(old) != Type.type(value):
+            raise RuntimeException(name, "Variable '{}' is type stable and can not change type to '{}'".format(name.lexeme, Type.type(value)))
+
+
+def make_call(interpreter):
+    def call(callee, arguments, paren):
+        runtime.check_arity(paren, callee, arguments)
+        try:
+            return callee.call(interpreter, arguments)
+        except RecursionError:
+            raise runtime.stack_overflow(paren)
+    return call
+
+
+def make_tail_call(interpreter):
+    def tail_call(callee, arguments, paren):
+        runtime.check_arity(paren, callee, arguments)
+        if isinstance(callee, NebbdyrFunction):
+            return TailCall(callee, arguments)
+        return callee.call(interpreter, arguments)
+    return tail_call
+
+
+def make_get(interpreter):
+    counters = interpreter.property_counters
+
+    def get(object, name, cache):
+        if isinstance(object, NebbdyrInstance):
+            return object.get_cached(name, cache, counters)
+        raise RuntimeException(name, "Only instances have properties")
+    return get
+
+
+def negate(operator, value):
+    runtime.check_number_operand(operator, value)
+    return -value
+
+
+# The helpers available to every translated function
+NAMESPACE = {
+    '_U': UNASSIGNED,
+    '_NUMBERS': (int, float),
+    '_unassigned': unassigned,
+    '_immutable': immutable,
+    '_check_mutable': check_mutable,
+    '_truthy': runtime.is_truthy,
+    '_stringify': runtime.stringify,
+    '_bound': runtime.range_bound,
+    '_construct': runtime.construct_list,
+    '_index': runtime.index,
+    '_view': runtime.view,
+    '_negate': negate,
+}
+
+
+class Local:
+    """ A variable of the translated function, kept in a Python local """
+    def __init__(self, identifier, kind, checked):
+        self.identifier = identifier
+        self.kind = kind
+        # Whether the variable may be unassigned when read
+        self.checked = checked
+
+
+class Transpiler:
+    """
+    Translates the AST of a Nebbdyr function into Python source.
+
+    Locals of the function become Python locals, while variables of
+    enclosing scopes are looked up in the closure at the distance found by
+    the Resolver. The translation keeps the rules of Nebbdyr: comparisons
+    return their right operand or false, none equals nothing, immutable
+    variables are assigned once and mutable ones keep their type.
+    """
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    def transpile(self, declaration):
+        """ Return the Python source of a factory making the function """
+        self.lines = []
+        self.constants = []
+        self.temporaries = 0
+        self.scopes = []
+        self.level = 2
+
+        self.begin_scope()
+        for i, parameter in enumerate(declaration.parameters):
+            local = self.declare(parameter, VAR, True)
+            self.write("{} = arguments[{}]".format(local.identifier, i))
+            self.write("if {0} is None: {0} = _U".format(local.identifier))
+        self.statements(declaration.body)
+        self.end_scope()
+
+        body = self.lines
+        parameters = ''.join(", _k{}".format(i)
+                             for i in range(len(self.constants)))
+        source = ["def _factory(_closure, _globals, _call, _tail, _get{}):".format(parameters),
+                  "    def function(arguments):"]
+        source += body
+        source += ["        return None",
+                   "    return function"]
+        return '\n'.join(source)
+
+    def compile(self, function):
+        """ Compile a NebbdyrFunction, returning a callable on its arguments """
+        source = self.transpile(function.declaration)
+        namespace = dict(NAMESPACE)
+        exec(compile(source, "<nebbdyr {}>".format(self.name(function)),
+                     'exec'), namespace)
+        return namespace['_factory'](function.closure,
+                                     self.interpreter.globals,
+                                     make_call(self.interpreter),
+                                     make_tail_call(self.interpreter),
+                                     make_get(self.interpreter),
+                                     *self.constants)
+
+    def name(self, function):
+        if isinstance(function.declaration, st.Function):
+            return function.declaration.name.lexeme
+        return "lambda"
+
+    # Bookkeeping
+
+    def write(self, line):
+        self.lines.append("    "*self.level + line)
+
+    def constant(self, value):
+        for i, constant in enumerate(self.constants):
+            if constant is value:
+                return "_k{}".format(i)
+        self.constants.append(value)
+        return "_k{}".format(len(self.constants) - 1)
+
+    def temporary(self):
+        self.temporaries += 1
+        return "_t{}".format(self.temporaries)
+
+    def begin_scope(self):
+        self.scopes.append({})
+
+    def end_scope(self):
+        self.scopes.pop()
+
+    def declare(self, name, kind, checked):
+        self.temporaries += 1
+        identifier = "v{}_{}".format(self.temporaries, name.lexeme)
+        local = Local(identifier, kind, checked)
+        self.scopes[-1][name.lexeme] = local
+        return local
+
+    def resolve(self, expr, name):
+        """ Find a variable as either a local or a slot in the closure """
+        distance = expr.depth
+        if distance is None:
+            return None, None
+        if distance < len(self.scopes):
+            return self.scopes[len(self.scopes) - 1 - distance][name.lexeme], None
+        return None, (distance - len(self.scopes), expr.slot)
+
+    # Statements
+
+    def statements(self, statements):
+        if not isinstance(statements, list):
+            statements = [statements]
+        for statement in statements:
+            self.statement(statement)
+
+    def statement(self, statement):
+        if isinstance(statement, st.Expression):
+            expression = statement.expression
+            if isinstance(expression, ex.Assign):
+                self.store(expression, self.expression(expression.value))
+            else:
+                self.write(self.expression(expression))
+        elif isinstance(statement, st.Print):
+            self.write("print(_stringify({}))".format(
+                self.expression(statement.expression)))
+        elif isinstance(statement, st.Return):
+            if statement.value is None:
+                self.write("return None")
+            elif statement.tail:
+                # A TailCall is run by NebbdyrFunction.call
+                self.write("return " + self.call(statement.value, "_tail"))
+            else:
+                self.write("return " + self.expression(statement.value))
+        elif isinstance(statement, (st.Var, st.Mut, st.Unstable)):
+            self.declaration(statement)
+        elif isinstance(statement, st.Block):
+            # Blocks declaring nothing have no scope of their own
+            if statement.layout is None:
+                self.statements(statement.statements)
+            else:
+                self.begin_scope()
+                self.statements(statement.statements)
+                self.end_scope()
+        elif isinstance(statement, st.If):
+            self.write("if {}:".format(self.truthy(statement.condition)))
+            self.branch(statement.then_branch)
+            if statement.else_branch is not None:
+                self.write("else:")
+                self.branch(statement.else_branch)
+        elif isinstance(statement, st.While):
+            self.write("while {}:".format(self.truthy(statement.condition)))
+            self.branch(statement.body)
+        elif isinstance(statement, st.Break):
+            self.write("break")
+        elif isinstance(statement, st.Continue):
+            self.write("continue")
+        else:
+            raise Untranslatable(type(statement).__name__)
+
+    def branch(self, statement):
+        self.level += 1
+        written = len(self.lines)
+        self.statement(statement)
+        if len(self.lines) == written:
+            self.write("pass")
+        self.level -= 1
+
+    def declaration(self, statement):
+        if isinstance(statement, st.Var):
+            kind = VAR
+        elif isinstance(statement, st.Mut):
+            kind = MUT
+        else:
+            kind = UNSTABLE
+
+        initializer = statement.initializer
+        if initializer is None:
+            value = "_U"
+        else:
+            value = self.expression(initializer)
+        checked = initializer is None or not self.never_none(initializer)
+        local = self.declare(statement.name, kind, checked)
+        self.write("{} = {}".format(local.identifier, value))
+        if initializer is not None and checked:
+            self.write("if {0} is None: {0} = _U".format(local.identifier))
+
+    def store(self, expression, value):
+        """ Write an assignment statement. Assignments used as values are not translated """
+        name = expression.name
+        local, location = self.resolve(expression, name)
+        token = self.constant(name)
+        if local is None:
+            if location is None:
+                self.write("_globals.assign({}, {})".format(token, value))
+            else:
+                self.write("_closure.assign_at({}, {}, {}, {})".format(
+                    *location, token, value))
+            return
+
+        identifier = local.identifier
+        if local.kind == VAR:
+            temporary = self.temporary()
+            self.write("{} = {}".format(temporary, value))
+            self.write("if {} is not _U: raise _immutable({})".format(
+                identifier, token))
+            self.write("{} = {}".format(identifier, temporary))
+        elif local.kind == MUT:
+            temporary = self.temporary()
+            self.write("{} = {}".format(temporary, value))
+            self.write("if type({0}) is not type({1}): _check_mutable({0}, {1}, {2})".format(
+                identifier, temporary, token))
+            self.write("{} = {}".format(identifier, temporary))
+        else:
+            self.write("{} = {}".format(identifier, value))
+
+    # Expressions
+
+    def never_none(self, expression):
+        """ Whether an expression is known to never evaluate to none """
+        if isinstance(expression, ex.Literal):
+            return expression.value is not None
+        if isinstance(expression, ex.Grouping):
+            return self.never_none(expression.expression)
+        if isinstance(expression, ex.Binary):
+            return expression.operator.type not in (TT.EQUAL, TT.BANG_EQUAL)
+        return isinstance(expression, (ex.Unary, ex.List, ex.ListConstructor))
+
+    def truthy(self, expression):
+        # Anything falsy except the integer 0 is false
+        temporary = self.temporary()
+        return "(({} := {}) or type({}) is int)".format(
+            temporary, self.expression(expression), temporary)
+
+    def expression(self, expression):
+        method = getattr(self, type(expression).__name__.lower(), None)
+        if method is None:
+            raise Untranslatable(type(expression).__name__)
+        return method(expression)
+
+    def literal(self, expression):
+        if isinstance(expression.value, (bool, int, float, str, type(None))):
+            return repr(expression.value)
+        return self.constant(expression.value)
+
+    def grouping(self, expression):
+        return self.expression(expression.expression)
+
+    def variable(self, expression):
+        name = expression.name
+        local, location = self.resolve(expression, name)
+        if local is None:
+            if location is None:
+                return "_globals.get({})".format(self.constant(name))
+            return "_closure.get_at({}, {}, {})".format(*location,
+                                                         self.constant(name))
+        if not local.checked:
+            return local.identifier
+        return "({0} if {0} is not _U else _unassigned({1}))".format(
+            local.identifier, self.constant(name))
+
+    def binary(self, expression):
+        operator = expression.operator
+        left = self.expression(expression.left)
+        right = self.expression(expression.right)
+        slow = "{}({}, {{0}}, {{1}})".format(
+            self.constant(runtime.BINARY[operator.type]),
+            self.constant(operator))
+
+        if operator.type in ARITHMETIC or operator.type in COMPARISON:
+            a = self.temporary()
+            b = self.temporary()
+            if operator.type in ARITHMETIC:
+                fast = "{} {} {}".format(a, ARITHMETIC[operator.type], b)
+            else:
+                fast = "({1} if {0} {2} {1} else False)".format(
+                    a, b, COMPARISON[operator.type])
+            # Both operands are evaluated before the types are checked
+            return ("({fast} if (type({a} := {left}) in _NUMBERS) & "
+                    "(type({b} := {right}) in _NUMBERS) else {slow})").format(
+                        fast=fast, a=a, b=b, left=left, right=right,
+                        slow=slow.format(a, b))
+        return slow.format(left, right)
+
+    def logical(self, expression):
+        temporary = self.temporary()
+        left = self.expression(expression.left)
+        right = self.expression(expression.right)
+        if expression.operator.type == TT.OR:
+            return "({0} if _truthy({0} := {1}) else {2})".format(
+                temporary, left, right)
+        return "({0} if not _truthy({0} := {1}) else {2})".format(
+            temporary, left, right)
+
+    def unary(self, expression):
+        operator = expression.operator
+        if operator.type == TT.MINUS:
+            return "_negate({}, {})".format(self.constant(operator),
+                                            self.expression(expression.right))
+        if operator.type == TT.BANG:
+            return "(not _truthy({}))".format(self.expression(expression.right))
+        # Increment and decrement are left to the interpreter
+        raise Untranslatable(operator.lexeme)
+
+    def call(self, expression, helper="_call"):
+        callee = self.expression(expression.callee)
+        arguments = ', '.join(self.expression(argument)
+                              for argument in expression.arguments)
+        return "{}({}, [{}], {})".format(helper, callee, arguments,
+                                         self.constant(expression.paren))
+
+    def list(self, expression):
+        return "[{}]".format(', '.join(self.expression(element)
+                                       for element in expression.expression))
+
+    def index(self, expression):
+        collection = self.expression(expression.collection)
+        indicies = ', '.join(self.expression(index)
+                             for index in expression.indicies)
+        return "_index({}, {}, [{}])".format(self.constant(expression.paren),
+                                             collection, indicies)
+
+    def slice(self, expression):
+        return "_view({}, {}, {}, {})".format(
+            self.constant(expression.paren),
+            self.expression(expression.collection),
+            self.expression(expression.start),
+            self.expression(expression.stop))
+
+    def listconstructor(self, expression):
+        token = self.constant(expression.token)
+        start = "_bound({}, {}, 'Start')".format(
+            token, self.expression(expression.start))
+        next = "None"
+        if expression.next is not None:
+            next = "_bound({}, {}, 'Next')".format(
+                token, self.expression(expression.next))
+        stop = "_bound({}, {}, 'Stop')".format(
+            token, self.expression(expression.stop))
+        return "_construct({}, {}, {})".format(start, next, stop)
+
+    def get(self, expression):
+        return "_get({}, {}, {})".format(self.expression(expression.object),
+                                         self.constant(expression.name),
+                                         self.constant(expression.cache))
@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs for loops doing arithmetic on the elements of lists of numbers as a
+few NumPy operations instead of one iteration at a time.
+
+The Resolver plans every for loop whose body is one of
+
+    out[i] := e                 a map
+    s := s + e or s := s * e    a sum or a product
+    if e < m: m := e            a min, or a max with >, with the operands
+                                either way round and <= and >= as well
+
+where e only adds, subtracts, multiplies, divides and negates numbers,
+the loop variable, variables declared outside of the loop and elements
+a[i], a[i + 1] or a[i - 1] of lists, and a map's e may also compare two
+such expressions. s and m must be declared with mut or unstable. The
+backends run a planned loop over a range with run, which returns None
+when the values it reads could give another result than the loop would.
+The loop then runs serially, which also raises the errors.
+
+The elements of a list must all be whole numbers or all decimal numbers,
+so that NumPy computes in the type Python would. Loops fall back on whole
+numbers which could overflow 64 bits, whole numbers beyond 2^53 divided by
+or compared with another number, division by zero, stores out of bounds
+or into lists read at other indices, and for min and max decimal zeros
+and NaNs. A comparison returns its right operand, and a zero decimal
+number is false, so with zeros the loop does not simply find the least
+element. Sums and products of decimal numbers are accumulated in order,
+so they round like the loop.
+"""
+
+from errors import RuntimeException
+from expr import Assign, Binary, Grouping, Index, Literal, SetIndex, Unary, Variable
+from nebbdyrarray import NebbdyrArray, load_numpy
+from nebbdyrrange import NebbdyrRange, is_range
+from nebbdyrshared import NebbdyrShared
+from nebbdyrslice import NebbdyrSlice
+from stmt import Block, Expression, If, Mut, Unstable
+from tokentype import TokenType as TT
+
+# The kinds of loops
+MAP = "map"
+SUM = "sum"
+PRODUCT = "product"
+MIN = "min"
+MAX = "max"
+
+# The fewest iterations worth the calls into NumPy
+MINIMUM = 16
+
+# Whole numbers are computed with 64 bits, and are exact as decimal
+# numbers up to 2^53
+LIMIT = 2**63
+EXACT = 2**53
+
+ARITHMETIC = {TT.PLUS, TT.MINUS, TT.STAR, TT.SLASH}
+COMPARISONS = {TT.LESS, TT.LESS_EQUAL, TT.GREATER, TT.GREATER_EQUAL,
+               TT.EQUAL, TT.BANG_EQUAL}
+
+numpy = None
+
+
+class Vector:
+    """ How a for loop runs as NumPy operations, made by plan """
+    def __init__(self, kind, loop, expression, target, names):
+        self.kind = kind
+        # The name of the loop variable
+        self.loop = loop
+        self.expression = expression
+        # The name of the list stored into, or of the variable reduced
+        self.target = target
+        # The outer names read, starting with the target
+        self.names = names
+        # The names read at other indices than the loop variable or as
+        # numbers
+        self.shifted = set()
+        # Variables reading the names, and the variable assigned the
+        # reduced value, resolved where the loop is
+        self.variables = []
+        self.targets = []
+
+
+class Fallback(Exception):
+    """ Raised when a loop has to run serially """
+    pass
+
+
+# Planning
+
+def single(body):
+    """ The only statement of a body, or None """
+    while isinstance(body, Block):
+        if len(body.statements) != 1:
+            return None
+        body = body.statements[0]
+    return body
+
+
+def is_variable(expr, name):
+    return isinstance(expr, Variable) and expr.name.lexeme == name
+
+
+def same(left, right):
+    """ Whether two expressions are written the same """
+    if type(left) is not type(right):
+        return False
+    if isinstance(left, Literal):
+        return type(left.value) is type(right.value) and left.value == right.value
+    if isinstance(left, Variable):
+        return left.name.lexeme == right.name.lexeme
+    if isinstance(left, Grouping):
+        return same(left.expression, right.expression)
+    if isinstance(left, Unary):
+        return (left.operator.type == right.operator.type and
+                same(left.right, right.right))
+    if isinstance(left, Binary):
+        return (left.operator.type == right.operator.type and
+                same(left.left, right.left) and same(left.right, right.right))
+    if isinstance(left, Index):
+        return (same(left.collection, right.collection) and
+                len(left.indicies) == len(right.indicies) and
+                all(same(a, b) for a, b in zip(left.indicies, right.indicies)))
+    return False
+
+
+def offset(expr, loop):
+    """ c of the index i + c or i - c, or None for other indices """
+    if is_variable(expr, loop):
+        return 0
+    if (isinstance(expr, Binary) and expr.operator.type in (TT.PLUS, TT.MINUS)
+            and is_variable(expr.left, loop) and isinstance(expr.right, Literal)
+            and type(expr.right.value) is int):
+        return expr.right.value if expr.operator.type == TT.PLUS else -expr.right.value
+    return None
+
+
+def element_wise(expr, loop, reads, comparison=False):
+    """
+    Whether expr can be computed for every iteration at once, adding the
+    outer names it reads to reads as (name, offset), with an offset of
+    None for names read as numbers
+    """
+    if isinstance(expr, Literal):
+        return type(expr.value) in (int, float)
+    if isinstance(expr, Variable):
+        if expr.name.lexeme != loop:
+            reads.append((expr.name, None))
+        return True
+    if isinstance(expr, Grouping):
+        return element_wise(expr.expression, loop, reads, comparison)
+    if isinstance(expr, Unary):
+        return (expr.operator.type == TT.MINUS and
+                element_wise(expr.right, loop, reads))
+    if isinstance(expr, Binary):
+        operator = expr.operator.type
+        if operator not in ARITHMETIC and not (comparison and operator in COMPARISONS):
+            return False
+        return (element_wise(expr.left, loop, reads) and
+                element_wise(expr.right, loop, reads))
+    if isinstance(expr, Index):
+        if (not isinstance(expr.collection, Variable) or
+                expr.collection.name.lexeme == loop or len(expr.indicies) != 1):
+            return False
+        shift = offset(expr.indicies[0], loop)
+        if shift is None:
+            return False
+        reads.append((expr.collection.name, shift))
+        return True
+    return False
+
+
+def reduction(body):
+    """ (kind, e, name) of a body reducing into a variable, or None """
+    if isinstance(body, Expression) and isinstance(body.expression, Assign):
+        name, value = body.expression.name, body.expression.value
+        if (isinstance(value, Binary) and
+                value.operator.type in (TT.PLUS, TT.STAR) and
+                is_variable(value.left, name.lexeme)):
+            kind = SUM if value.operator.type == TT.PLUS else PRODUCT
+            return kind, value.right, name
+        return None
+    if not isinstance(body, If) or body.else_branch is not None:
+        return None
+    assign = single(body.then_branch)
+    condition = body.condition
+    if (not isinstance(assign, Expression) or
+            not isinstance(assign.expression, Assign) or
+            not isinstance(condition, Binary) or
+            condition.operator.type not in (TT.LESS, TT.LESS_EQUAL,
+                                            TT.GREATER, TT.GREATER_EQUAL)):
+        return None
+    name, value = assign.expression.name, assign.expression.value
+    less = condition.operator.type in (TT.LESS, TT.LESS_EQUAL)
+    # if e < m and if m > e find the least e
+    if is_variable(condition.right, name.lexeme) and same(condition.left, value):
+        kind = MIN if less else MAX
+    elif is_variable(condition.left, name.lexeme) and same(condition.right, value):
+        kind = MAX if less else MIN
+    else:
+        return None
+    return kind, value, name
+
+
+def plan(loop, declaration):
+    """
+    The Vector of a for loop, or None when it is not one NumPy can run.
+    declaration finds the statement declaring a name, see
+    Resolver.declaration.
+    """
+    body = single(loop.body)
+    name = loop.name.lexeme
+    reads = []
+    if isinstance(body, Expression) and isinstance(body.expression, SetIndex):
+        assignment = body.expression
+        if (not isinstance(assignment.collection, Variable) or
+                assignment.collection.name.lexeme == name or
+                offset(assignment.index, name) != 0 or
+                not element_wise(assignment.value, name, reads, comparison=True)):
+            return None
+        kind, expression = MAP, assignment.value
+        target = assignment.collection.name
+        # Other elements of the list may have been stored into already
+        if any(read.lexeme == target.lexeme and shift != 0
+               for read, shift in reads):
+            return None
+    else:
+        found = reduction(body)
+        if found is None:
+            return None
+        kind, expression, target = found
+        if (target.lexeme == name or
+                not element_wise(expression, name, reads) or
+                any(read.lexeme == target.lexeme for read, _ in reads) or
+                not isinstance(declaration(target.lexeme)[0], (Mut, Unstable))):
+            return None
+
+    names = [target]
+    for read, _ in reads:
+        if all(read.lexeme != known.lexeme for known in names):
+            names.append(read)
+    vector = Vector(kind, name, expression, target, names)
+    vector.shifted = {read.lexeme for read, shift in reads if shift != 0}
+    return vector
+
+
+# Running
+
+def applies(collection):
+    """ Whether a planned loop over collection is worth trying with NumPy """
+    return is_range(collection) and len(collection) >= MINIMUM
+
+
+def storage(value):
+    """ What holds the elements of a list, slice, shared list or array """
+    if isinstance(value, NebbdyrSlice):
+        return storage(value.list)
+    if isinstance(value, NebbdyrShared):
+        return value.segment
+    if isinstance(value, NebbdyrArray):
+        return value.array
+    return value
+
+
+def overlaps(out, value):
+    """
+    Whether value holds elements of the list stored into at other indices
+    than out, or at the same ones, or None when it holds none of them
+    """
+    if isinstance(out, NebbdyrArray) and isinstance(value, NebbdyrArray):
+        if value.array is out.array:
+            return False
+        return True if numpy.may_share_memory(value.array, out.array) else None
+    if storage(value) is not storage(out):
+        return None
+    return type(value) is not type(out)
+
+
+def to_array(value):
+    """ The elements of a list as an array of 64 bit numbers """
+    if is_range(value):
+        return numpy.arange(value.range.start, value.range.stop,
+                            value.range.step, dtype=numpy.int64)
+    if isinstance(value, NebbdyrShared):
+        if value.freed():
+            raise Fallback()
+        return numpy.asarray(value.segment.view)
+    if isinstance(value, NebbdyrArray):
+        array = value.array
+        if array.ndim != 1 or array.dtype not in (numpy.int64, numpy.float64):
+            raise Fallback()
+        return array
+    if isinstance(value, NebbdyrSlice) and isinstance(value.list, NebbdyrShared):
+        return to_array(value.list)[value.start:value.stop]
+    if not isinstance(value, (list, NebbdyrRange, NebbdyrSlice)):
+        raise Fallback()
+    values = list(value)
+    types = set(map(type, values))
+    try:
+        if types == {int}:
+            return numpy.array(values, dtype=numpy.int64)
+        if types == {float}:
+            return numpy.array(values, dtype=numpy.float64)
+    except OverflowError:
+        pass
+    raise Fallback()
+
+
+def operand(array):
+    """ An operand of a computed array, with its type and bound """
+    if array.dtype == numpy.int64:
+        if array.size == 0:
+            return array, int, 0
+        return array, int, max(abs(int(array.min())), abs(int(array.max())))
+    return array, float, None
+
+
+def bounded(kind, bound, limit):
+    if kind is int and bound >= limit:
+        raise Fallback()
+
+
+class Evaluation:
+    """ Computes the expression of a loop for all of its iterations """
+    def __init__(self, vector, indices, values):
+        self.vector = vector
+        self.indices = indices
+        self.values = {name.lexeme: value
+                       for name, value in zip(vector.names, values)}
+        # The arrays of the lists read, by name
+        self.arrays = {}
+
+    def evaluate(self, expr):
+        """ (value, type, bound) of expr, the bound only for whole numbers """
+        if isinstance(expr, Literal):
+            value = expr.value
+            return value, type(value), abs(value) if type(value) is int else None
+        if isinstance(expr, Variable):
+            if expr.name.lexeme == self.vector.loop:
+                return operand(self.indices)
+            value = self.values[expr.name.lexeme]
+            if type(value) is int:
+                return value, int, abs(value)
+            if type(value) is float:
+                return value, float, None
+            raise Fallback()
+        if isinstance(expr, Grouping):
+            return self.evaluate(expr.expression)
+        if isinstance(expr, Unary):
+            value, kind, bound = self.evaluate(expr.right)
+            return -value, kind, bound
+        if isinstance(expr, Index):
+            return self.element(expr)
+        return self.arithmetic(expr.operator.type, self.evaluate(expr.left),
+                               self.evaluate(expr.right))
+
+    def element(self, expr):
+        name = expr.collection.name.lexeme
+        if name not in self.arrays:
+            self.arrays[name] = operand(to_array(self.values[name]))
+        array, kind, bound = self.arrays[name]
+        indices = self.indices + offset(expr.indicies[0], self.vector.loop)
+        length = len(array)
+        if not (-length <= indices.min() and indices.max() < length):
+            raise Fallback()
+        # Negative indices count from the end, as in Nebbdyr
+        return array[indices], kind, bound
+
+    def arithmetic(self, operator, left, right):
+        left, left_kind, left_bound = left
+        right, right_kind, right_bound = right
+        kind = int if left_kind is int and right_kind is int else float
+        if operator == TT.SLASH:
+            if numpy.any(numpy.equal(right, 0)):
+                raise Fallback()
+            bounded(left_kind, left_bound, EXACT)
+            bounded(right_kind, right_bound, EXACT)
+            return left / right, float, None
+        bound = None
+        if kind is int:
+            if operator == TT.STAR:
+                bound = left_bound * right_bound
+            else:
+                bound = left_bound + right_bound
+            bounded(kind, bound, LIMIT)
+        elif left_kind is not right_kind:
+            # Whole numbers are converted to decimal numbers like Python does
+            bounded(left_kind, left_bound, LIMIT)
+            bounded(right_kind, right_bound, LIMIT)
+        if operator == TT.PLUS:
+            return left + right, kind, bound
+        if operator == TT.MINUS:
+            return left - right, kind, bound
+        return left * right, kind, bound
+
+    def elements(self, expr):
+        """ The value of expr at every iteration, as a list """
+        count = len(self.indices)
+        if isinstance(expr, Grouping):
+            return self.elements(expr.expression)
+        if not isinstance(expr, Binary) or expr.operator.type not in COMPARISONS:
+            value, kind, _ = self.evaluate(expr)
+            return numpy.broadcast_to(numpy.asarray(value), (count,)).tolist(), kind
+        left, left_kind, left_bound = self.evaluate(expr.left)
+        right, right_kind, right_bound = self.evaluate(expr.right)
+        if left_kind is not right_kind:
+            # Python compares whole and decimal numbers exactly
+            bounded(left_kind, left_bound, EXACT)
+            bounded(right_kind, right_bound, EXACT)
+        operator = expr.operator.type
+        if operator == TT.LESS:
+            truth = numpy.less(left, right)
+        elif operator == TT.LESS_EQUAL:
+            truth = numpy.less_equal(left, right)
+        elif operator == TT.GREATER:
+            truth = numpy.greater(left, right)
+        elif operator == TT.GREATER_EQUAL:
+            truth = numpy.greater_equal(left, right)
+        elif operator == TT.EQUAL:
+            truth = numpy.equal(left, right)
+        else:
+            truth = numpy.not_equal(left, right)
+        # A comparison gives its right operand when it holds and false
+        rights = numpy.broadcast_to(numpy.asarray(right), (count,)).tolist()
+        truths = numpy.broadcast_to(truth, (count,)).tolist()
+        return [value if holds else False
+                for value, holds in zip(rights, truths)], None
+
+
+def store(out, indices, values, kind):
+    """ Store the values of a map into out at indices """
+    if isinstance(out, NebbdyrRange):
+        out = out.materialize()
+    if not isinstance(out, (list, NebbdyrShared, NebbdyrArray)):
+        raise Fallback()
+    length = len(out)
+    first, last = int(indices.min()), int(indices.max())
+    # Indices on both sides of zero could store into an element twice
+    if not (-length <= first and last < length) or (first < 0 <= last):
+        raise Fallback()
+    if isinstance(out, list):
+        if indices[-1] - indices[0] == len(indices) - 1:
+            start = int(indices[0]) % length
+            out[start:start + len(values)] = values
+        else:
+            for index, value in zip(indices.tolist(), values):
+                out[index] = value
+        return
+    # Shared lists and arrays only hold numbers, and shared lists of whole
+    # numbers and arrays of whole numbers only whole numbers
+    if kind is None:
+        raise Fallback()
+    if isinstance(out, NebbdyrShared):
+        if out.freed() or (out.typecode == 'q' and kind is float):
+            raise Fallback()
+        target = numpy.asarray(out.segment.view)
+    else:
+        target = out.array
+        if target.ndim != 1 or not (target.dtype == numpy.float64 or
+                                    (target.dtype == numpy.int64 and kind is int)):
+            raise Fallback()
+    target[indices] = values
+
+
+def accumulate(function, start, values, count):
+    """ Fold decimal numbers in order, rounding like the loop """
+    if type(start) is int:
+        bounded(int, abs(start), LIMIT)
+    array = numpy.empty(count + 1, dtype=numpy.float64)
+    array[0] = start
+    array[1:] = values
+    return function.accumulate(array)[-1].item()
+
+
+def reduce(vector, start, value, kind, bound, count):
+    """ The value a reduction ends with """
+    if type(start) not in (int, float):
+        raise Fallback()
+    values = numpy.broadcast_to(numpy.asarray(value), (count,))
+    if vector.kind == SUM:
+        if type(start) is int and kind is int:
+            bounded(int, abs(start) + count * bound, LIMIT)
+            return start + int(values.sum())
+        return accumulate(numpy.add, start, values, count)
+    if vector.kind == PRODUCT:
+        if type(start) is int and kind is int:
+            if start.bit_length() + count * bound.bit_length() >= 63:
+                raise Fallback()
+            return start * int(values.prod())
+        return accumulate(numpy.multiply, start, values, count)
+    if type(start) is not kind:
+        raise Fallback()
+    if kind is float and (numpy.isnan(start) or start == 0 or
+                          numpy.isnan(values).any() or (values == 0).any()):
+        raise Fallback()
+    if vector.kind == MIN:
+        return min(start, values.min().item())
+    return max(start, values.max().item())
+
+
+def run(vector, collection, values):
+    """
+    Run a planned loop over collection with the values of vector.names,
+    returning the values of vector.targets, or None when the loop has to
+    run serially
+    """
+    global numpy
+    try:
+        numpy = load_numpy(None)
+    except RuntimeException:
+        return None
+    indices = to_array(collection)
+    evaluation = Evaluation(vector, indices, values)
+    try:
+        with numpy.errstate(all='ignore'):
+            if vector.kind == MAP:
+                run_map(vector, evaluation, indices, values)
+                return []
+            value, kind, bound = evaluation.evaluate(vector.expression)
+            return [reduce(vector, values[0], value, kind, bound, len(indices))]
+    except Fallback:
+        return None
+
+
+def run_map(vector, evaluation, indices, values):
+    out = values[0]
+    for name, value in zip(vector.names[1:], values[1:]):
+        elsewhere = overlaps(out, value)
+        if elsewhere or (elsewhere is False and name.lexeme in vector.shifted):
+            raise Fallback()
+    elements, kind = evaluation.elements(vector.expression)
+    store(out, indices, elements, kind)
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+
+from bytecode import *
+from compiler import Compiler
+from environment import UNASSIGNED, unassigned
+from memo import MISSING
+from errors import RuntimeException, IndexException
+from interpreter import Interpreter
+from nebbdyrclass import NebbdyrClass
+from nebbdyrinstance import NebbdyrInstance
+from nebbtypes import Type
+import parallel
+import runtime
+import vectorize
+
+
+class Cell:
+    """ A local variable shared between a frame and the closures capturing it """
+    __slots__ = ('value', 'name', 'kind')
+
+    def __init__(self, value, name, kind):
+        self.value = value
+        self.name = name
+        self.kind = kind
+
+
+class Closure:
+    """ A compiled function together with the cells it has captured """
+    def __init__(self, code, cells, memo=None):
+        self.code = code
+        self.cells = cells
+        self.memo = memo
+
+    def arity(self):
+        return self.code.arity()
+
+    def call(self, interpreter, arguments):
+        return interpreter.vm.call(self, arguments)
+
+    def to_string(self):
+        return "<fn " + self.code.name + ">"
+
+
+class Frame:
+    __slots__ = ('closure', 'code', 'slots', 'ip', 'memo')
+
+    def __init__(self, closure, arguments):
+        self.closure = closure
+        self.code = closure.code
+        self.slots = [UNASSIGNED]*len(self.code.local_names)
+        for i, argument in enumerate(arguments):
+            if argument is not None:
+                self.slots[i] = argument
+        self.ip = 0
+        # The cache and key to store the result in when returning
+        self.memo = None
+
+
+def check_assignment(kind, name, old, value):
+    """ Enforce the mutability rules of a variable of the given kind """
+    if kind == MUT:
+        if (old is not UNASSIGNED and old is not None and
+                Type.type(old) != Type.type(value)):
+            raise RuntimeException(name, "Variable '{}' is type stable and can not change type to '{}'".format(name.lexeme, Type.type(value)))
+    elif kind == VAR and old is not UNASSIGNED:
+        raise RuntimeException(name, "Variable '{}' is immutable and can not be reassigned.".format(name.lexeme))
+
+
+class VM:
+    """
+    Executes Code objects with a dispatch loop.
+
+    Calls between Nebbdyr functions push a Frame instead of recursing in
+    Python, so recursion is limited by memory, and a tail call replaces
+    the Frame of the caller. Break, continue and return are plain jumps.
+    """
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.globals = interpreter.globals
+
+    def run(self, code):
+        return self.execute(Frame(Closure(code, []), []))
+
+    def call(self, closure, arguments):
+        return self.execute(Frame(closure, arguments))
+
+    def execute(self, frame):
+        # The number of critical sections the frames of this call are in,
+        # left again when an error unwinds them
+        held = [0]
+        try:
+            return self.dispatch(frame, held)
+        except BaseException:
+            team = self.interpreter.team
+            for _ in range(held[0]):
+                team.exit()
+            raise
+
+    def dispatch(self, frame, held):
+        globals = self.globals
+        interpreter = self.interpreter
+        is_truthy = runtime.is_truthy
+        BINARY = runtime.BINARY
+
+        frames = [frame]
+        stack = []
+        push = stack.append
+        pop = stack.pop
+
+        code = frame.code.code
+        tokens = frame.code.tokens
+        constants = frame.code.constants
+        slots = frame.slots
+        cells = frame.closure.cells
+        ip = 0
+
+        while True:
+            op = code[ip]
+            arg = code[ip+1]
+            ip += 2
+
+            if op == GET_LOCAL:
+                value = slots[arg]
+                if value is UNASSIGNED:
+                    raise unassigned(tokens[(ip >> 1) - 1])
+                push(value)
+            elif op == CONSTANT:
+                push(constants[arg])
+            elif op == SET_LOCAL:
+                value = stack[-1]
+                frame_code = frames[-1].code
+                check_assignment(frame_code.local_kinds[arg],
+                                 tokens[(ip >> 1) - 1], slots[arg], value)
+                slots[arg] = value
+            elif op == ADD or op == SUBTRACT or op == MULTIPLY or op == LESS:
+                right = pop()
+                left = stack[-1]
+                if type(left) in (int, float) and type(right) in (int, float):
+                    if op == ADD:
+                        stack[-1] = left + right
+                    elif op == SUBTRACT:
+                        stack[-1] = left - right
+                    elif op == MULTIPLY:
+                        stack[-1] = left * right
+                    else:
+                        stack[-1] = right if left < right else False
+                else:
+                    operator = tokens[(ip >> 1) - 1]
+                    stack[-1] = BINARY[operator.type](operator, left, right)
+            elif op == POP:
+                pop()
+            elif op == JUMP_IF_FALSE:
+                if not is_truthy(pop()):
+                    ip = arg
+            elif op == JUMP:
+                ip = arg
+            elif op == GET_GLOBAL:
+                push(globals.get(constants[arg]))
+            elif op == CALL or op == TAIL_CALL:
+                callee = stack[-arg-1]
+                paren = tokens[(ip >> 1) - 1]
+                if type(callee) is Closure:
+                    if arg != len(callee.code.parameters):
+                        raise RuntimeException(paren, "Expected " + str(callee.arity()) +
+                                               " arguments, but got " + str(arg) + ".")
+                    arguments = stack[len(stack)-arg:]
+                    del stack[len(stack)-arg-1:]
+                    memo = callee.memo
+                    if memo is not None:
+                        key = memo.key(arguments)
+                        if key is not None:
+                            value = memo.get(key)
+                            if value is not MISSING:
+                                push(value)
+                                continue
+                    frame = Frame(callee, arguments)
+                    if memo is not None and key is not None:
+                        frame.memo = (memo, key)
+                    # Results of memoized frames are stored on return, so
+                    # those frames are never replaced
+                    if (op == CALL or frame.memo is not None or
+                            frames[-1].memo is not None):
+                        frames[-1].ip = ip
+                        frames.append(frame)
+                    else:
+                        frames[-1] = frame
+                    code = frame.code.code
+                    tokens = frame.code.tokens
+                    constants = frame.code.constants
+                    slots = frame.slots
+                    cells = callee.cells
+                    ip = 0
+                else:
+                    arguments = stack[len(stack)-arg:]
+                    del stack[len(stack)-arg-1:]
+                    if not hasattr(callee, 'arity'):
+                        raise RuntimeException(paren, "Can only call functions and classes.")
+                    if arg != callee.arity():
+                        raise RuntimeException(paren, "Expected " + str(callee.arity()) +
+                                               " arguments, but got " + str(arg) + ".")
+                    push(callee.call(interpreter, arguments))
+            elif op == RETURN:
+                value = pop()
+                if frames[-1].memo is not None:
+                    memo, key = frames[-1].memo
+                    memo.store(key, value)
+                frames.pop()
+                if not frames:
+                    return value
+                frame = frames[-1]
+                code = frame.code.code
+                tokens = frame.code.tokens
+                constants = frame.code.constants
+                slots = frame.slots
+                cells = frame.closure.cells
+                ip = frame.ip
+                push(value)
+            elif op == DEFINE_LOCAL:
+                value = pop()
+                slots[arg] = UNASSIGNED if value is None else value
+            elif op == INIT_LOCAL:
+                slots[arg] = pop()
+            elif op == GET_CELL:
+                value = slots[arg].value
+                if value is UNASSIGNED:
+                    raise unassigned(tokens[(ip >> 1) - 1])
+                push(value)
+            elif op == GET_UPVALUE:
+                value = cells[arg].value
+                if value is UNASSIGNED:
+                    raise unassigned(tokens[(ip >> 1) - 1])
+                push(value)
+            elif op == SET_CELL or op == SET_UPVALUE:
+                cell = slots[arg] if op == SET_CELL else cells[arg]
+                value = stack[-1]
+                check_assignment(cell.kind, tokens[(ip >> 1) - 1],
+                                 cell.value, value)
+                cell.value = value
+            elif op == DEFINE_CELL:
+                value = pop()
+                slots[arg] = Cell(UNASSIGNED if value is None else value,
+                                  frames[-1].code.local_names[arg],
+                                  frames[-1].code.local_kinds[arg])
+            elif op == INIT_CELL:
+                slots[arg].value = pop()
+            elif op == BOX:
+                slots[arg] = Cell(slots[arg], frames[-1].code.local_names[arg],
+                                  frames[-1].code.local_kinds[arg])
+            elif op == NOP:
+                pass
+            elif op == SET_GLOBAL:
+                globals.assign(tokens[(ip >> 1) - 1], stack[-1])
+            elif op == DEFINE_GLOBAL:
+                name, attributes = constants[arg]
+                globals.define(name, pop(), attributes)
+            elif op == JUMP_IF_FALSE_OR_POP:
+                if not is_truthy(stack[-1]):
+                    ip = arg
+                else:
+                    pop()
+            elif op == JUMP_IF_TRUE_OR_POP:
+                if is_truthy(stack[-1]):
+                    ip = arg
+                else:
+                    pop()
+            elif ADD <= op <= NOT_EQUAL:
+                # The remaining binary operators
+                right = pop()
+                operator = tokens[(ip >> 1) - 1]
+                stack[-1] = BINARY[operator.type](operator, stack[-1], right)
+            elif op == NEGATE:
+                runtime.check_number_operand(tokens[(ip >> 1) - 1], stack[-1])
+                stack[-1] = -stack[-1]
+            elif op == NOT:
+                stack[-1] = not is_truthy(stack[-1])
+            elif op == CHECK_NUMBER:
+                runtime.check_number_operand(tokens[(ip >> 1) - 1], stack[-1])
+            elif op == CLOSURE:
+                function = constants[arg]
+                captured = [slots[index] if is_local else cells[index]
+                            for is_local, index, _ in function.captures]
+                memo = None
+                if function.memo is not None:
+                    memo = interpreter.memo_for(function.memo)
+                push(Closure(function, captured, memo))
+            elif op == CLASS:
+                name, count = constants[arg]
+                methods = {}
+                for method in stack[len(stack)-count:]:
+                    methods[method.code.name] = method
+                del stack[len(stack)-count:]
+                push(NebbdyrClass(name.lexeme, methods))
+            elif op == GET_PROPERTY:
+                object = stack[-1]
+                name, cache = constants[arg]
+                if not isinstance(object, NebbdyrInstance):
+                    raise RuntimeException(name, "Only instances have properties")
+                stack[-1] = object.get_cached(name, cache,
+                                              interpreter.property_counters)
+            elif op == SET_PROPERTY:
+                value = pop()
+                object = stack[-1]
+                name = constants[arg]
+                if not isinstance(object, NebbdyrInstance):
+                    raise RuntimeException(name, "Only instances have fields.")
+                object.set(name, value)
+                stack[-1] = None
+            elif op == BUILD_LIST:
+                elements = stack[len(stack)-arg:]
+                del stack[len(stack)-arg:]
+                push(elements)
+            elif op == CHECK_BOUND:
+                runtime.range_bound(tokens[(ip >> 1) - 1], stack[-1],
+                                    BOUNDS[arg])
+            elif op == BUILD_RANGE:
+                stop = pop()
+                second = pop() if arg else None
+                stack[-1] = runtime.construct_list(stack[-1], second, stop)
+            elif op == INDEX:
+                indicies = stack[len(stack)-arg:]
+                del stack[len(stack)-arg:]
+                stack[-1] = runtime.index(tokens[(ip >> 1) - 1], stack[-1],
+                                          indicies)
+            elif op == SLICE:
+                stop = pop()
+                start = pop()
+                stack[-1] = runtime.view(tokens[(ip >> 1) - 1], stack[-1],
+                                         start, stop)
+            elif op == PARALLEL:
+                stmt = constants[arg]
+                count = len(stmt.captures) + len(stmt.targets)
+                values = stack[len(stack)-count:]
+                del stack[len(stack)-count:]
+                captures = values[:len(stmt.captures)]
+                reductions = values[len(stmt.captures):]
+                stack[-1:] = parallel.run(interpreter, stmt, stack[-1],
+                                          captures, reductions)
+            elif op == ITERATE:
+                stack[-1] = runtime.iterate(tokens[(ip >> 1) - 1], stack[-1],
+                                            interpreter)
+            elif op == FOR_NEXT:
+                value = next(pop(), UNASSIGNED)
+                if value is UNASSIGNED:
+                    ip = arg
+                else:
+                    push(value)
+            elif op == AUTO_PARALLEL:
+                stmt = constants[arg]
+                plan = stmt.parallel
+                stores = len(stmt.stores)
+                captures = stores + len(plan.captures)
+                count = captures + len(plan.targets)
+                values = stack[len(stack)-count:]
+                del stack[len(stack)-count:]
+                if interpreter.parallel.auto:
+                    values = parallel.auto(interpreter, plan, stack[-1],
+                                           values[:stores],
+                                           values[stores:captures],
+                                           values[captures:])
+                else:
+                    values = None
+                if values is None:
+                    push(False)
+                else:
+                    stack.extend(values)
+                    push(True)
+            elif op == VECTORIZABLE:
+                push(interpreter.vectorize and vectorize.applies(stack[-1]))
+            elif op == VECTOR:
+                vector = constants[arg].vector
+                count = len(vector.variables)
+                values = stack[len(stack)-count:]
+                del stack[len(stack)-count:]
+                values = vectorize.run(vector, stack[-1], values)
+                if values is None:
+                    push(False)
+                else:
+                    interpreter.vectorized += 1
+                    stack.extend(values)
+                    push(True)
+            elif op == STORE_INDEX:
+                value = pop()
+                index = pop()
+                stack[-1] = runtime.store(tokens[(ip >> 1) - 1], stack[-1],
+                                          index, value)
+            elif op == SPAWN:
+                arguments = stack[len(stack)-arg:]
+                del stack[len(stack)-arg:]
+                paren = tokens[(ip >> 1) - 1]
+                runtime.check_arity(paren, stack[-1], arguments)
+                stack[-1] = parallel.spawn(interpreter, paren, stack[-1],
+                                           arguments)
+            elif op == CRITICAL:
+                if arg == 0:
+                    interpreter.team.enter()
+                    held[0] += 1
+                else:
+                    interpreter.team.exit()
+                    held[0] -= 1
+            elif op == BARRIER:
+                interpreter.team.wait(tokens[(ip >> 1) - 1])
+            elif op == PRINT:
+                print(runtime.stringify(pop()))
+            else:
+                raise RuntimeError("Unknown opcode {}".format(op))
+
+
+class VMInterpreter(Interpreter):
+    """ Executes programs by compiling them to bytecode for the VM """
+    def __init__(self, nebbdyr):
+        super(VMInterpreter, self).__init__(nebbdyr)
+        self.vm = VM(self)
+        self.disassemble = False
+
+    def fork(self):
+        interpreter = super(VMInterpreter, self).fork()
+        interpreter.vm = VM(interpreter)
+        return interpreter
+
+    def interpret(self, statements):
+        code = Compiler().compile(statements)
+        if self.disassemble:
+            print(disassemble(code))
+        try:
+            self.vm.run(code)
+        except RuntimeException as exc:
+            self.nebbdyr.runtime_error(exc)
+        except IndexException as exc:
+            self.nebbdyr.runtime_error(exc)